@@ -0,0 +1,102 @@
+"""
+Benchmark: number of readings and captured transients of the adaptive read interval.
+
+Replays a synthetic 24 h measurement through ls336.lib.adaptive.adaptive_interval: a stable hold with sensor noise,
+set point steps (first order response, time constant TAU), a slow oscillating drift below the rate threshold and
+short heater spikes. Compared to reading at the fixed shortest interval it reports the number of readings,
+the largest deviation of the linearly interpolated adaptive readings from the true sample temperature apart from
+the spikes, the largest deviation at the rising edges of the spikes (a transient starting during a long interval
+is detected up to one interval late, its rising edge is interpolated) and the largest difference of a spike maximum
+and the highest reading of the spike. Fails if the interpolation error apart from the spikes exceeds the temperature
+step threshold of adaptive_interval (spikes shorter than the longest interval can be missed).
+
+usage: python benchmarks/bench_adaptive.py [--hours 24] [--min-interval 0.5] [--max-interval 60]
+"""
+import argparse
+import numpy as np
+
+from ls336.lib.adaptive import adaptive_interval
+from ls336.lib.ls_interface import live_snapshot
+
+# time constant of the sample temperature in s, sensor noise in K
+TAU = 300.
+NOISE = 1e-3
+# amplitude in K and period in s of the drift starting at DRIFT_START s
+DRIFT = 1.
+DRIFT_PERIOD = 3600.
+DRIFT_START = 3 * 3600.
+# readings within SPIKE_WINDOW s of a spike belong to the spike
+SPIKE_WINDOW = 120.
+
+
+def trace(hours):
+    """returns a function t -> (T_sample, T_tip, heater) of a synthetic measurement, the set point change times
+    and the spike times"""
+    _steps = np.arange(2, hours, 6) * 3600.
+    _targets = 4.2 + 5. * (np.arange(len(_steps)) % 2 == 0)
+    _spikes = np.arange(1, hours, 4) * 3600. + 1234.
+
+    def _sample(t):
+        _temperature = 4.2
+        for step, target in zip(_steps, _targets):
+            if t >= step:
+                _temperature = target + (_temperature - target) * np.exp(-(t - step) / TAU)
+        if 0 <= t - DRIFT_START < DRIFT_PERIOD:
+            _temperature += DRIFT * np.sin(2 * np.pi * (t - DRIFT_START) / DRIFT_PERIOD)
+        # 30 s heat pulse, e.g. a helium transfer
+        _temperature += sum(0.5 * np.exp(-((t - spike) / 30.)**2) for spike in _spikes)
+        _heater = 10. * (_temperature - 4.2)
+        return _temperature, 0.8 * _temperature, _heater
+    return _sample, _steps, _spikes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--min-interval", type=float, default=0.5)
+    parser.add_argument("--max-interval", type=float, default=60.)
+    args = parser.parse_args()
+    _random = np.random.default_rng(0)
+    _sample, _steps, _spikes = trace(args.hours)
+    _end = args.hours * 3600
+
+    _schedule = adaptive_interval(args.min_interval, args.max_interval)
+    _times = []
+    _t = 0.
+    _next_step = 0
+    while _t < _end:
+        if _next_step < len(_steps) and _t >= _steps[_next_step]:
+            # set point change
+            _schedule.trigger()
+            _next_step += 1
+        _sample_temperature, _tip_temperature, _heater = _sample(_t)
+        _times.append(_t)
+        _snapshot = live_snapshot(_t, _sample_temperature + _random.normal(0, NOISE),
+                                  _tip_temperature + _random.normal(0, NOISE), _heater)
+        _t += _schedule.update(_snapshot)
+        if _next_step < len(_steps) and _t > _steps[_next_step]:
+            # the worker reads right after a set point change
+            _t = _steps[_next_step]
+
+    _fixed = np.arange(0., _end, args.min_interval)
+    _true = np.array([_sample(t)[0] for t in _fixed])
+    _readings = np.array([_sample(t)[0] for t in _times])
+    _adaptive = np.interp(_fixed, _times, _readings)
+    _times = np.asarray(_times)
+    _peak_errors = [_true[np.abs(_fixed - spike) < SPIKE_WINDOW].max()
+                    - _readings[np.abs(_times - spike) < SPIKE_WINDOW].max() for spike in _spikes]
+    _in_spike = np.any([np.abs(_fixed - spike) < SPIKE_WINDOW for spike in _spikes], axis=0)
+    _errors = np.abs(_adaptive - _true)
+    _error = _errors[~_in_spike].max()
+    _bound = _schedule.temperature_step
+    print(f"fixed {args.min_interval} s readings:  {len(_fixed):10d}")
+    print(f"adaptive readings:        {len(_times):10d}  ({len(_fixed) / len(_times):.1f} x fewer)")
+    print(f"max interpolation error:  {_error * 1e3:10.1f} mK  (bound {_bound * 1e3:.0f} mK)")
+    print(f"max spike edge error:     {_errors[_in_spike].max() * 1e3:10.1f} mK")
+    print(f"max spike peak error:     {max(_peak_errors) * 1e3:10.1f} mK")
+    if _error > _bound:
+        raise SystemExit(f"error exceeds the temperature step {_bound * 1e3:.0f} mK of adaptive_interval")
+
+
+if __name__ == "__main__":
+    main()
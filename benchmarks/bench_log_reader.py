@@ -0,0 +1,67 @@
+"""
+Micro-benchmark: time window queries of a long log file with ls336.lib.log_reader.
+
+Writes a synthetic log of DAYS days at 1 Hz (format version 2) and times queries of windows
+of different length at random positions, raw and resampled to 1 min bins.
+
+usage: python benchmarks/bench_log_reader.py [--days 7] [--queries 50]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+import numpy as np
+
+from ls336.lib.log_writer import log_writer, LIVE_DTYPE
+from ls336.lib.log_reader import open_log
+
+# window lengths in s
+WINDOWS = (60, 3600, 3 * 3600, 86400)
+
+
+def write_log(log_file, days):
+    _n = int(days * 86400)
+    _rows = np.empty(_n, dtype=LIVE_DTYPE)
+    _rows["time"] = 1.6e9 + np.arange(_n)
+    _rows["T_sample"] = 4.2 + 1e-3 * np.sin(np.arange(_n) / 600)
+    _rows["T_tip"] = 3.9
+    _rows["P_heater"] = 12.5
+    writer = log_writer(log_file, block_size=4096)
+    for start in range(0, _n, 4096):
+        for row in _rows[start:start + 4096]:
+            writer.append(row["time"], "live_temp", (row["T_sample"], row["T_tip"], row["P_heater"]))
+    writer.close()
+    return _rows["time"][0], _rows["time"][-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    _random = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _log_file = os.path.join(tmp, "log.hdf5")
+        _first, _last = write_log(_log_file, args.days)
+        print(f"log: {args.days} days, {os.path.getsize(_log_file) / 2**20:.1f} MiB")
+        _start = perf_counter()
+        with open_log(_log_file) as reader:
+            reader.read_live()
+            print(f"full read:              {(perf_counter() - _start) * 1e3:8.1f} ms")
+            for window in WINDOWS:
+                if window > _last - _first:
+                    print(f"window {window:6d} s: skipped, longer than the log")
+                    continue
+                for bin_seconds in (None, 60):
+                    _latencies = []
+                    for start in _random.uniform(_first, _last - window, args.queries):
+                        _start = perf_counter()
+                        reader.query(start, start + window, bin_seconds=bin_seconds)
+                        _latencies.append(perf_counter() - _start)
+                    print(f"window {window:6d} s bins {str(bin_seconds):4s}: "
+                          f"{np.median(_latencies) * 1e3:8.2f} ms median {np.max(_latencies) * 1e3:8.2f} ms max")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: per sample cost of logging live values to hdf5.
+
+Compares the former open/resize/close per sample path of ctrl_ui._logFileUpdate (format version 1)
+with the buffered ls336.lib.log_writer (format version 2) and reports the file sizes.
+
+usage: python benchmarks/bench_log_writer.py [-n SAMPLES] [--block-size N] [--compression gzip|lzf|none]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+import h5py
+
+from ls336.lib.log_writer import log_writer, LIVE_GROUPS
+
+
+def legacy_create(log_file):
+    with h5py.File(log_file, "w") as f:
+        for group in LIVE_GROUPS:
+            _group = f.create_group(group)
+            _group.create_dataset("time", data=[], maxshape=(7e5,), chunks=True)
+            _group.create_dataset("data", data=[], maxshape=(7e5,), chunks=True)
+
+
+def legacy_append(log_file, time_stamp, value):
+    with h5py.File(log_file, "a") as f:
+        for idx, group in enumerate(LIVE_GROUPS):
+            _time = f[f"{group}/time"]
+            _time.resize(_time.shape[0] + 1, axis=0)
+            _time[-1] = time_stamp
+            _value = f[f"{group}/data"]
+            _value.resize(_value.shape[0] + 1, axis=0)
+            _value[-1] = value[idx]
+
+
+def bench_legacy(log_file, n):
+    legacy_create(log_file)
+    _start = perf_counter()
+    for i in range(n):
+        legacy_append(log_file, 1.6e9 + i, (4.2 + 1e-3 * (i % 7), 3.9, 12.5))
+    return perf_counter() - _start
+
+
+def bench_writer(log_file, n, block_size, compression):
+    _start = perf_counter()
+    writer = log_writer(log_file, block_size=block_size, compression=compression)
+    for i in range(n):
+        writer.append(1.6e9 + i, "live_temp", (4.2 + 1e-3 * (i % 7), 3.9, 12.5))
+    writer.close()
+    return perf_counter() - _start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--samples", type=int, default=2000)
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--compression", default="gzip", choices=["gzip", "lzf", "none"])
+    args = parser.parse_args()
+    _compression = None if args.compression == "none" else args.compression
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _legacy_file, _writer_file = os.path.join(tmp, "legacy.hdf5"), os.path.join(tmp, "writer.hdf5")
+        _legacy = bench_legacy(_legacy_file, args.samples)
+        _writer = bench_writer(_writer_file, args.samples, args.block_size, _compression)
+        _legacy_size, _writer_size = os.path.getsize(_legacy_file), os.path.getsize(_writer_file)
+
+    print(f"samples:               {args.samples}")
+    print(f"legacy per sample:     {_legacy / args.samples * 1e6:10.1f} us")
+    print(f"log_writer per sample: {_writer / args.samples * 1e6:10.1f} us")
+    print(f"speed up:              {_legacy / _writer:10.1f} x")
+    print(f"legacy file size:      {_legacy_size:10d} B")
+    print(f"log_writer file size:  {_writer_size:10d} B")
+
+
+if __name__ == "__main__":
+    main()
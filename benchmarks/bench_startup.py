@@ -0,0 +1,120 @@
+"""
+Benchmark: start up time of the UI against the simulated LS336.
+
+Starts the UI in a fresh interpreter (offscreen, LS336_BACKEND=sim) for every run and reports the median over the runs of
+    import     time to import ls336.ui.ls336ui (Qt, pyqtgraph and the ls336 modules)
+    window     time from process start until the window is shown and its first events are processed
+    connected  time from process start until the acquisition worker is connected to the controller
+    history    time from process start until the journal is replayed and the history is shown in the live view
+With --cold the cached compiled form (see ls336.ui.ls336ui.compiled_ui) is removed before every run, so the form
+is compiled with uic again as on the first start after an update of the ui file.
+The log directory of every run holds a log of PRELOAD_HOURS hours at 1 Hz, preloaded into the live view, and the
+journal of a crashed session with JOURNAL_ENTRIES readings, replayed on start.
+
+usage: PYTHONPATH=. python benchmarks/bench_startup.py [--runs 5] [--cold] [--preload-hours 24] [--journal-entries 10000]
+"""
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from ls336.lib.journal import journal_name, write_ahead_journal
+from ls336.lib.log_writer import LIVE_DTYPE, log_file_name, log_writer
+
+# markers printed by the child process
+PHASES = ("import", "window", "connected", "history")
+# runs in the child process, prints "<marker> <epoch time>" lines
+CHILD = """
+import sys, time
+from time import perf_counter
+_start = perf_counter()
+import ls336.ui.ls336ui as ls336ui
+print("import", perf_counter() - _start, flush=True)
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+import ls336.lib.ui_ctrl
+from ls336.lib.ui_ctrl import ctrl_ui
+ls336.lib.ui_ctrl.get_base_path = lambda: sys.argv[1]
+app = QApplication(sys.argv)
+gui = ls336ui.ls336_control()
+gui.show()
+ui = ctrl_ui(gui, 1, preload_hours=float(sys.argv[2]))
+app.processEvents()
+print("window", time.time(), flush=True)
+_pending = {"connected", "history"}
+def _poll():
+    if "connected" in _pending and ui.ls336.instrument is not None:
+        _pending.discard("connected")
+        print("connected", time.time(), flush=True)
+    if "history" in _pending and ui.history is not None and ui.recovered:
+        _pending.discard("history")
+        print("history", time.time(), flush=True)
+    if not _pending:
+        app.quit()
+timer = QTimer(interval=1, timeout=_poll)
+timer.start()
+app.exec()
+"""
+
+
+def write_logs(template_dir, preload_hours, journal_entries):
+    """writes a log of preload_hours hours at 1 Hz ending now and the journal of a crashed session continuing it"""
+    _n = int(preload_hours * 3600)
+    _log_file = log_file_name(template_dir)
+    _times = time.time() - _n - journal_entries + np.arange(_n + journal_entries)
+    _rows = np.zeros(_n, dtype=LIVE_DTYPE)
+    _rows["time"] = _times[:_n]
+    _rows["T_sample"] = 4.2 + 1e-3 * np.sin(np.arange(_n) / 600)
+    writer = log_writer(_log_file, block_size=4096)
+    writer._write_rows(_rows)
+    writer.close()
+    journal = write_ahead_journal(journal_name(_log_file))
+    for time_stamp in _times[_n:]:
+        journal.append(time_stamp, "live_temp", (4.2, 3.9, 12.5))
+    journal.close(remove=False)
+
+
+def start_up(cold, template_dir, preload_hours):
+    """starts the UI once on a copy of the logs in template_dir, returns the seconds until import, window,
+    connected and history"""
+    if cold:
+        for module_file in glob.glob(os.path.join("ls336", "ui", "__pycache__", "ls336ui_ui_*.py")):
+            os.remove(module_file)
+    _environment = dict(os.environ, QT_QPA_PLATFORM="offscreen", LS336_BACKEND="sim")
+    with tempfile.TemporaryDirectory() as log_dir:
+        # the journal is replayed into the log on every start
+        shutil.copytree(template_dir, log_dir, dirs_exist_ok=True)
+        _start = time.time()
+        _output = subprocess.run([sys.executable, "-c", CHILD, log_dir, str(preload_hours)], env=_environment,
+                                 capture_output=True, text=True, timeout=120, check=True).stdout
+    _markers = dict(line.split() for line in _output.splitlines() if line.startswith(PHASES))
+    return {"import": float(_markers["import"]),
+            **{phase: float(_markers[phase]) - _start for phase in PHASES[1:]}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="compile the form with uic on every run")
+    parser.add_argument("--preload-hours", type=float, default=24)
+    parser.add_argument("--journal-entries", type=int, default=10000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as template_dir:
+        write_logs(template_dir, args.preload_hours, args.journal_entries)
+        # compile the form before the warm runs
+        start_up(args.cold, template_dir, args.preload_hours)
+        _results = [start_up(args.cold, template_dir, args.preload_hours) for _ in range(args.runs)]
+    for phase in PHASES:
+        _times = [result[phase] for result in _results]
+        print(f"{phase:10s} median {statistics.median(_times) * 1e3:8.1f} ms   "
+              f"min {min(_times) * 1e3:8.1f} ms   max {max(_times) * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
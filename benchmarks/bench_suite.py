@@ -0,0 +1,206 @@
+"""
+Benchmark suite for the acquisition, logging and plotting hot paths, run against the simulated LS336.
+
+Benchmarks (each for every sample count):
+    acquire   local_intrument.read_live_snapshot
+    log       log file creation (ctrl_ui._createLogFile) and log_writer.append (ctrl_ui._logFileUpdate)
+    tick      acquisition_worker._acquire: snapshot + log entry
+    plot      ctrl_ui._readLiveParameters with a live view holding `samples` samples (needs PyQt5, runs offscreen)
+
+Reported per benchmark: per tick latency percentiles, hdf5 bytes written, number of hdf5 file opens and RSS growth
+(not on Windows).
+
+usage: python benchmarks/bench_suite.py [-n 1000 100000 1000000] [--json results.json] [--skip plot]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter_ns
+import numpy as np
+import h5py
+
+from ls336 import __version__
+from ls336.lib.log_writer import log_writer
+from ls336.lib.ls_interface import local_intrument, live_snapshot
+from ls336.lib.acquisition import acquisition_worker
+
+# number of ticks timed by the plot benchmark
+PLOT_TICKS = 200
+
+
+class counting_file(h5py.File):
+    """h5py.File counting how often a file is opened"""
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        counting_file.opened += 1
+        super().__init__(*args, **kwargs)
+
+
+def rss_bytes():
+    """returns the current resident set size (Linux) or the peak resident set size, None if neither is available
+    (Windows)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    _scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _scale
+
+
+def summarize(name, samples, latencies_ns, rss_start, hdf5_bytes=0, file_opens=0, **extra):
+    _latencies = np.asarray(latencies_ns, dtype=np.float64) / 1e3
+    _result = {
+              "benchmark": name,
+              "samples": samples,
+              "ticks": len(_latencies),
+              "mean_us": float(_latencies.mean()),
+              "p50_us": float(np.percentile(_latencies, 50)),
+              "p90_us": float(np.percentile(_latencies, 90)),
+              "p99_us": float(np.percentile(_latencies, 99)),
+              "max_us": float(_latencies.max()),
+              "hdf5_bytes": hdf5_bytes,
+              "file_opens": file_opens,
+              "rss_growth_bytes": rss_bytes() - rss_start if rss_start is not None else None,
+              }
+    _result.update(extra)
+    return _result
+
+
+def simulated_instrument():
+    _instrument = local_intrument(1, backend="sim")
+    _instrument.instrument.latency = 0.
+    return _instrument
+
+
+def bench_acquire(n, tmp):
+    _instrument = simulated_instrument()
+    _rss = rss_bytes()
+    _latencies = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        _start = perf_counter_ns()
+        _instrument.read_live_snapshot()
+        _latencies[i] = perf_counter_ns() - _start
+    return summarize("acquire", n, _latencies, _rss)
+
+
+def bench_log(n, tmp):
+    _log_file = os.path.join(tmp, f"log_{n}.hdf5")
+    _rss = rss_bytes()
+    counting_file.opened = 0
+    _start = perf_counter_ns()
+    _writer = log_writer(_log_file)
+    _create_us = (perf_counter_ns() - _start) / 1e3
+    _latencies = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        _start = perf_counter_ns()
+        _writer.append(1.6e9 + i, "live_temp", (4.2, 3.9, 12.5))
+        _latencies[i] = perf_counter_ns() - _start
+    _start = perf_counter_ns()
+    _writer.close()
+    _close_us = (perf_counter_ns() - _start) / 1e3
+    return summarize("log", n, _latencies, _rss, os.path.getsize(_log_file), counting_file.opened,
+                     create_us=_create_us, close_us=_close_us)
+
+
+def bench_tick(n, tmp):
+    _log_file = os.path.join(tmp, f"tick_{n}.hdf5")
+    _worker = acquisition_worker(1)
+    _worker.instrument = simulated_instrument()
+    _rss = rss_bytes()
+    counting_file.opened = 0
+    _worker._cmd_open_log(_log_file)
+    _latencies = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        _start = perf_counter_ns()
+        _worker._acquire()
+        _latencies[i] = perf_counter_ns() - _start
+    _worker._cmd_close_log()
+    return summarize("tick", n, _latencies, _rss, os.path.getsize(_log_file), counting_file.opened)
+
+
+def bench_plot(n, tmp):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ["LS336_BACKEND"] = "sim"
+    from PyQt5.QtWidgets import QApplication
+    from ls336.ui.ls336ui import ls336_control
+    from ls336.lib.ui_ctrl import ctrl_ui
+
+    _app = QApplication.instance() or QApplication([])
+    _gui = ls336_control()
+    _gui.resize(1200, 800)
+    _gui.show()
+    _ctrl = ctrl_ui(_gui, 1, live_view_retention=None)
+    _gui.liveViewHeater.enableAutoRange()
+    _rss = rss_bytes()
+
+    # fill the live view up to n samples, then time the ticks
+    _t0 = 1.6e9
+    _fill = max(n - PLOT_TICKS, 0)
+    for i in range(_fill):
+        _ctrl.live_data.append(_t0 + i, (4.2, 3.9, 12.5))
+    _latencies = np.empty(n - _fill, dtype=np.int64)
+    for i in range(n - _fill):
+        _snapshot = live_snapshot(_t0 + _fill + i, 4.2, 3.9, 12.5)
+        _start = perf_counter_ns()
+        _ctrl._readLiveParameters(_snapshot)
+        _app.processEvents()
+        _latencies[i] = perf_counter_ns() - _start
+    _ctrl._shutDown()
+    _gui.close()
+    return summarize("plot", n, _latencies, _rss)
+
+
+BENCHMARKS = {
+             "acquire": bench_acquire,
+             "log": bench_log,
+             "tick": bench_tick,
+             "plot": bench_plot,
+             }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--samples", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(BENCHMARKS))
+    args = parser.parse_args()
+
+    # count every hdf5 file open of this process
+    h5py.File = counting_file
+    _results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, benchmark in BENCHMARKS.items():
+            if name in args.skip:
+                continue
+            for n in args.samples:
+                _result = benchmark(n, tmp)
+                _results.append(_result)
+                _rss = (f"  rss+={_result['rss_growth_bytes'] / 2**20:.1f} MiB"
+                        if _result["rss_growth_bytes"] is not None else "")
+                print(f"{name:8s} n={n:<8d} p50={_result['p50_us']:9.1f} us  p99={_result['p99_us']:9.1f} us  "
+                      f"max={_result['max_us']:10.1f} us  hdf5={_result['hdf5_bytes']:>10d} B  "
+                      f"opens={_result['file_opens']}{_rss}")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({
+                      "version": __version__,
+                      "python": platform.python_version(),
+                      "platform": platform.platform(),
+                      "date": datetime.now().isoformat(),
+                      "results": _results,
+                      }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,123 @@
-from .ui import ls336ui
+import argparse
+import os
 
-ls336ui.main()
\ No newline at end of file
+parser = argparse.ArgumentParser(prog="python -m ls336", description="Lakeshore 336 temperature control interface")
+parser.add_argument("--headless", action="store_true",
+                    help="run acquisition and logging without UI (no Qt required)")
+parser.add_argument("--interval", type=float, default=10,
+                    help="read interval in seconds (headless mode)")
+parser.add_argument("--adaptive", action="store_true",
+                    help="adapt the read interval to the temperature dynamics, between --min-interval and --interval")
+parser.add_argument("--min-interval", type=float, default=0.5,
+                    help="shortest read interval in seconds of the adaptive interval")
+parser.add_argument("--adaptive-rate", type=float, default=1e-2,
+                    help="temperature change in K/s switching to the shortest read interval")
+parser.add_argument("--adaptive-step", type=float, default=0.05,
+                    help="temperature change in K between two readings switching to the shortest read interval")
+parser.add_argument("--adaptive-heater-step", type=float, default=2.,
+                    help="heater output change in percent between two readings switching to the shortest read interval")
+parser.add_argument("--log-dir", default=os.getcwd(),
+                    help="directory of the hdf5 log files (headless mode)")
+parser.add_argument("--heater-channel", type=int, default=1,
+                    help="heater output of the LS336, default of --device without :HEATER_CHANNEL")
+parser.add_argument("--device", action="append", default=[],
+                    help="controller as NAME=SERIAL_NUMBER[:HEATER_CHANNEL] or NAME=COM_PORT[:HEATER_CHANNEL], "
+                         "repeat for several controllers (headless mode, the UI uses the first one)")
+parser.add_argument("--shared-log", action="store_true",
+                    help="log all controllers into one file with one group per controller (headless mode)")
+parser.add_argument("--rotate-hours", type=float, default=None,
+                    help="start a new log file every ROTATE_HOURS hours")
+parser.add_argument("--rotate-mb", type=float, default=None,
+                    help="start a new log file when the log file exceeds ROTATE_MB MB")
+parser.add_argument("--compress-finished", action="store_true",
+                    help="compress finished log files of a rotated log in the background")
+parser.add_argument("--log-compression", choices=("deadband", "swinging-door"), default=None,
+                    help="log only the readings needed to reproduce all readings within --log-deviation")
+parser.add_argument("--log-deviation", default="0.002,0.002,0.5",
+                    help="deviation of the compressed log as T_SAMPLE,T_TIP,P_HEATER in K, K and percent")
+parser.add_argument("--log-keepalive", type=float, default=600.,
+                    help="longest time in seconds between two entries of the compressed log")
+parser.add_argument("--no-journal", action="store_true",
+                    help="write the log files directly instead of through a crash safe write ahead journal")
+parser.add_argument("--preload-hours", type=float, default=None,
+                    help="show the last PRELOAD_HOURS hours of the latest log in the live view on startup (UI)")
+parser.add_argument("--control-port", type=int, default=None,
+                    help="share the controller with other programs through a server on CONTROL_HOST:PORT")
+parser.add_argument("--control-host", default="127.0.0.1",
+                    help="address of the server opened with --control-port (default: localhost only)")
+parser.add_argument("--metrics-port", type=int, default=None,
+                    help="export latencies and error counts in the prometheus text format on CONTROL_HOST:PORT/metrics")
+parser.add_argument("--metrics-json", default=None,
+                    help="write latencies and error counts to the JSON file METRICS_JSON every --metrics-interval seconds")
+parser.add_argument("--metrics-interval", type=float, default=10.,
+                    help="seconds between two writes of --metrics-json")
+parser.add_argument("--recipe", default=None,
+                    help="run the recipe (YAML/JSON file of set point ramps, dwells, heater range and PID changes) "
+                         "on startup, on the first controller")
+parser.add_argument("--simulate", action="store_true",
+                    help="use a simulated LS336 instead of the hardware (same as LS336_BACKEND=sim)")
+subcommands = parser.add_subparsers(dest="command", metavar="COMMAND")
+export_parser = subcommands.add_parser("export", help="export log files as CSV or Parquet tables",
+                                       description="Exports hdf5 log files as tables of the live values with the "
+                                                   "set point, heater range and PID values in effect at every reading")
+export_parser.add_argument("logs", nargs="+", metavar="LOG",
+                           help="hdf5 log file or index file (*.json) of a rotated log")
+export_parser.add_argument("--format", choices=("csv", "parquet"), default="csv",
+                           help="output format, parquet requires pyarrow")
+export_parser.add_argument("--out-dir", default=None,
+                           help="directory of the exported files (default: next to the log files)")
+export_parser.add_argument("--jobs", type=int, default=1,
+                           help="number of log files exported in parallel")
+export_parser.add_argument("--block-rows", type=int, default=65536,
+                           help="rows read and written at a time, bounds the memory used")
+analyze_parser = subcommands.add_parser("analyze", help="score the control loop per set point step of log files",
+                                        description="Prints settling time, overshoot, steady state error and heater "
+                                                    "output noise of every set point step of hdf5 log files")
+analyze_parser.add_argument("logs", nargs="+", metavar="LOG",
+                            help="hdf5 log file or index file (*.json) of a rotated log")
+analyze_parser.add_argument("--tolerance", type=float, default=0.01,
+                            help="settled within TOLERANCE K of the set point")
+analyze_parser.add_argument("--merge", type=float, default=60.,
+                            help="set point changes less than MERGE s apart (ramps) belong to one step")
+args = parser.parse_args()
+if args.shared_log and (args.rotate_hours is not None or args.rotate_mb is not None):
+    parser.error("--shared-log can not be combined with --rotate-hours / --rotate-mb")
+try:
+    from .lib.log_compression import change_compression_options
+    _change_compression = change_compression_options(args)
+except ValueError as e:
+    parser.error(str(e))
+_recipe = None
+if args.recipe is not None:
+    from .lib.recipe import load_recipe, RecipeError
+    try:
+        _recipe = load_recipe(args.recipe)
+    except (OSError, RecipeError) as e:
+        parser.error(f"Recipe {args.recipe} not loaded: {e}")
+
+if args.simulate:
+    os.environ["LS336_BACKEND"] = "sim"
+
+if args.command == "export":
+    from .lib import log_export
+    log_export.main(args)
+elif args.command == "analyze":
+    from .lib import pid_analytics
+    pid_analytics.main(args)
+elif args.headless:
+    from .lib import daemon
+    daemon.main(args, _recipe)
+else:
+    from .ui import ls336ui
+    if args.device:
+        from .lib.controller_manager import parse_device
+        _device = parse_device(args.device[0], args.heater_channel)
+    else:
+        _device = {"heater_channel": args.heater_channel, "serial_number": None, "com_port": None}
+    from .lib.adaptive import adaptive_options
+    ls336ui.main(_device["heater_channel"], _device["serial_number"], _device["com_port"],
+                 rotate_hours=args.rotate_hours, rotate_mb=args.rotate_mb, compress_finished=args.compress_finished,
+                 preload_hours=args.preload_hours, adaptive=adaptive_options(args),
+                 change_compression=_change_compression, control_port=args.control_port,
+                 control_host=args.control_host, metrics_port=args.metrics_port, metrics_json=args.metrics_json,
+                 metrics_interval=args.metrics_interval, recipe=_recipe, journal=not args.no_journal)
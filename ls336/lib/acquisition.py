@@ -0,0 +1,383 @@
+import threading
+import queue
+from concurrent.futures import Future
+from time import monotonic, time
+from ls336.lib.ls_interface import local_intrument
+from ls336.lib.log_writer import log_writer, rotating_log_writer
+from ls336.lib.metrics import registry
+from ls336.lib.pid_analytics import loop_analyzer
+
+# log mode -> getter of local_intrument
+SETTING_GETTERS = {
+                  "set_point": "get_setpoint",
+                  "heater_mode": "get_heater_range",
+                  "pid": "get_heater_pid",
+                  }
+# log mode -> setter of local_intrument
+SETTING_SETTERS = {
+                  "set_point": "set_setpoint",
+                  "heater_mode": "set_heater_range",
+                  "pid": "set_heater_pid",
+                  }
+
+
+class acquisition_worker(threading.Thread):
+    """Thread owning the connection to the ls336 temperature controller.
+
+    The worker polls the live values every self.interval seconds, writes them to the log file and
+    executes all setting reads and writes in the order they were submitted. Results are handed out
+    through the callbacks, which are called from the worker thread:
+
+        on_sample(snapshot)        snapshot: live_snapshot (time, sample_temperature, tip_temperature, heater_power)
+        on_setting(mode, value)    mode: "set_point", "heater_mode", "pid" or "loop_metrics"
+        on_error(exception)
+        on_connected()
+
+    Commands are queued by the public methods, which return a concurrent.futures.Future of the result.
+
+    The control loop is scored per set point step on the polled readings (loop_analyzer), the metrics of every
+    finished step are logged (group "PID_performance") and passed to on_setting("loop_metrics", metrics dict).
+
+    With an adaptive_interval schedule (set_adaptive), the poll interval follows the temperature dynamics
+    and is reset to its minimum after every set point or heater range change.
+
+    The durations of the tick phases "acquire" (controller read) and "log" are recorded in the histogram
+    ls336_tick_seconds{phase} of metrics.registry, ticks missed because a tick took longer than the
+    interval in the counter ls336_tick_overruns_total.
+    """
+    def __init__(self, heater_channel, interval=10., on_sample=None, on_setting=None, on_error=None,
+                 on_connected=None, serial_number=None, com_port=None, name="ls336"):
+        super().__init__(name=f"{name} acquisition", daemon=True)
+        self.heater_channel = heater_channel
+        self.serial_number = serial_number
+        self.com_port = com_port
+        self.interval = interval
+        self.adaptive = None
+        self.instrument = None
+        self.log_writer = None
+        self.on_sample = on_sample
+        self.on_setting = on_setting
+        self.on_error = on_error
+        self.on_connected = on_connected
+        # latest reading (live_snapshot), None before the first reading
+        self.latest_snapshot = None
+        self.loop_analyzer = loop_analyzer()
+        self._commands = queue.Queue()
+        self._polling = False
+        self._next_tick = monotonic()
+
+### Properties
+
+    @property
+    def polling(self):
+        """Returns True while the live values are polled
+
+        Returns:
+            bool: polling state
+        """
+        return self._polling
+
+### Methods
+
+    def submit(self, command, *args):
+        """queues a command for execution in the worker thread
+
+        Args:
+            command (string): name of a _cmd_* method, e.g. "read_setting" or "write_setting"
+            *args: arguments of the command
+
+        Returns:
+            concurrent.futures.Future: resolves to the return value of the command or its exception
+        """
+        _future = Future()
+        self._commands.put((command, args, _future))
+        return _future
+
+    def read_setting(self, mode):
+        """queues a read of a controller setting, the result is passed to on_setting and logged.
+        Settings are read from the settings cache of local_intrument while they are younger than their TTL
+
+        Args:
+            mode (string): "set_point", "heater_mode" or "pid"
+        """
+        return self.submit("read_setting", mode)
+
+    def refresh_settings(self):
+        """queues a read of all settings from the controller bypassing the settings cache (one compound query),
+        every setting is passed to on_setting and logged
+        """
+        return self.submit("refresh_settings")
+
+    def write_setting(self, mode, value):
+        """queues a write of a controller setting, the read back value is passed to on_setting and logged
+
+        Args:
+            mode (string): "set_point", "heater_mode" or "pid"
+            value (misc): setpoint (float), heater range ('OFF', 'LO', 'MID', 'HI') or 3-tuple of floats (P, I, D)
+        """
+        return self.submit("write_setting", mode, value)
+
+    def apply_settings(self, setpoint=None, heater_range=None, pid_values=None):
+        """queues a batched write of several settings (see local_intrument.apply_settings),
+        every written setting is passed to on_setting and logged
+
+        Args:
+            setpoint (float): temperature setpoint in Kelvin
+            heater_range (string): ('OFF', 'LO', 'MID', 'HI')
+            pid_values (3-tuple of floats): (P, I, D)
+        """
+        return self.submit("apply_settings", setpoint, heater_range, pid_values)
+
+    def acquire(self):
+        """queues a single reading of the live values, it is logged and passed to on_sample
+
+        Returns:
+            concurrent.futures.Future: resolves to the live_snapshot (None if the reading failed)
+        """
+        return self.submit("acquire")
+
+    def loop_metrics(self):
+        """requests the metrics of the current set point step up to the latest reading (see loop_analyzer)"""
+        return self.submit("loop_metrics")
+
+    def log_entry(self, mode, value):
+        """queues a log entry written in the worker thread (see log_writer.append), e.g. the state of a recipe
+
+        Args:
+            mode (string): log mode, e.g. "recipe"
+            value (misc): value of the log entry
+        """
+        return self.submit("log_entry", mode, value)
+
+    def start_polling(self):
+        """starts polling the live values"""
+        return self.submit("start_polling")
+
+    def stop_polling(self):
+        """stops polling the live values and writes buffered values to the log file"""
+        return self.submit("stop_polling")
+
+    def set_interval(self, interval):
+        """sets the fixed poll interval (used while no adaptive schedule is set)
+
+        Args:
+            interval (float): poll interval in seconds
+        """
+        return self.submit("set_interval", interval)
+
+    def set_adaptive(self, schedule):
+        """enables or disables the adaptive poll interval
+
+        Args:
+            schedule (adaptive_interval): schedule of the poll interval, None for the fixed interval of set_interval
+        """
+        return self.submit("set_adaptive", schedule)
+
+    def open_log(self, log_file, group=None, shared_file=None, change_compression=None, journal=True):
+        """closes the current log file and creates a new one
+
+        Args:
+            log_file (string): path of the hdf5 log file to be created
+            group (string): optional group of the log file holding all log entries of this worker
+            shared_file (h5py.File): optional open log file shared with other workers, log_file is not created
+            change_compression (dict): optional keyword arguments of change_compressor for the live values
+            journal (bool): write the entries through a write ahead journal, the hdf5 file is written in the background
+        """
+        return self.submit("open_log", log_file, group, shared_file, change_compression, journal)
+
+    def open_rotating_log(self, save_path, device=None, rotate_hours=None, rotate_mb=None, compress_finished=False,
+                          change_compression=None, journal=True):
+        """closes the current log file and starts a log rotated into several files (see rotating_log_writer)
+
+        Args:
+            save_path (string): directory of the log files
+            device (string): optional device name added to the file names
+            rotate_hours (float): hours of live values per file, None for no time based rotation
+            rotate_mb (float): maximum file size in MB, None for no size based rotation
+            compress_finished (bool): compress finished files in the background
+            change_compression (dict): optional keyword arguments of change_compressor for the live values
+            journal (bool): write the entries through a write ahead journal, the hdf5 file is written in the background
+        """
+        return self.submit("open_rotating_log", save_path, device, rotate_hours, rotate_mb, compress_finished,
+                           change_compression, journal)
+
+    def close_log(self):
+        """closes the current log file"""
+        return self.submit("close_log")
+
+    def shutdown(self):
+        """stops the worker after all queued commands are executed, closes the log file"""
+        return self.submit("shutdown")
+
+    def run(self):
+        try:
+            self.instrument = local_intrument(self.heater_channel, serial_number=self.serial_number,
+                                              com_port=self.com_port)
+        except Exception as e:
+            self._report(e)
+            # fail all commands until shutdown
+            while True:
+                command, args, future = self._commands.get()
+                if command == "shutdown":
+                    future.set_result(None)
+                    return
+                future.set_exception(e)
+        if self.on_connected is not None:
+            self.on_connected()
+
+        while True:
+            _timeout = max(0., self._next_tick - monotonic()) if self._polling else None
+            try:
+                command, args, future = self._commands.get(timeout=_timeout)
+            except queue.Empty:
+                command = None
+
+            if command == "shutdown":
+                break
+            elif command is not None:
+                try:
+                    future.set_result(getattr(self, f"_cmd_{command}")(*args))
+                except Exception as e:
+                    self._report(e)
+                    future.set_exception(e)
+
+            if self._polling and monotonic() >= self._next_tick:
+                _snapshot = self._acquire()
+                if self.adaptive is not None and _snapshot is not None:
+                    self.interval = self.adaptive.update(_snapshot)
+                # keep a steady cadence, skip ticks that are already missed
+                self._next_tick += self.interval
+                if self._next_tick <= monotonic():
+                    registry.count("ls336_tick_overruns_total")
+                    self._next_tick = monotonic() + self.interval
+
+        self._cmd_close_log()
+        future.set_result(None)
+
+    def _report(self, error):
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def _acquire(self):
+        """reads the live values, logs them and passes them to on_sample, returns the snapshot (None on failure)"""
+        try:
+            with registry.timer("ls336_tick_seconds", phase="acquire"):
+                _snapshot = self.instrument.read_live_snapshot()
+        except Exception as e:
+            self._report(e)
+            return None
+        self.latest_snapshot = _snapshot
+        if self.log_writer is not None:
+            with registry.timer("ls336_tick_seconds", phase="log"):
+                self.log_writer.append(_snapshot.time, "live_temp", _snapshot[1:])
+        self.loop_analyzer.add(_snapshot.time, _snapshot[1:])
+        if self.on_sample is not None:
+            self.on_sample(_snapshot)
+        return _snapshot
+
+    def _speed_up(self):
+        """polls fast after a change of the controller settings (adaptive interval only)"""
+        if self.adaptive is None:
+            return
+        self.interval = self.adaptive.trigger()
+        self._next_tick = min(self._next_tick, monotonic() + self.interval)
+
+    def _publish_setting(self, mode, value):
+        _time = time()
+        if self.log_writer is not None:
+            self.log_writer.append(_time, mode, value.name if mode == "heater_mode" else value)
+        if self.on_setting is not None:
+            self.on_setting(mode, value)
+        if mode == "set_point":
+            _finished = self.loop_analyzer.set_point(_time, value)
+            if _finished is not None:
+                self._publish_loop_metrics(*_finished)
+        return value
+
+    def _publish_loop_metrics(self, start, metrics):
+        """logs the metrics of a finished set point step at the time the step started"""
+        if self.log_writer is not None:
+            self.log_writer.append(start, "loop_metrics", tuple(metrics.values()))
+        if self.on_setting is not None:
+            self.on_setting("loop_metrics", metrics)
+
+    def _cmd_read_setting(self, mode):
+        return self._publish_setting(mode, getattr(self.instrument, SETTING_GETTERS[mode]))
+
+    def _cmd_refresh_settings(self):
+        _settings = self.instrument.refresh_settings()
+        for mode, value in _settings.items():
+            self._publish_setting(mode, value)
+        return _settings
+
+    def _cmd_write_setting(self, mode, value):
+        if mode in ("set_point", "heater_mode"):
+            self._speed_up()
+        try:
+            _value = getattr(self.instrument, SETTING_SETTERS[mode])(value)
+        except Exception:
+            # show the value the controller actually uses before reporting the failure
+            self._cmd_read_setting(mode)
+            raise
+        return self._publish_setting(mode, _value)
+
+    def _cmd_apply_settings(self, setpoint, heater_range, pid_values):
+        _written = [mode for mode, value in zip(("set_point", "heater_mode", "pid"), (setpoint, heater_range, pid_values))
+                    if value is not None]
+        if setpoint is not None or heater_range is not None:
+            self._speed_up()
+        try:
+            _settings = self.instrument.apply_settings(setpoint, heater_range, pid_values)
+        except Exception:
+            # show the values the controller actually uses before reporting the failure
+            for mode in _written:
+                self._cmd_read_setting(mode)
+            raise
+        for mode in _written:
+            self._publish_setting(mode, _settings[mode])
+        return _settings
+
+    def _cmd_acquire(self):
+        return self._acquire()
+
+    def _cmd_loop_metrics(self):
+        return self.loop_analyzer.metrics()
+
+    def _cmd_log_entry(self, mode, value):
+        if self.log_writer is not None:
+            self.log_writer.append(time(), mode, value)
+
+    def _cmd_start_polling(self):
+        self._polling = True
+        self._next_tick = monotonic()
+
+    def _cmd_stop_polling(self):
+        self._polling = False
+        if self.log_writer is not None:
+            self.log_writer.flush()
+
+    def _cmd_set_interval(self, interval):
+        self.interval = interval
+
+    def _cmd_set_adaptive(self, schedule):
+        self.adaptive = schedule
+        if schedule is not None:
+            self.interval = schedule.trigger()
+            self._next_tick = min(self._next_tick, monotonic() + self.interval)
+
+    def _cmd_open_log(self, log_file, group=None, shared_file=None, change_compression=None, journal=True):
+        self._cmd_close_log()
+        self.log_writer = log_writer(log_file, group=group, shared_file=shared_file,
+                                     change_compression=change_compression, journal=journal)
+
+    def _cmd_open_rotating_log(self, save_path, device, rotate_hours, rotate_mb, compress_finished,
+                               change_compression=None, journal=True):
+        self._cmd_close_log()
+        self.log_writer = rotating_log_writer(save_path, device, rotate_hours, rotate_mb, compress_finished,
+                                              change_compression=change_compression, journal=journal)
+        return self.log_writer.index_file
+
+    def _cmd_close_log(self):
+        if self.log_writer is not None:
+            self.log_writer.close()
+            self.log_writer = None
@@ -0,0 +1,100 @@
+def adaptive_options(args):
+    """returns the keyword arguments of adaptive_interval given on the command line
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments of python -m ls336
+
+    Returns:
+        dict: keyword arguments, None if the adaptive interval is not enabled
+    """
+    if not args.adaptive:
+        return None
+    return {
+           "min_interval": args.min_interval,
+           "max_interval": args.interval,
+           "temperature_rate": args.adaptive_rate,
+           "temperature_step": args.adaptive_step,
+           "heater_step": args.adaptive_heater_step,
+           }
+
+
+class adaptive_interval():
+    """Poll interval following the temperature dynamics.
+
+    After every reading the interval is set to min_interval if the sample or tip temperature changed by at least
+    temperature_step (K) or temperature_rate (K/s), or the heater output by at least heater_step (% of full scale),
+    since the previous reading. Temperature changes below temperature_noise (K) are sensor noise and never count.
+    Otherwise the interval grows by the factor backoff up to max_interval, but at most until the temperature,
+    changing at the slope of the last two readings, moves by half of temperature_step (a full step would count as
+    changing): slow drifts below the thresholds are still read about every temperature_step / 2 K, so linearly
+    interpolated readings stay within temperature_step of a temperature that keeps its slope between two readings.
+    trigger() (called after set point and heater range changes) keeps the interval at min_interval for hold seconds.
+    """
+    def __init__(self, min_interval=0.5, max_interval=60., temperature_rate=1e-2, temperature_step=0.05,
+                 heater_step=2., backoff=2., hold=60., temperature_noise=5e-3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.temperature_rate = temperature_rate
+        self.temperature_step = temperature_step
+        self.heater_step = heater_step
+        self.temperature_noise = temperature_noise
+        self.backoff = backoff
+        self.hold = hold
+        self.interval = min_interval
+        self._last = None
+        # the hold time starts with the next reading (time stamps of the readings are used as clock)
+        self._triggered = True
+        self._fast_until = 0.
+
+### Methods
+
+    def trigger(self):
+        """switches to min_interval for the next hold seconds
+
+        Returns:
+            float: poll interval in seconds
+        """
+        self._triggered = True
+        self.interval = self.min_interval
+        return self.interval
+
+    def _temperature_change(self, snapshot):
+        """returns the change of the sample or tip temperature since the previous reading, 0 within the noise"""
+        _temperature_change = max(abs(snapshot.sample_temperature - self._last.sample_temperature),
+                                  abs(snapshot.tip_temperature - self._last.tip_temperature))
+        return _temperature_change if _temperature_change >= self.temperature_noise else 0.
+
+    def _changing(self, snapshot):
+        """returns True if snapshot differs from the previous reading by more than the thresholds"""
+        if self._last is None:
+            return True
+        _temperature_change = self._temperature_change(snapshot)
+        _elapsed = snapshot.time - self._last.time
+        return (_temperature_change >= self.temperature_step
+                or (_elapsed > 0 and _temperature_change / _elapsed >= self.temperature_rate)
+                or abs(snapshot.heater_power - self._last.heater_power) >= self.heater_step)
+
+    def update(self, snapshot):
+        """returns the poll interval after snapshot
+
+        Args:
+            snapshot (live_snapshot): latest reading
+
+        Returns:
+            float: poll interval in seconds
+        """
+        if self._triggered:
+            self._triggered = False
+            self._fast_until = snapshot.time + self.hold
+        if self._changing(snapshot) or snapshot.time < self._fast_until:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            _elapsed = snapshot.time - self._last.time
+            _temperature_change = self._temperature_change(snapshot)
+            if _elapsed > 0 and _temperature_change > 0:
+                # predicted change until the next reading: slope * interval <= temperature_step / 2
+                _limit = 0.5 * self.temperature_step * _elapsed / _temperature_change
+                self.interval = max(self.min_interval, min(self.interval, _limit))
+        self._last = snapshot
+        return self.interval
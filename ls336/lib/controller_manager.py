@@ -0,0 +1,175 @@
+import atexit
+from concurrent.futures import wait
+from functools import partial
+from ls336.lib.acquisition import acquisition_worker
+from ls336.lib.adaptive import adaptive_interval
+from ls336.lib.log_writer import log_file_name, log_index_name
+
+
+def parse_device(text, heater_channel=1):
+    """parses a device given as NAME=SERIAL_NUMBER[:HEATER_CHANNEL] or NAME=COM_PORT[:HEATER_CHANNEL]
+
+    Values starting with "COM" or "/dev/" are com ports, everything else is a serial number.
+    Without "NAME=" the serial number / com port is used as name.
+
+    Args:
+        text (string): device specification, e.g. "cryo=LSA1234:2" or "cryo=COM3:2"
+        heater_channel (int): heater output of devices without ":HEATER_CHANNEL"
+
+    Returns:
+        dict: {"name": string, "serial_number": string or None, "com_port": string or None, "heater_channel": int}
+    """
+    _name, _, _address = text.rpartition("=")
+    _heater_channel = heater_channel
+    if ":" in _address and _address.rsplit(":", 1)[1].isdigit():
+        _address, _channel = _address.rsplit(":", 1)
+        _heater_channel = int(_channel)
+    _is_port = _address.upper().startswith("COM") or _address.startswith("/dev/")
+    return {
+           "name": _name or _address,
+           "serial_number": None if _is_port else _address,
+           "com_port": _address if _is_port else None,
+           "heater_channel": _heater_channel,
+           }
+
+
+class controller_manager():
+    """Runs one acquisition_worker per LS336, so all controllers are polled concurrently and the cycle time
+    is bounded by the slowest controller.
+
+    devices is a list of dicts as returned by parse_device. The callbacks get the device name as first argument:
+        on_sample(name, snapshot), on_setting(name, mode, value), on_error(name, exception), on_connected(name)
+    """
+    def __init__(self, devices, interval=10., on_sample=None, on_setting=None, on_error=None, on_connected=None):
+        self.workers = {}
+        self.log_files = {}
+        self._shared_file = None
+        for device in devices:
+            _name = device["name"]
+            if _name in self.workers:
+                raise ValueError(f"Device name {_name} is used twice")
+            self.workers[_name] = acquisition_worker(
+                                  device.get("heater_channel", 1), interval,
+                                  on_sample=partial(on_sample, _name) if on_sample is not None else None,
+                                  on_setting=partial(on_setting, _name) if on_setting is not None else None,
+                                  on_error=partial(on_error, _name) if on_error is not None else None,
+                                  on_connected=partial(on_connected, _name) if on_connected is not None else None,
+                                  serial_number=device.get("serial_number"),
+                                  com_port=device.get("com_port"),
+                                  name=_name)
+
+### Properties
+
+    @property
+    def names(self):
+        """Returns the device names
+
+        Returns:
+            list of strings: device names in the order given
+        """
+        return list(self.workers)
+
+### Methods
+
+    def start(self):
+        """starts all workers, every worker connects to its controller"""
+        for worker in self.workers.values():
+            worker.start()
+
+    def open_logs(self, log_dir, shared=False, rotate_hours=None, rotate_mb=None, compress_finished=False,
+                  change_compression=None, journal=True):
+        """creates the log files, one per device or one shared file with a group per device
+
+        Args:
+            log_dir (string): directory of the log files
+            shared (bool): log all devices into one file
+            rotate_hours (float): start a new file per device after rotate_hours hours (see rotating_log_writer)
+            rotate_mb (float): start a new file per device when the file exceeds rotate_mb MB
+            compress_finished (bool): compress finished files of rotated logs
+            change_compression (dict): optional keyword arguments of change_compressor for the live values
+            journal (bool): write the log entries through write ahead journals (see log_writer)
+
+        Raises:
+            ValueError: Is raised if a shared log is to be rotated
+
+        Returns:
+            dict: device name -> log file path (index file path of rotated logs)
+        """
+        _rotate = rotate_hours is not None or rotate_mb is not None
+        if shared and _rotate:
+            raise ValueError("Shared log files can not be rotated")
+        self.close_logs()
+        if _rotate:
+            for name, worker in self.workers.items():
+                self.log_files[name] = log_index_name(log_dir, name)
+                worker.open_rotating_log(log_dir, name, rotate_hours, rotate_mb, compress_finished, change_compression,
+                                         journal)
+            return dict(self.log_files)
+        if shared:
+            _log_file = log_file_name(log_dir)
+            import h5py
+            self._shared_file = h5py.File(_log_file, "w")
+            atexit.register(self._close_shared_file)
+        for name, worker in self.workers.items():
+            if shared:
+                self.log_files[name] = _log_file
+                worker.open_log(_log_file, group=name, shared_file=self._shared_file,
+                                change_compression=change_compression, journal=journal)
+            else:
+                self.log_files[name] = log_file_name(log_dir, name)
+                worker.open_log(self.log_files[name], change_compression=change_compression, journal=journal)
+        return dict(self.log_files)
+
+    def close_logs(self):
+        """closes all log files after the workers wrote their buffered values"""
+        wait([worker.close_log() for worker in self.workers.values() if worker.is_alive()])
+        self._close_shared_file()
+        self.log_files = {}
+
+    def _close_shared_file(self):
+        if self._shared_file is not None:
+            self._shared_file.close()
+            self._shared_file = None
+            atexit.unregister(self._close_shared_file)
+
+    def read_settings(self):
+        """requests set point, heater range and PID values of all devices from the controllers"""
+        for worker in self.workers.values():
+            worker.refresh_settings()
+
+    def start_polling(self):
+        """starts polling the live values of all devices"""
+        for worker in self.workers.values():
+            worker.start_polling()
+
+    def stop_polling(self):
+        """stops polling the live values of all devices"""
+        for worker in self.workers.values():
+            worker.stop_polling()
+
+    def set_interval(self, interval):
+        """sets the poll interval of all devices
+
+        Args:
+            interval (float): poll interval in seconds
+        """
+        for worker in self.workers.values():
+            worker.set_interval(interval)
+
+    def set_adaptive(self, options):
+        """enables the adaptive poll interval of all devices, every device gets its own schedule
+
+        Args:
+            options (dict): keyword arguments of adaptive_interval, None for the fixed poll interval
+        """
+        for worker in self.workers.values():
+            worker.set_adaptive(adaptive_interval(**options) if options is not None else None)
+
+    def shutdown(self):
+        """stops all workers and closes all log files"""
+        self.close_logs()
+        for worker in self.workers.values():
+            worker.shutdown()
+        for worker in self.workers.values():
+            if worker.is_alive():
+                worker.join()
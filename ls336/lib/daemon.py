@@ -0,0 +1,163 @@
+import logging
+import signal
+import threading
+from os import makedirs
+from ls336.lib.adaptive import adaptive_options
+from ls336.lib.log_compression import change_compression_options
+from ls336.lib.controller_manager import controller_manager, parse_device
+from ls336.lib.journal import replay_journals
+from ls336.lib.metrics import metrics_exporter, registry
+from ls336.lib.recipe import recipe_runner
+from ls336.lib.server import instrument_server
+
+logger = logging.getLogger("ls336")
+# seconds between two metrics summaries in the log
+METRICS_LOG_INTERVAL = 3600.
+
+
+class acquisition_daemon():
+    """Headless acquisition without Qt: polls the controllers and logs to hdf5 until SIGINT/SIGTERM.
+
+    devices is a list of dicts as returned by controller_manager.parse_device, every controller is polled by
+    its own worker and logged to its own file (or its own group of a shared file with shared_log).
+    With rotate_hours / rotate_mb the log of every controller is split into several files (see rotating_log_writer).
+    adaptive (keyword arguments of adaptive_interval) enables the adaptive poll interval,
+    change_compression (keyword arguments of change_compressor) the change based compression of the live values.
+    With journal, the log entries are written through write ahead journals (see log_writer), journals left in
+    log_dir by a crashed process are replayed into their log files on start.
+
+    With control_port the controllers are shared with other programs by an instrument_server on
+    control_host:control_port (see instrument_server for the protocol).
+    metrics (keyword arguments of metrics_exporter) exports the latencies and error counts of metrics.registry,
+    a summary is logged every hour.
+    recipe (see load_recipe) is run on the first controller once acquisition started, acquisition continues
+    after the recipe.
+    """
+    def __init__(self, devices, interval, log_dir, control_port=None, shared_log=False, rotate_hours=None,
+                 rotate_mb=None, compress_finished=False, adaptive=None, change_compression=None,
+                 control_host="127.0.0.1", metrics=None, recipe=None, journal=True):
+        self.interval = interval
+        self.log_dir = log_dir
+        self.control_port = control_port
+        self.control_host = control_host
+        self.shared_log = shared_log
+        self.rotate_hours = rotate_hours
+        self.rotate_mb = rotate_mb
+        self.compress_finished = compress_finished
+        self.adaptive = adaptive
+        self.change_compression = change_compression
+        self.journal = journal
+        self.metrics_exporter = metrics_exporter(**metrics) if metrics is not None else None
+        self.recipe = recipe
+        self.recipe_runner = None
+        self.latest = {}
+        self._stop = threading.Event()
+        self._server = None
+        self.manager = controller_manager(devices, interval,
+                                          on_sample=self._receive_sample,
+                                          on_setting=self._receive_setting,
+                                          on_error=self._receive_error,
+                                          on_connected=self._receive_connected)
+
+### Methods
+
+    def run(self):
+        """starts acquisition and logging, blocks until stop() is called or SIGINT/SIGTERM is received"""
+        for _signal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(_signal, lambda *args: self.stop())
+
+        makedirs(self.log_dir, exist_ok=True)
+        replay_journals(self.log_dir)
+        self.manager.start()
+        for name, log_file in self.manager.open_logs(self.log_dir, self.shared_log, self.rotate_hours,
+                                                     self.rotate_mb, self.compress_finished,
+                                                     self.change_compression, self.journal).items():
+            logger.info(f"{name}: logging to {log_file}")
+        self.manager.read_settings()
+        if self.adaptive is not None:
+            self.manager.set_adaptive(self.adaptive)
+        self.manager.start_polling()
+
+        if self.control_port is not None:
+            self._server = instrument_server(self.manager.workers, self.control_port, self.control_host)
+            self._server.start()
+
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.start()
+        if self.recipe is not None:
+            self.recipe_runner = recipe_runner(self.manager.workers[self.manager.names[0]], self.recipe,
+                                               on_state=self._receive_recipe_state)
+            self.recipe_runner.start()
+
+        while not self._stop.wait(METRICS_LOG_INTERVAL):
+            logger.info(registry.summary())
+
+        if self.recipe_runner is not None:
+            self.recipe_runner.abort()
+            self.recipe_runner.join(5)
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        if self._server is not None:
+            self._server.stop()
+        self.manager.shutdown()
+        logger.info("Stopped")
+
+    def stop(self):
+        """stops acquisition, the log file is flushed and closed"""
+        self._stop.set()
+
+    def _receive_sample(self, name, snapshot):
+        self.latest[name] = snapshot
+        if self._server is not None:
+            self._server.publish_sample(name, snapshot)
+
+    def _receive_setting(self, name, mode, value):
+        logger.info(f"{name}: {mode}: {value}")
+        if self._server is not None:
+            self._server.publish_setting(name, mode, value)
+
+    def _receive_recipe_state(self, step, state, description):
+        logger.info(f"recipe {self.recipe['name']} step {step}/{len(self.recipe['steps'])} {state}: {description}")
+
+    def _receive_error(self, name, error):
+        logger.error(f"{name}: {error}")
+
+    def _receive_connected(self, name):
+        logger.info(f"{name}: connected to LS336")
+
+
+def metrics_options(args):
+    """returns the keyword arguments of metrics_exporter given on the command line
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments of python -m ls336
+
+    Returns:
+        dict: keyword arguments, None if the metrics are not exported
+    """
+    if args.metrics_port is None and args.metrics_json is None:
+        return None
+    return {
+           "port": args.metrics_port,
+           "host": args.control_host,
+           "json_file": args.metrics_json,
+           "interval": args.metrics_interval,
+           }
+
+
+def main(args, recipe=None):
+    """runs the headless acquisition daemon
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments of python -m ls336
+        recipe (dict): optional recipe run on startup (see load_recipe)
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.device:
+        _devices = [parse_device(device, args.heater_channel) for device in args.device]
+    else:
+        _devices = [{"name": "ls336", "heater_channel": args.heater_channel}]
+    acquisition_daemon(_devices, args.interval, args.log_dir, args.control_port, args.shared_log,
+                       args.rotate_hours, args.rotate_mb, args.compress_finished, adaptive_options(args),
+                       change_compression_options(args), args.control_host, metrics_options(args), recipe,
+                       not args.no_journal).run()
@@ -0,0 +1,111 @@
+import numpy as np
+from ls336.lib.ring_buffer import ring_buffer
+
+
+class decimation_pyramid():
+    """Min/max decimation pyramid of time stamped samples, maintained incrementally on append.
+
+    Level 0 holds the raw samples. Level k holds one bucket per factor**k raw samples, every bucket is stored
+    as two samples: (start time, minimum of every channel) and (end time, maximum of every channel).
+    Plotting a level therefore keeps all transient spikes while the number of points drops by factor / 2 per level.
+    All levels are ring buffers, views are returned without copying.
+    """
+    def __init__(self, capacity, n_channels, factor=4, n_levels=6, retention=None):
+        self.factor = factor
+        self.n_channels = n_channels
+        self.levels = [ring_buffer(capacity, n_channels, retention=retention)]
+        for k in range(1, n_levels):
+            self.levels.append(ring_buffer(max(2 * capacity // factor**k, 2 * factor), n_channels, retention=retention))
+
+        ### pending (incomplete) bucket of every level k >= 1
+        self._count = np.zeros(n_levels, dtype=np.int64)
+        self._start = np.zeros(n_levels, dtype=np.float64)
+        self._end = np.zeros(n_levels, dtype=np.float64)
+        self._min = np.empty((n_levels, n_channels), dtype=np.float64)
+        self._max = np.empty((n_levels, n_channels), dtype=np.float64)
+
+### Properties
+
+    @property
+    def raw(self):
+        """Returns the ring buffer holding the raw samples
+
+        Returns:
+            ring_buffer: level 0
+        """
+        return self.levels[0]
+
+### Methods
+
+    def append(self, time_stamp, values):
+        """appends a sample and updates all levels
+
+        Args:
+            time_stamp (float): epoch time of the sample
+            values (sequence of floats): one value per channel
+        """
+        self.levels[0].append(time_stamp, values)
+        _values = np.asarray(values, dtype=np.float64)
+        self._add(1, time_stamp, time_stamp, _values, _values)
+
+    def _add(self, k, start, end, minimum, maximum):
+        """adds a sample or a completed bucket of level k - 1 to the pending bucket of level k"""
+        if k >= len(self.levels):
+            return
+        if self._count[k] == 0:
+            self._start[k] = start
+            self._min[k] = minimum
+            self._max[k] = maximum
+        else:
+            np.minimum(self._min[k], minimum, out=self._min[k])
+            np.maximum(self._max[k], maximum, out=self._max[k])
+        self._end[k] = end
+        self._count[k] += 1
+
+        if self._count[k] == self.factor:
+            self._count[k] = 0
+            self.levels[k].append(self._start[k], self._min[k])
+            self.levels[k].append(self._end[k], self._max[k])
+            self._add(k + 1, self._start[k], self._end[k], self._min[k].copy(), self._max[k].copy())
+
+    def level_for(self, x_min, x_max, max_points):
+        """returns the finest level showing at most max_points points between x_min and x_max
+
+        Args:
+            x_min (float): start of the visible range in epoch time
+            x_max (float): end of the visible range in epoch time
+            max_points (int): maximum number of points, e.g. twice the plot width in pixels
+
+        Returns:
+            int: level index
+        """
+        for k, level in enumerate(self.levels):
+            _time = level.time
+            _n = np.searchsorted(_time, x_max, side="right") - np.searchsorted(_time, x_min, side="left")
+            if _n <= max_points:
+                return k
+        return len(self.levels) - 1
+
+    def view(self, channel, level=0, x_min=None, x_max=None):
+        """returns time stamps and values of a channel at the given level
+
+        Args:
+            channel (int): channel index
+            level (int): decimation level
+            x_min (float): optional start of the returned range in epoch time
+            x_max (float): optional end of the returned range in epoch time
+
+        Returns:
+            tuple of numpy.ndarray: (time, values) views, oldest first
+        """
+        _time = self.levels[level].time
+        _values = self.levels[level].channel(channel)
+        _start = 0 if x_min is None else int(np.searchsorted(_time, x_min, side="left"))
+        _stop = len(_time) if x_max is None else int(np.searchsorted(_time, x_max, side="right"))
+        return _time[_start:_stop], _values[_start:_stop]
+
+    def clear(self):
+        """removes all samples of all levels"""
+        for level in self.levels:
+            level.clear()
+        self._count[:] = 0
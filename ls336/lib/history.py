@@ -0,0 +1,123 @@
+import glob
+import json
+from os.path import basename, getmtime, join
+import numpy as np
+from ls336.lib.log_reader import open_log, resample_live
+from ls336.lib.log_writer import LIVE_GROUPS
+
+# number of min/max buckets of the overview of the preloaded time range
+OVERVIEW_BUCKETS = 2048
+# rows read per bucket of the overview at most, the overview of longer windows is built from every n-th row
+OVERVIEW_SAMPLES = 16
+
+
+def latest_log(save_path):
+    """returns the most recently written log in save_path
+
+    Args:
+        save_path (string): directory of the log files
+
+    Returns:
+        string: path of the hdf5 log file or of the index file of a rotated log, None if there is no log
+    """
+    _candidates = glob.glob(join(save_path, "ls336_log_*.hdf5")) + glob.glob(join(save_path, "ls336_log_*index.json"))
+    if not _candidates:
+        return None
+    _latest = max(_candidates, key=getmtime)
+    if _latest.endswith(".hdf5"):
+        # segments of a rotated log are read through their index
+        for index_file in glob.glob(join(save_path, "ls336_log_*index.json")):
+            with open(index_file) as f:
+                if any(segment["file"] == basename(_latest) for segment in json.load(f)["segments"]):
+                    return index_file
+    return _latest
+
+
+def _envelope(rows, bin_seconds):
+    """returns the min/max envelope of rows: two points per bin, (start, minimum) and (center, maximum)
+
+    Returns:
+        tuple of numpy.ndarray: (time, values (n, channels))
+    """
+    _minimum = resample_live(rows, bin_seconds, "min")
+    _maximum = resample_live(rows, bin_seconds, "max")
+    _time = np.empty(2 * len(_minimum))
+    _time[0::2] = _minimum["time"]
+    _time[1::2] = _minimum["time"] + 0.5 * bin_seconds
+    _values = np.empty((2 * len(_minimum), len(LIVE_GROUPS)))
+    for channel, name in enumerate(LIVE_GROUPS):
+        _values[0::2, channel] = _minimum[name]
+        _values[1::2, channel] = _maximum[name]
+    return _time, _values
+
+
+class log_history():
+    """Live values of the last hours of a log, shown in the live view before the values of the current session.
+
+    On creation only a min/max overview (OVERVIEW_BUCKETS buckets) of the time range is kept in memory.
+    It is built decimated first: at most OVERVIEW_SAMPLES rows per bucket are read (every step-th row), so
+    spikes between the rows read show up once the view is zoomed in. Finer resolution is read from the log on
+    demand when the view is zoomed in (window()), the last window is cached.
+    """
+    def __init__(self, path, hours, group=None):
+        self.path = path
+        self._log = open_log(path, group)
+        _first, _last = self._log.time_range
+        if _first is None:
+            self.start = self.stop = None
+            self._overview = (np.empty(0), np.empty((0, len(LIVE_GROUPS))))
+            return
+        self.start = max(_first, _last - hours * 3600)
+        self.stop = _last
+        self.bin_seconds = max((self.stop - self.start) / OVERVIEW_BUCKETS, 1e-3)
+        _stop = np.nextafter(self.stop, np.inf)
+        self.step = max(1, -(-self._log.count_live(self.start, _stop) // (OVERVIEW_BUCKETS * OVERVIEW_SAMPLES)))
+        self._overview = _envelope(self._log.read_live(self.start, _stop, step=self.step), self.bin_seconds)
+        self._cache = (None, None)
+
+### Properties
+
+    @property
+    def empty(self):
+        """Returns True if the log holds no live values
+
+        Returns:
+            bool: True if there is nothing to show
+        """
+        return self.start is None
+
+### Methods
+
+    def window(self, x_min, x_max, resolution):
+        """returns the live values between x_min and x_max with at least the given resolution
+
+        Args:
+            x_min (float): start of the range in epoch time
+            x_max (float): end of the range in epoch time
+            resolution (float): seconds per plotted point
+
+        Returns:
+            tuple of numpy.ndarray: (time, values (n, 3)), values in the order of LIVE_GROUPS
+        """
+        if self.empty or x_max < self.start or x_min > self.stop:
+            return np.empty(0), np.empty((0, len(LIVE_GROUPS)))
+        if resolution >= self.bin_seconds:
+            _time, _values = self._overview
+            _start, _stop = np.searchsorted(_time, (x_min - self.bin_seconds, x_max), side="left")
+            return _time[_start:_stop], _values[_start:_stop]
+
+        # zoomed in: read the range from the log, decimate it only if it holds more points than needed
+        x_min, x_max = max(x_min, self.start), min(x_max, self.stop)
+        _key = (x_min, x_max, resolution)
+        if self._cache[0] != _key:
+            _rows = self._log.read_live(x_min, np.nextafter(x_max, np.inf))
+            if len(_rows) > (x_max - x_min) / resolution:
+                self._cache = (_key, _envelope(_rows, 2 * resolution))
+            else:
+                self._cache = (_key, (_rows["time"].astype(np.float64),
+                                      np.column_stack([_rows[name] for name in LIVE_GROUPS]).astype(np.float64)))
+        return self._cache[1]
+
+    def close(self):
+        """closes the log"""
+        self._log.close()
@@ -0,0 +1,334 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from glob import glob
+from os.path import basename, dirname, exists, join, splitext
+import numpy as np
+
+logger = logging.getLogger("ls336")
+
+# journal files are named after their log file: LOG.hdf5.journal or LOG.hdf5.GROUP.journal (shared log files)
+JOURNAL_SUFFIX = ".journal"
+# records of a journal (88 bytes each, 5.5 MB), far more entries than wait for the compaction into the log file
+JOURNAL_CAPACITY = 65536
+# log entry modes of log_writer.append, stored as their index in the records
+JOURNAL_MODES = ("live_temp", "set_point", "heater_mode", "pid", "recipe", "loop_metrics", "autotune")
+# values per record, entries with fewer values are padded with zeros
+JOURNAL_VALUES = 6
+# header: magic, version, record size, capacity, sequence number of the first record not yet in the log file, group,
+# sequence number after the last setting entry in the log file (settings are written before the live rows buffered)
+JOURNAL_HEADER = struct.Struct("<8sIIQQ64sQ")
+JOURNAL_HEADER_SIZE = 128
+JOURNAL_MAGIC = b"LS336JNL"
+JOURNAL_VERSION = 2
+# offsets of the committed sequence numbers in the header
+JOURNAL_COMMITTED = 24
+JOURNAL_SETTINGS_COMMITTED = 96
+# record: sequence number, time stamp, values, text (heater mode, recipe state), mode, CRC32 of the bytes before
+JOURNAL_RECORD = struct.Struct(f"<Qd{JOURNAL_VALUES}d16sB3xI")
+JOURNAL_DTYPE = np.dtype([("seq", "<u8"), ("time", "<f8"), ("values", "<f8", JOURNAL_VALUES), ("text", "S16"),
+                          ("mode", "u1"), ("pad", "V3"), ("crc", "<u4")])
+
+
+class JournalError(Exception):
+    pass
+
+
+def _lock(f):
+    """locks the open file f exclusively (released when f is closed)
+
+    Returns:
+        bool: False if the file is locked by another writer
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Windows
+        import msvcrt
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def journal_name(log_file, group=None):
+    """returns the path of the journal of a log file (group: group of a shared log file)"""
+    return f"{log_file}{JOURNAL_SUFFIX}" if group is None else f"{log_file}.{group}{JOURNAL_SUFFIX}"
+
+
+class write_ahead_journal():
+    """Append only journal of the log entries of a log_writer, written before the entries reach the hdf5 file.
+
+    The journal is a preallocated file of JOURNAL_CAPACITY fixed size records mapped into memory, appending an
+    entry copies one record into the mapping (no system call, no hdf5 transaction). The mapping is written back
+    by the operating system, so the entries survive a crash of the process. Every record carries a sequence number
+    and a CRC32, a record torn by a crash is detected and dropped, so at most the last entry is lost.
+    Once entries are written to the hdf5 file, commit() marks them as obsolete and their slots are reused
+    (ring buffer). Settings reach the hdf5 file before live rows appended earlier (which wait in the block buffer),
+    commit_settings() marks the setting entries written. replay_journal() writes the entries not committed into
+    the log file.
+    The journal file is locked while it is open, so journals in use are never replayed or overwritten.
+
+    Raises:
+        JournalError: Is raised if the journal file is locked by another writer or a replay
+    """
+    def __init__(self, path, group=None, capacity=JOURNAL_CAPACITY):
+        self.path = path
+        self.group = group
+        self.capacity = capacity
+        self.next_seq = 0
+        self.committed = 0
+        self.settings_committed = 0
+        self._record = bytearray(JOURNAL_RECORD.size)
+        self._map = None
+        # the file is truncated only once it is locked, a journal not yet replayed is never overwritten
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        if not _lock(self._file):
+            self._file.close()
+            raise JournalError(f"{path} is in use")
+        self._file.truncate(0)
+        self._file.truncate(JOURNAL_HEADER_SIZE + capacity * JOURNAL_RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        JOURNAL_HEADER.pack_into(self._map, 0, JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_RECORD.size, capacity, 0,
+                                 (group or "").encode(), 0)
+
+### Properties
+
+    @property
+    def pending(self):
+        """Returns the number of entries not yet committed
+
+        Returns:
+            int: number of records
+        """
+        return self.next_seq - self.committed
+
+    @property
+    def full(self):
+        """Returns True if no entry can be appended before the next commit
+
+        Returns:
+            bool: journal state
+        """
+        return self.pending >= self.capacity
+
+### Methods
+
+    def append(self, time_stamp, mode, value):
+        """appends a log entry (see log_writer.append)
+
+        Args:
+            time_stamp (float): epoch time of the entry
+            mode (string): one of JOURNAL_MODES
+            value (misc): value of the entry
+
+        Raises:
+            JournalError: Is raised if the journal is full
+
+        Returns:
+            int: sequence number of the entry
+        """
+        if self.full:
+            raise JournalError(f"Journal {self.path} is full")
+        if mode == "heater_mode":
+            _values, _text = (), value
+        elif mode == "recipe":
+            _values, _text = (value[0],), value[1]
+        elif mode == "set_point":
+            _values, _text = (value,), ""
+        else:
+            _values, _text = tuple(value), ""
+        _seq = self.next_seq
+        JOURNAL_RECORD.pack_into(self._record, 0, _seq, time_stamp, *_values,
+                                 *(0.,) * (JOURNAL_VALUES - len(_values)), _text.encode(),
+                                 JOURNAL_MODES.index(mode), 0)
+        struct.pack_into("<I", self._record, JOURNAL_RECORD.size - 4, zlib.crc32(self._record[:-4]))
+        _offset = JOURNAL_HEADER_SIZE + _seq % self.capacity * JOURNAL_RECORD.size
+        self._map[_offset:_offset + JOURNAL_RECORD.size] = self._record
+        self.next_seq += 1
+        return _seq
+
+    def commit(self, seq):
+        """marks the entries before seq as written to the log file
+
+        Args:
+            seq (int): sequence number of the first entry not yet written to the log file
+        """
+        if seq > self.committed:
+            self.committed = seq
+            struct.pack_into("<Q", self._map, JOURNAL_COMMITTED, seq)
+
+    def commit_settings(self, seq):
+        """marks the setting entries (all modes but live_temp) before seq as written to the log file
+
+        Args:
+            seq (int): sequence number after the last setting entry written to the log file
+        """
+        if seq > self.settings_committed:
+            self.settings_committed = seq
+            struct.pack_into("<Q", self._map, JOURNAL_SETTINGS_COMMITTED, seq)
+
+    def close(self, remove=True):
+        """closes the journal
+
+        Args:
+            remove (bool): delete the journal file (all entries are in the log file)
+        """
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+
+def read_journal(path):
+    """reads the entries of a journal which were not committed
+
+    Args:
+        path (string): journal file
+
+    Raises:
+        JournalError: Is raised if the file is no journal or in use
+
+    Returns:
+        tuple: (group, numpy structured array of JOURNAL_DTYPE records in the order of their sequence numbers)
+    """
+    with open(path, "r+b") as f:
+        return _read_records(f, path)
+
+
+def _read_records(f, path):
+    """reads the entries not committed from the open journal file f, see read_journal"""
+    if not _lock(f):
+        raise JournalError(f"{path} is in use")
+    _header = f.read(JOURNAL_HEADER_SIZE)
+    if len(_header) < JOURNAL_HEADER.size:
+        raise JournalError(f"{path} is no journal")
+    _magic, _version, _record_size, _capacity, _committed, _group, _settings_committed = \
+        JOURNAL_HEADER.unpack_from(_header)
+    if _magic != JOURNAL_MAGIC or _record_size != JOURNAL_RECORD.size:
+        raise JournalError(f"{path} is no journal")
+    _records = np.fromfile(f, dtype=JOURNAL_DTYPE, count=_capacity)
+    _records = _records[_records["seq"] >= _committed]
+    _records = _records[np.argsort(_records["seq"], kind="stable")]
+    _raw = _records.tobytes()
+    _valid = [zlib.crc32(_raw[i * JOURNAL_RECORD.size:(i + 1) * JOURNAL_RECORD.size - 4]) == record["crc"]
+              for i, record in enumerate(_records)]
+    _records = _records[np.asarray(_valid, dtype=bool)]
+    # entries follow each other without gaps, a torn record ends the journal
+    _consecutive = _records["seq"] == _committed + np.arange(len(_records))
+    _end = len(_records) if _consecutive.all() else int(np.argmin(_consecutive))
+    _records = _records[:_end]
+    # settings already written to the log file (journals of version 1 have no settings committed)
+    _written = (_records["mode"] != JOURNAL_MODES.index("live_temp")) & (_records["seq"] < _settings_committed)
+    return _group.rstrip(b"\0").decode() or None, _records[~_written]
+
+
+def _entry(record):
+    """returns (time_stamp, mode, value) of a journal record for log_writer.append"""
+    _mode = JOURNAL_MODES[record["mode"]]
+    _values = tuple(float(value) for value in record["values"])
+    if _mode == "set_point":
+        return float(record["time"]), _mode, _values[0]
+    if _mode == "heater_mode":
+        return float(record["time"]), _mode, record["text"].decode()
+    if _mode == "recipe":
+        return float(record["time"]), _mode, (int(_values[0]), record["text"].decode())
+    if _mode == "live_temp":
+        return float(record["time"]), _mode, _values[:3]
+    from ls336.lib.log_writer import SETTING_GROUPS
+    return float(record["time"]), _mode, _values[:len(SETTING_GROUPS[_mode][1])]
+
+
+def _update_index(log_file, records):
+    """adds the replayed readings to the segment of log_file in the index files of rotated logs listing it"""
+    _times = records["time"][records["mode"] == JOURNAL_MODES.index("live_temp")]
+    if len(_times) == 0:
+        return
+    for index_file in glob(join(dirname(log_file), "*_index.json")):
+        with open(index_file) as f:
+            _index = json.load(f)
+        _segments = [segment for segment in _index.get("segments", []) if segment["file"] == basename(log_file)]
+        if not _segments:
+            continue
+        if _segments[0]["start"] is None:
+            _segments[0]["start"] = float(_times[0])
+        _segments[0]["end"] = max(_segments[0]["end"] or float(_times[-1]), float(_times[-1]))
+        _segments[0]["entries"] += len(_times)
+        with open(f"{index_file}.tmp", "w") as f:
+            json.dump(_index, f, indent=1)
+        os.replace(f"{index_file}.tmp", index_file)
+
+
+def replay_journal(path):
+    """writes the entries of a journal which were not committed into its log file and removes the journal.
+    The entries are appended to the log file (with its change compression). If the log file can not be
+    opened, e.g. because the process died while writing it, they are written to a new log file LOG_recovered.hdf5.
+
+    Args:
+        path (string): journal file
+
+    Returns:
+        tuple: (log file the entries were written to, number of entries)
+    """
+    from ls336.lib.log_writer import log_writer
+    # the journal stays locked until it is replayed
+    with open(path, "r+b") as f:
+        _group, _records = _read_records(f, path)
+        _log_file = path[:-len(JOURNAL_SUFFIX)]
+        if _group is not None:
+            _log_file = _log_file[:-len(_group) - 1]
+        if len(_records):
+            try:
+                _writer = log_writer(_log_file, group=_group, append=True)
+            except (OSError, KeyError) as e:
+                logger.warning(f"Log file {_log_file} not readable ({e}), journal written to a new file")
+                _log_file = f"{splitext(_log_file)[0]}_recovered.hdf5"
+                _writer = log_writer(_log_file, group=_group, append=exists(_log_file))
+            for record in _records:
+                _writer.append(*_entry(record))
+            _writer.close()
+            _update_index(_log_file, _records)
+            # the entries are committed before the lock is released, a concurrent replay finds none left
+            f.seek(JOURNAL_COMMITTED)
+            f.write(struct.pack("<Q", int(_records["seq"][-1]) + 1))
+            f.flush()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # removed by a concurrent replay
+        pass
+    return _log_file, len(_records)
+
+
+def replay_journals(save_path):
+    """replays all journals left in save_path by a process which did not close its log files (see replay_journal),
+    journals in use are skipped
+
+    Args:
+        save_path (string): directory of the log files
+
+    Returns:
+        list of tuples: (log file, number of entries) per journal
+    """
+    _replayed = []
+    for path in sorted(glob(join(save_path, f"*{JOURNAL_SUFFIX}"))):
+        try:
+            _replayed.append(replay_journal(path))
+        except JournalError as e:
+            # journals in use by a running log_writer are locked
+            logger.info(f"Journal {path} not replayed: {e}")
+            continue
+        logger.info(f"Journal {path}: {_replayed[-1][1]} entries written to {_replayed[-1][0]}")
+    return _replayed
@@ -0,0 +1,134 @@
+import numpy as np
+
+# modes of change_compressor and how the reader reconstructs the values between two logged rows
+RECONSTRUCTION = {
+                 "deadband": "hold",
+                 "swinging_door": "linear",
+                 }
+
+
+def change_compression_options(args):
+    """returns the keyword arguments of change_compressor given on the command line
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments of python -m ls336
+
+    Raises:
+        ValueError: Is raised if --log-deviation does not hold three numbers
+
+    Returns:
+        dict: keyword arguments, None if every reading is to be logged
+    """
+    if args.log_compression is None:
+        return None
+    _deviation = tuple(float(value) for value in args.log_deviation.split(","))
+    if len(_deviation) != 3:
+        raise ValueError(f"Deviation of T_sample, T_tip and P_heater expected: {args.log_deviation}")
+    return {
+           "mode": args.log_compression.replace("-", "_"),
+           "deviation": _deviation,
+           "keepalive": args.log_keepalive,
+           }
+
+
+class change_compressor():
+    """Change based compression of the live values, applied before the values are written to the log.
+
+    Rows are compared with the channels T_sample, T_tip and P_heater jointly, a row is logged if one channel requires it:
+        deadband:       a row is logged when a channel differs by more than deviation from the last logged row.
+                        Holding the last logged row reproduces every reading within deviation.
+        swinging_door:  piecewise linear compression, a row is logged when the readings since the last logged row
+                        can no longer be approximated by one line within deviation. The row ending the segment is
+                        taken from a line within the door of all readings of the segment (so it may differ from
+                        the reading by up to deviation), linear interpolation between the logged rows reproduces
+                        every reading within deviation.
+    Additionally a row is logged at least every keepalive seconds, so gaps in the log are distinguishable
+    from constant values. flush() returns the latest reading if it was not logged yet.
+    """
+    def __init__(self, mode="swinging_door", deviation=(2e-3, 2e-3, 0.5), keepalive=600.):
+        if mode not in RECONSTRUCTION:
+            raise ValueError(f"Unknown compression mode {mode}")
+        self.mode = mode
+        self.deviation = np.asarray(deviation, dtype=np.float64)
+        self.keepalive = float(keepalive)
+        self._anchor = None
+        self._last = None
+        self._last_logged = True
+        self._upper = None
+        self._lower = None
+
+### Methods
+
+    def _log(self, time_stamp, values):
+        """makes (time_stamp, values) the last logged row"""
+        self._anchor = (time_stamp, values)
+        self._upper = np.full(len(values), np.inf)
+        self._lower = np.full(len(values), -np.inf)
+
+    def _door_open(self, time_stamp, values):
+        """narrows the doors of all channels by the reading, returns False (doors unchanged) if one door closes"""
+        _elapsed = time_stamp - self._anchor[0]
+        if _elapsed <= 0:
+            return bool(np.all(np.abs(values - self._anchor[1]) <= self.deviation))
+        _upper = np.minimum(self._upper, (values + self.deviation - self._anchor[1]) / _elapsed)
+        _lower = np.maximum(self._lower, (values - self.deviation - self._anchor[1]) / _elapsed)
+        if np.any(_lower > _upper):
+            return False
+        self._upper, self._lower = _upper, _lower
+        return True
+
+    def _segment_end(self):
+        """returns the row ending the segment at the previous reading: on the line within all doors closest to it"""
+        _time_stamp, _values = self._last
+        _elapsed = _time_stamp - self._anchor[0]
+        if _elapsed <= 0:
+            return self._last
+        _slope = np.clip((_values - self._anchor[1]) / _elapsed, self._lower, self._upper)
+        return _time_stamp, self._anchor[1] + _slope * _elapsed
+
+    def add(self, time_stamp, values):
+        """passes a reading through the compression
+
+        Args:
+            time_stamp (float): epoch time of the reading
+            values (sequence of floats): T_sample, T_tip, P_heater
+
+        Returns:
+            list: rows (time_stamp, values) to be logged, oldest first
+        """
+        _values = np.asarray(values, dtype=np.float64)
+        _rows = []
+        if self._anchor is None:
+            _rows.append((time_stamp, _values))
+            self._log(time_stamp, _values)
+        elif self.mode == "deadband":
+            if np.any(np.abs(_values - self._anchor[1]) > self.deviation):
+                _rows.append((time_stamp, _values))
+                self._log(time_stamp, _values)
+        elif not self._door_open(time_stamp, _values):
+            # the segment ends at the previous reading, the new segment starts there
+            _rows.append(self._segment_end())
+            self._log(*_rows[-1])
+            self._door_open(time_stamp, _values)
+
+        if (not _rows or _rows[-1][0] != time_stamp) and time_stamp - self._anchor[0] >= self.keepalive:
+            # the swinging door segment ends within the door like on flush(), not at the reading
+            self._last = (time_stamp, _values)
+            _rows.append(self._segment_end() if self.mode == "swinging_door" else self._last)
+            self._log(*_rows[-1])
+        self._last = (time_stamp, _values)
+        self._last_logged = bool(_rows) and _rows[-1][0] == time_stamp
+        return _rows
+
+    def flush(self):
+        """returns the latest reading if it was not logged yet, the compression continues from this reading
+
+        Returns:
+            list: rows (time_stamp, values) to be logged
+        """
+        if self._last_logged or self._last is None:
+            return []
+        _row = self._segment_end() if self.mode == "swinging_door" else self._last
+        self._log(*_row)
+        self._last_logged = True
+        return [_row]
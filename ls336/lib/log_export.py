@@ -0,0 +1,186 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from os.path import basename, dirname, join, splitext
+import numpy as np
+from ls336.lib.log_reader import log_reader, open_log
+from ls336.lib.log_writer import LIVE_GROUPS, SETTING_GROUPS
+
+# output formats of export_log, parquet requires pyarrow
+EXPORT_FORMATS = ("csv", "parquet")
+# live rows read, joined and written at a time, bounds the memory of an export (~5 MB per block)
+EXPORT_BLOCK = 65536
+# settings joined onto the live rows
+EXPORT_SETTINGS = ("set_point", "heater_mode", "pid")
+# columns of the exported table: live values, then the setting values in effect at the time of the row
+EXPORT_COLUMNS = ("time",) + LIVE_GROUPS + tuple(name for mode in EXPORT_SETTINGS for name in SETTING_GROUPS[mode][1])
+
+
+def join_settings(rows, settings):
+    """joins the settings onto live rows as of time: every row gets the last setting value logged at or before it
+
+    Args:
+        rows (numpy structured array): rows of LIVE_DTYPE sorted by time
+        settings (dict): mode -> setting entries as returned by read_setting
+
+    Returns:
+        dict: EXPORT_COLUMNS -> numpy arrays, NaN (empty string for the heater mode) before the first setting entry
+    """
+    _columns = {name: rows[name] for name in ("time",) + LIVE_GROUPS}
+    for mode in EXPORT_SETTINGS:
+        _setting = settings[mode]
+        _times = _setting.get("time", np.empty(0))
+        _idx = np.searchsorted(_times, rows["time"], side="right") - 1
+        _missing = _idx < 0
+        for name in SETTING_GROUPS[mode][1]:
+            if mode == "heater_mode":
+                _column = np.full(len(rows), "", dtype=object)
+            else:
+                _column = np.full(len(rows), np.nan)
+            _column[~_missing] = _setting[name][_idx[~_missing]]
+            _columns[name] = _column
+    return _columns
+
+
+class csv_sink():
+    """Writes exported blocks to a CSV file with header, floats in their shortest exact representation,
+    missing values as empty fields (no field needs quoting)"""
+    def __init__(self, out_file):
+        self._file = open(out_file, "w", newline="")
+        self._file.write(f"{','.join(EXPORT_COLUMNS)}\n")
+
+### Methods
+
+    def write(self, columns):
+        _text = []
+        for name in EXPORT_COLUMNS:
+            _column = columns[name]
+            if name in LIVE_GROUPS or name == "time":
+                _text.append(_column.astype(str).tolist())
+                continue
+            # setting columns hold few distinct values, each is formatted once
+            _values, _inverse = np.unique(_column, return_inverse=True)
+            _values = np.array(["" if value != value else str(value) for value in _values], dtype=object)
+            _text.append(_values[_inverse].tolist())
+        self._file.write("".join(f"{','.join(row)}\n" for row in zip(*_text)))
+
+    def close(self):
+        self._file.close()
+
+
+class parquet_sink():
+    """Writes exported blocks to a Parquet file, one row group per block (requires pyarrow)"""
+    def __init__(self, out_file):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._schema = pa.schema([(name, pa.string() if name == "heater_mode" else
+                                   pa.float32() if name in LIVE_GROUPS else pa.float64()) for name in EXPORT_COLUMNS])
+        self._writer = pq.ParquetWriter(out_file, self._schema)
+
+### Methods
+
+    def write(self, columns):
+        self._writer.write_table(self._pa.table({name: columns[name] for name in EXPORT_COLUMNS}, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+EXPORT_SINKS = {
+               "csv": csv_sink,
+               "parquet": parquet_sink,
+               }
+
+
+def export_log(path, out_file, format="csv", group=None, block_rows=EXPORT_BLOCK):
+    """exports a log (see open_log) as one table of the live values with the settings joined as of time
+    (see join_settings). The live values are read, joined and written block wise, so only one block of rows and
+    the setting entries are held in memory. The table is written to out_file.tmp and renamed when complete.
+
+    Args:
+        path (string): hdf5 log file or index file (*.json) of a rotated log
+        out_file (string): path of the exported file
+        format (string): "csv" or "parquet" (requires pyarrow)
+        group (string): group of a shared log file
+        block_rows (int): rows per block
+
+    Returns:
+        int: number of exported rows
+    """
+    _rows = 0
+    _tmp_file = f"{out_file}.tmp"
+    _sink = EXPORT_SINKS[format](_tmp_file)
+    try:
+        with open_log(path, group) as log:
+            _settings = {mode: log.read_setting(mode) for mode in EXPORT_SETTINGS}
+            for block in log.iter_live(block_rows):
+                _sink.write(join_settings(block, _settings))
+                _rows += len(block)
+    except BaseException:
+        _sink.close()
+        os.remove(_tmp_file)
+        raise
+    _sink.close()
+    os.replace(_tmp_file, out_file)
+    return _rows
+
+
+def export_jobs(paths, out_dir=None, format="csv"):
+    """returns the exports of log files: shared log files give one export per controller group
+
+    Args:
+        paths (list of strings): hdf5 log files or index files (*.json) of rotated logs
+        out_dir (string): directory of the exported files, None for the directory of each log
+
+    Returns:
+        list of tuples: (path, group, out_file), out_file is named after the log file or rotated log (and the group)
+    """
+    _jobs = []
+    for path in paths:
+        _stem = join(out_dir if out_dir is not None else dirname(path), splitext(basename(path))[0])
+        if path.endswith(".json"):
+            # ls336_log_index.json -> ls336_log
+            _stem = _stem.removesuffix("_index")
+        _groups = [None]
+        if not path.endswith(".json"):
+            with log_reader(path) as reader:
+                _groups = reader.groups or [None]
+        for group in _groups:
+            _jobs.append((path, group, f"{_stem}.{format}" if group is None else f"{_stem}_{group}.{format}"))
+    return _jobs
+
+
+def export_logs(paths, out_dir=None, format="csv", jobs=1, block_rows=EXPORT_BLOCK):
+    """exports several logs (see export_log), with jobs > 1 in parallel processes
+
+    Args:
+        paths (list of strings): hdf5 log files or index files (*.json) of rotated logs
+        out_dir (string): directory of the exported files, None for the directory of each log
+        format (string): "csv" or "parquet" (requires pyarrow)
+        jobs (int): number of logs exported at the same time
+        block_rows (int): rows per block
+
+    Returns:
+        generator of tuples: (path, group, out_file, exported rows) in the order of the exports
+    """
+    _jobs = export_jobs(paths, out_dir, format)
+    if jobs <= 1:
+        for path, group, out_file in _jobs:
+            yield path, group, out_file, export_log(path, out_file, format, group, block_rows)
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        _futures = [executor.submit(export_log, path, out_file, format, group, block_rows)
+                    for path, group, out_file in _jobs]
+        for (path, group, out_file), future in zip(_jobs, _futures):
+            yield path, group, out_file, future.result()
+
+
+def main(args):
+    """python -m ls336 export: exports the logs given on the command line"""
+    if args.format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet export requires pyarrow (pip install pyarrow)")
+    for path, group, out_file, rows in export_logs(args.logs, args.out_dir, args.format, args.jobs, args.block_rows):
+        print(f"{path}{f' [{group}]' if group is not None else ''}: {rows} rows -> {out_file}")
@@ -0,0 +1,508 @@
+import json
+from functools import partial
+from os.path import dirname, join
+import numpy as np
+from ls336.lib.log_writer import LIVE_DTYPE, LIVE_GROUPS, SETTING_GROUPS
+
+# aggregations of resample_live
+AGGREGATIONS = {
+               "mean": np.add.reduceat,
+               "min": np.minimum.reduceat,
+               "max": np.maximum.reduceat,
+               }
+
+
+def open_log(path, group=None):
+    """opens a single log file or a rotated log
+
+    Args:
+        path (string or list of strings): hdf5 log file, index file (*.json) of a rotated log or list of log files
+        group (string): group of a shared log file
+
+    Returns:
+        log_reader or log_set: reader of the log
+    """
+    if isinstance(path, (list, tuple)) or str(path).endswith(".json"):
+        return log_set(path, group)
+    return log_reader(path, group)
+
+
+def resample_live(rows, bin_seconds, how="mean"):
+    """aggregates live values into time bins, bins are aligned to multiples of bin_seconds in epoch time
+
+    Args:
+        rows (numpy structured array): rows of LIVE_DTYPE sorted by time
+        bin_seconds (float): width of the bins in seconds
+        how (string): "mean", "min" or "max"
+
+    Returns:
+        numpy structured array: one row of LIVE_DTYPE per non empty bin, time is the start of the bin
+    """
+    _reduce = AGGREGATIONS[how]
+    _bins = np.floor(rows["time"] / bin_seconds)
+    _starts = np.flatnonzero(np.diff(_bins, prepend=np.nan))
+    _resampled = np.empty(len(_starts), dtype=LIVE_DTYPE)
+    _resampled["time"] = _bins[_starts] * bin_seconds
+    if len(_starts) == 0:
+        return _resampled
+    for name in LIVE_GROUPS:
+        _values = _reduce(rows[name].astype(np.float64), _starts)
+        if how == "mean":
+            _values /= np.diff(np.append(_starts, len(rows)))
+        _resampled[name] = _values
+    return _resampled
+
+
+def reconstruct_live(rows, times, reconstruction="linear"):
+    """returns the live values at arbitrary times from logged rows, e.g. of a change compressed log
+
+    Args:
+        rows (numpy structured array): rows of LIVE_DTYPE sorted by time
+        times (numpy.ndarray): epoch times
+        reconstruction (string): "linear" interpolation or "hold" of the last row before each time
+
+    Returns:
+        numpy structured array: rows of LIVE_DTYPE at times, NaN outside of the logged rows
+    """
+    _times = np.asarray(times, dtype=np.float64)
+    _reconstructed = np.empty(len(_times), dtype=LIVE_DTYPE)
+    _reconstructed["time"] = _times
+    if len(rows) == 0:
+        for name in LIVE_GROUPS:
+            _reconstructed[name] = np.nan
+        return _reconstructed
+    _outside = (_times < rows["time"][0]) | (_times > rows["time"][-1])
+    _idx = np.clip(np.searchsorted(rows["time"], _times, side="right") - 1, 0, len(rows) - 1)
+    for name in LIVE_GROUPS:
+        if reconstruction == "hold":
+            _values = rows[name][_idx].astype(np.float64)
+        else:
+            _values = np.interp(_times, rows["time"], rows[name])
+        _values[_outside] = np.nan
+        _reconstructed[name] = _values
+    return _reconstructed
+
+
+def to_dataframe(rows):
+    """converts live values to a pandas DataFrame indexed by time (requires pandas)
+
+    Args:
+        rows (numpy structured array): rows of LIVE_DTYPE
+
+    Returns:
+        pandas.DataFrame: columns T_sample, T_tip, P_heater, index time as UTC datetime
+    """
+    import pandas as pd
+    _frame = pd.DataFrame({name: rows[name] for name in LIVE_GROUPS})
+    _frame.index = pd.to_datetime(rows["time"], unit="s", utc=True)
+    _frame.index.name = "time"
+    return _frame
+
+
+def _interpolate(log, times, compression):
+    """reconstructs the live values of log (log_reader or log_set) at times"""
+    _times = np.asarray(times, dtype=np.float64)
+    if len(_times) == 0:
+        return np.empty(0, dtype=LIVE_DTYPE)
+    _rows = log.read_live(_times[0], np.nextafter(_times[-1], np.inf), enclosing=True)
+    return reconstruct_live(_rows, _times, compression["reconstruction"] if compression is not None else "linear")
+
+
+class _time_column():
+    """time stamps of a data set, read chunk wise on access"""
+    def __init__(self, dataset, length, field=None):
+        self.dataset = dataset
+        self.length = length
+        self.field = field
+        self.chunk = dataset.chunks[0] if dataset.chunks is not None else 4096
+        self._bounds = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return self._read(idx, idx + 1)[0]
+
+    def _read(self, start, stop):
+        """reads the time stamps of the entries start to stop"""
+        if self.field is None:
+            return self.dataset[start:stop]
+        return self.dataset[start:stop][self.field]
+
+    def search(self, value):
+        """returns the index of the first time stamp >= value (like bisect_left) reading as few chunks as possible.
+        The chunk holding value is guessed by interpolation, which finds it with one read for evenly sampled
+        time stamps, every second guess is a bisection to bound the number of reads for uneven sampling.
+        Every guess reads at least two time stamps and narrows the range, also for data sets with chunks of one entry.
+
+        Args:
+            value (float): epoch time
+
+        Returns:
+            int: index
+        """
+        _low, _high = 0, self.length
+        if _high == 0:
+            return 0
+        if self._bounds is None:
+            self._bounds = (self[_low], self[_high - 1])
+        _t_low, _t_high = self._bounds
+        _bisect = False
+        _span = max(self.chunk, 2)
+        while True:
+            if value <= _t_low:
+                return _low
+            if value > _t_high:
+                return _high
+            if _high - _low <= _span:
+                return _low + int(np.searchsorted(self._read(_low, _high), value))
+            if _bisect:
+                _guess = (_low + _high) // 2
+            else:
+                _guess = _low + int((value - _t_low) / (_t_high - _t_low) * (_high - _low))
+            _bisect = not _bisect
+            # _low <= _start <= _high - 2 and _stop >= _start + 2, so both updates below narrow the range
+            _start = max(_low, min(_guess, _high - 2) // self.chunk * self.chunk)
+            _stop = min(_high, _start + _span)
+            _times = self._read(_start, _stop)
+            if value <= _times[0]:
+                _high, _t_high = _start + 1, _times[0]
+            elif value > _times[-1]:
+                _low, _t_low = _stop - 1, _times[-1]
+            else:
+                return _start + int(np.searchsorted(_times, value))
+
+
+class log_reader():
+    """Reads ls336 log files of all format versions through one interface.
+
+    Format version 1 (groups T_sample, T_tip and P_heater with "time"/"data" data sets) is converted
+    to rows of LIVE_DTYPE, format version 2 is read directly. Only the valid entries (attribute "length")
+    are returned, so files which were not closed properly can be read as well.
+
+    Time windows are located by searching the time stamps chunk wise (_time_column.search), so only a few chunks
+    besides the ones of the window are read.
+    Windows are half open: start <= time < stop, None means unbounded.
+
+    With group, the log below this group of the file is read (shared log files of several controllers).
+    """
+    def __init__(self, log_file, group=None):
+        self.log_file = log_file
+        self.group = group
+        # imported on first use, so starting the UI does not wait for h5py
+        import h5py
+        self._file = h5py.File(log_file, "r")
+        self._root = self._file[group] if group is not None else self._file
+        self._times = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+### Properties
+
+    @property
+    def format_version(self):
+        """Returns the layout version of the log
+
+        Returns:
+            int: 1 or 2
+        """
+        return int(self._root.attrs.get("format_version", 1))
+
+    @property
+    def groups(self):
+        """Returns the controller groups of a shared log file
+
+        Returns:
+            list of strings: group names, empty if the file holds the log of a single controller
+        """
+        import h5py
+        return [name for name, node in self._file.items()
+                if isinstance(node, h5py.Group) and ("live" in node or "T_sample" in node)]
+
+    @property
+    def time_range(self):
+        """Returns the time stamps of the first and the last live entry
+
+        Returns:
+            tuple of floats: (first, last) in epoch time, (None, None) if the log has no live entries
+        """
+        _times = self._live_times()
+        if len(_times) == 0:
+            return (None, None)
+        return (float(_times[0]), float(_times[len(_times) - 1]))
+
+    @property
+    def change_compression(self):
+        """Returns the settings of the change compression of the live values (see change_compressor)
+
+        Returns:
+            dict: "mode", "deviation", "keepalive" and "reconstruction", None if every reading is logged
+        """
+        if self.format_version < 2:
+            return None
+        _attrs = self._root["live"].attrs
+        if "change_compression_mode" not in _attrs:
+            return None
+        return {name: _attrs[f"change_compression_{name}"] for name in ("mode", "deviation", "keepalive", "reconstruction")}
+
+### Methods
+
+    def _length(self, node, dataset):
+        """returns the number of valid entries of dataset, node holds the attribute "length" """
+        return min(int(node.attrs.get("length", dataset.shape[0])), dataset.shape[0])
+
+    def _valid(self, node, dataset):
+        """returns the valid entries of dataset, node holds the attribute "length" """
+        return dataset[:self._length(node, dataset)]
+
+    def _live_times(self):
+        """returns the time stamps of the live values as lazily read sequence"""
+        if self._times is None:
+            if self.format_version >= 2:
+                _live = self._root["live"]
+                self._times = _time_column(_live, self._length(_live, _live), "time")
+            else:
+                _group = self._root[LIVE_GROUPS[0]]
+                _length = min(self._length(self._root[group], self._root[group]["data"]) for group in LIVE_GROUPS)
+                self._times = _time_column(_group["time"], min(_length, self._length(_group, _group["time"])))
+        return self._times
+
+    def _window(self, times, start, stop):
+        """returns the index range of the entries with start <= time < stop
+
+        Args:
+            times (_time_column or numpy array): time stamps
+        """
+        _search = times.search if isinstance(times, _time_column) else partial(np.searchsorted, times)
+        _first = 0 if start is None else int(_search(start))
+        _last = len(times) if stop is None else max(_first, int(_search(stop)))
+        return _first, _last
+
+    def count_live(self, start=None, stop=None):
+        """returns the number of live entries with start <= time < stop (None means unbounded)"""
+        _first, _last = self._window(self._live_times(), start, stop)
+        return _last - _first
+
+    def read_live(self, start=None, stop=None, enclosing=False, step=1):
+        """reads the live values of a time window
+
+        Args:
+            start (float): epoch time of the first entry, None for the start of the log
+            stop (float): epoch time after the last entry, None for the end of the log
+            enclosing (bool): include the last entry before start and the first entry at or after stop (for interpolation)
+            step (int): read only every step-th entry of the window (decimated preview of a long window)
+
+        Returns:
+            numpy structured array: rows of LIVE_DTYPE (time, T_sample, T_tip, P_heater), time in epoch time
+        """
+        _times = self._live_times()
+        _first, _last = self._window(_times, start, stop)
+        if enclosing:
+            _first, _last = max(_first - 1, 0), min(_last + 1, len(_times))
+        return self._read_rows(_first, _last, step)
+
+    def _read_rows(self, first, last, step=1):
+        """reads every step-th live entry of first to last as rows of LIVE_DTYPE"""
+        if self.format_version >= 2:
+            return self._root["live"][first:last:step]
+        _rows = np.empty(len(range(first, last, step)), dtype=LIVE_DTYPE)
+        _rows["time"] = self._root[LIVE_GROUPS[0]]["time"][first:last:step]
+        for name in LIVE_GROUPS:
+            _rows[name] = self._root[name]["data"][first:last:step]
+        return _rows
+
+    def iter_live(self, block_rows=65536):
+        """reads all live values block wise, so logs larger than the memory can be processed
+
+        Args:
+            block_rows (int): rows per block
+
+        Returns:
+            generator of numpy structured arrays: consecutive blocks of at most block_rows rows of LIVE_DTYPE
+        """
+        _length = len(self._live_times())
+        for first in range(0, _length, block_rows):
+            yield self._read_rows(first, min(first + block_rows, _length))
+
+    def query(self, start=None, stop=None, bin_seconds=None, how="mean", as_dataframe=False):
+        """reads the live values of a time window, optionally aggregated into time bins
+
+        Args:
+            start (float): epoch time of the first entry, None for the start of the log
+            stop (float): epoch time after the last entry, None for the end of the log
+            bin_seconds (float): width of the time bins (see resample_live), None for the raw values
+            how (string): aggregation of the bins: "mean", "min" or "max"
+            as_dataframe (bool): return a pandas DataFrame instead of a structured array (requires pandas)
+
+        Returns:
+            numpy structured array or pandas.DataFrame: rows of LIVE_DTYPE
+        """
+        _rows = self.read_live(start, stop)
+        if bin_seconds is not None:
+            _rows = resample_live(_rows, bin_seconds, how)
+        return to_dataframe(_rows) if as_dataframe else _rows
+
+    def interpolate(self, times):
+        """returns the live values at arbitrary times, reconstructed as configured by the change compression
+        (linear interpolation for logs without change compression)
+
+        Args:
+            times (numpy.ndarray): epoch times, sorted
+
+        Returns:
+            numpy structured array: rows of LIVE_DTYPE at times, NaN outside of the log
+        """
+        return _interpolate(self, times, self.change_compression)
+
+    def read_setting(self, mode, start=None, stop=None):
+        """reads the log entries of a controller setting in a time window
+
+        Args:
+            mode (string): "set_point", "heater_mode", "pid", "recipe", "loop_metrics" or "autotune" (see SETTING_GROUPS)
+            start (float): epoch time of the first entry, None for the start of the log
+            stop (float): epoch time after the last entry, None for the end of the log
+
+        Returns:
+            dict: "time" and the value names of the setting ("set_point", "heater_mode" or "p", "i", "d")
+                  mapped to numpy arrays, heater modes as strings
+        """
+        group_name, names = SETTING_GROUPS[mode]
+        if group_name not in self._root:
+            return {name: np.empty(0) for name in ("time",) + names}
+        _group = self._root[group_name]
+        _setting = {name: self._valid(_group, _group[name]) for name in ("time",) + names}
+        _length = min(len(values) for values in _setting.values())
+        _first, _last = self._window(_setting["time"][:_length], start, stop)
+        _setting = {name: values[_first:_last] for name, values in _setting.items()}
+        for name in names:
+            if _setting[name].dtype.kind == "S":
+                _setting[name] = _setting[name].astype(str)
+        return _setting
+
+    def close(self):
+        """closes the log file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._root = None
+            self._times = None
+
+
+class log_set():
+    """Reads a log split into several files (rotating_log_writer) like a single log.
+
+    The files are given by the index file of the rotated log or as list of log files. Live values are read
+    only from the files overlapping the requested time window, a file is kept open after its first use.
+    """
+    def __init__(self, files, group=None):
+        self.group = group
+        self._readers = {}
+        if isinstance(files, (list, tuple)):
+            self.segments = [{"file": file, "start": None, "end": None} for file in files]
+        else:
+            with open(files) as f:
+                _index = json.load(f)
+            self.segments = [dict(segment, file=join(dirname(files), segment["file"])) for segment in _index["segments"]]
+        for segment in self.segments:
+            if segment["start"] is None:
+                segment["start"], segment["end"] = self._reader(segment["file"]).time_range
+        self.segments = [segment for segment in self.segments if segment["start"] is not None]
+        self.segments.sort(key=lambda segment: segment["start"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+### Properties
+
+    @property
+    def time_range(self):
+        """Returns the time stamps of the first and the last live entry of all files
+
+        Returns:
+            tuple of floats: (first, last) in epoch time, (None, None) if the log has no live entries
+        """
+        if not self.segments:
+            return (None, None)
+        return (self.segments[0]["start"], max(segment["end"] for segment in self.segments))
+
+### Methods
+
+    def _reader(self, log_file):
+        if log_file not in self._readers:
+            self._readers[log_file] = log_reader(log_file, self.group)
+        return self._readers[log_file]
+
+    def _overlapping(self, start, stop):
+        """returns the readers of the files with live values in start <= time < stop"""
+        return [self._reader(segment["file"]) for segment in self.segments
+                if (start is None or segment["end"] >= start) and (stop is None or segment["start"] < stop)]
+
+    def count_live(self, start=None, stop=None):
+        """returns the number of live entries of all files with start <= time < stop (see log_reader.count_live)"""
+        return sum(reader.count_live(start, stop) for reader in self._overlapping(start, stop))
+
+    def read_live(self, start=None, stop=None, enclosing=False, step=1):
+        """reads the live values of a time window from all files (see log_reader.read_live), with step every
+        step-th entry of every file"""
+        if not enclosing:
+            _parts = [reader.read_live(start, stop, step=step) for reader in self._overlapping(start, stop)]
+            return np.concatenate(_parts) if _parts else np.empty(0, dtype=LIVE_DTYPE)
+
+        # the enclosing entries can be in the files before and after the window
+        _starts = [segment["start"] for segment in self.segments]
+        _first = 0 if start is None else max(int(np.searchsorted(_starts, start, side="right")) - 1, 0)
+        _last = len(self.segments) if stop is None else int(np.searchsorted(_starts, stop, side="left")) + 1
+        _parts = [self._reader(segment["file"]).read_live(start, stop, enclosing=True, step=step)
+                  for segment in self.segments[_first:_last]]
+        _rows = np.concatenate(_parts) if _parts else np.empty(0, dtype=LIVE_DTYPE)
+        _low = 0 if start is None else max(int(np.searchsorted(_rows["time"], start, side="left")) - 1, 0)
+        _high = len(_rows) if stop is None else int(np.searchsorted(_rows["time"], stop, side="left")) + 1
+        return _rows[_low:_high]
+
+    def iter_live(self, block_rows=65536):
+        """reads all live values of all files block wise (see log_reader.iter_live), a file is closed after its
+        last block"""
+        for segment in self.segments:
+            yield from self._reader(segment["file"]).iter_live(block_rows)
+            self._readers.pop(segment["file"]).close()
+
+    def query(self, start=None, stop=None, bin_seconds=None, how="mean", as_dataframe=False):
+        """reads the live values of a time window from all files, optionally aggregated (see log_reader.query)"""
+        _rows = self.read_live(start, stop)
+        if bin_seconds is not None:
+            _rows = resample_live(_rows, bin_seconds, how)
+        return to_dataframe(_rows) if as_dataframe else _rows
+
+    def interpolate(self, times):
+        """returns the live values at arbitrary times from all files (see log_reader.interpolate)"""
+        _compression = self._reader(self.segments[0]["file"]).change_compression if self.segments else None
+        return _interpolate(self, times, _compression)
+
+    def read_setting(self, mode, start=None, stop=None):
+        """reads the log entries of a controller setting from the files overlapping the time window
+        (see log_reader.read_setting), settings repeated at the start of a rotated file are returned once"""
+        # a file holds the entries logged until the first live entry of the next file, the first file also
+        # the entries before its first live entry
+        _starts = [segment["start"] for segment in self.segments]
+        _first = 0 if start is None else max(int(np.searchsorted(_starts, start, side="left")) - 1, 0)
+        _last = len(self.segments) if stop is None else max(int(np.searchsorted(_starts, stop, side="left")), 1)
+        _parts = [self._reader(segment["file"]).read_setting(mode, start, stop)
+                  for segment in self.segments[_first:_last]]
+        if not _parts:
+            return {name: np.empty(0) for name in ("time",) + SETTING_GROUPS[mode][1]}
+        _setting = {name: np.concatenate([part[name] for part in _parts]) for name in _parts[0]}
+        _unique = np.unique(_setting["time"], return_index=True)[1]
+        return {name: values[_unique] for name, values in _setting.items()}
+
+    def close(self):
+        """closes all open log files"""
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
@@ -0,0 +1,543 @@
+import atexit
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os.path import basename, exists, getsize, join
+from time import monotonic
+import numpy as np
+from ls336.lib.log_compression import change_compressor, RECONSTRUCTION
+from ls336.lib.journal import journal_name, write_ahead_journal
+
+# version of the log file layout, stored in the attribute "format_version" of the log root
+# 1: groups T_sample, T_tip and P_heater each with data sets "time" and "data" (float64, at most 7e5 entries)
+# 2: one compound data set "live" of LIVE_DTYPE rows, unlimited length, optionally compressed
+FORMAT_VERSION = 2
+
+# live values: groups of format version 1, fields of LIVE_DTYPE in format version 2
+LIVE_GROUPS = ("T_sample", "T_tip", "P_heater")
+# one row per reading: time stamp in epoch time (float64 keeps sub ms resolution), values as float32
+LIVE_DTYPE = np.dtype([("time", "<f8"), ("T_sample", "<f4"), ("T_tip", "<f4"), ("P_heater", "<f4")])
+# rows per chunk of the live data set (80 kB, ~18 h at 1 Hz)
+LIVE_CHUNK = 4096
+# entries per chunk of the setting data sets
+SETTING_CHUNK = 64
+SETTING_GROUPS = {
+                 "set_point": ("T_set_point", ("set_point",)),
+                 "heater_mode": ("Heater_mode", ("heater_mode",)),
+                 "pid": ("PID_values", ("p", "i", "d")),
+                 "recipe": ("Recipe", ("step", "state")),
+                 "loop_metrics": ("PID_performance", ("set_point", "settling_time", "overshoot", "steady_state_error",
+                                                      "power_noise")),
+                 "autotune": ("PID_autotune", ("gain", "time_constant", "dead_time", "p", "i", "d")),
+                 }
+# results logged once (see pid_analytics), not repeated at the start of a segment like the settings
+SETTING_RESULTS = ("loop_metrics", "autotune")
+# data types of the setting values other than float64 (strings are stored as fixed length byte strings)
+SETTING_DTYPES = {
+                 "heater_mode": "S4",
+                 "step": np.int32,
+                 "state": "S8",
+                 }
+
+
+def log_file_name(save_path, device=None):
+    """returns the path of a new log file named after the current time
+
+    Args:
+        save_path (string): directory of the log file
+        device (string): optional device name added to the file name
+
+    Returns:
+        string: save_path/ls336_log_TIMESTAMP.hdf5 or save_path/ls336_log_DEVICE_TIMESTAMP.hdf5
+    """
+    _creation_timestamp = datetime.now()
+    _timestamp_string = f"{_creation_timestamp.date().isoformat()}_{_creation_timestamp.hour}h_{_creation_timestamp.minute}m_{_creation_timestamp.second}s"
+    _prefix = "ls336_log_" if device is None else f"ls336_log_{device}_"
+    return join(save_path, f"{_prefix}{_timestamp_string}.hdf5")
+
+
+def log_index_name(save_path, device=None):
+    """returns the path of the index file of the rotated log files in save_path
+
+    Args:
+        save_path (string): directory of the log files
+        device (string): optional device name
+
+    Returns:
+        string: save_path/ls336_log_index.json or save_path/ls336_log_DEVICE_index.json
+    """
+    return join(save_path, "ls336_log_index.json" if device is None else f"ls336_log_{device}_index.json")
+
+
+def compress_log_file(log_file, compression="gzip", compression_opts=9):
+    """rewrites a closed log file with all data sets compressed (and the shuffle filter),
+    the file is replaced only after the compressed copy is complete
+
+    Args:
+        log_file (string): path of the hdf5 log file
+        compression (string): "gzip" or "lzf"
+        compression_opts (int): gzip level
+    """
+    import h5py
+    _options = {"compression": compression, "shuffle": True,
+                "compression_opts": compression_opts if compression == "gzip" else None}
+    _temporary = f"{log_file}.tmp"
+
+    def _copy(source, destination):
+        destination.attrs.update(source.attrs)
+        for name, node in source.items():
+            if isinstance(node, h5py.Group):
+                _copy(node, destination.create_group(name))
+                continue
+            _dataset = destination.create_dataset(name, shape=node.shape, maxshape=node.maxshape,
+                                                  chunks=node.chunks, dtype=node.dtype, **_options)
+            _dataset.attrs.update(node.attrs)
+            # copy chunk wise, so other threads writing hdf5 files are not blocked for long
+            _step = max(node.chunks[0], 1) * 16
+            for start in range(0, node.shape[0], _step):
+                _dataset[start:start + _step] = node[start:start + _step]
+
+    with h5py.File(log_file, "r") as source, h5py.File(_temporary, "w") as destination:
+        _copy(source, destination)
+    os.replace(_temporary, log_file)
+
+
+class log_writer():
+    """Keeps a hdf5 log file open and writes the live values in blocks.
+
+    Live samples are collected in a preallocated array and written to the file when the block is full,
+    when flush_interval seconds have passed since the last write, on flush() and on close().
+    Live samples are stored as rows of the compound data set "live" (format version 2, see LIVE_DTYPE),
+    compressed with compression ("gzip", "lzf" or None) and the shuffle filter.
+    Data sets grow geometrically without limit, the number of valid entries is stored in the attribute
+    "length" of the live data set and of every setting group. On close() the data sets are trimmed to their valid length.
+
+    change_compression (keyword arguments of change_compressor, e.g. {"mode": "swinging_door", "deviation": (2e-3, 2e-3, 0.5)})
+    logs only the rows needed to reproduce the readings within the deviation. Mode, deviation, keepalive and
+    the reconstruction ("hold" or "linear") are stored as attributes "change_compression_*" of the live data set.
+
+    With group, all groups of the log are created below this group (e.g. one group per controller).
+    With shared_file, an open h5py.File shared by several writers is used instead of creating log_file,
+    the shared file is flushed but not closed by the writer.
+    With append, the entries are appended to the existing log log_file (with its change compression).
+
+    With journal, every entry is first appended to a write ahead journal (write_ahead_journal, file
+    journal_name(log_file, group)) and the hdf5 file is written asynchronously by a compaction thread: the caller
+    only copies the entry into the journal, blocks and settings are written to the hdf5 file in the background.
+    Entries are committed in the journal once they are flushed to the hdf5 file, the journal is removed on close().
+    After a crash, replay_journal() writes the entries not committed into the log file. The journal is created
+    before the hdf5 file is opened, a log file whose journal is in use (JournalError) is left untouched.
+    """
+    def __init__(self, log_file, block_size=64, flush_interval=30., group=None, shared_file=None,
+                 compression="gzip", compression_opts=4, change_compression=None, journal=False, append=False):
+        self.log_file = log_file
+        self.group = group
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == "gzip" else None
+        self.compressor = change_compressor(**change_compression) if change_compression is not None else None
+        self.journal = write_ahead_journal(journal_name(log_file, group), group) if journal else None
+
+        ### buffer for live values, rows of LIVE_DTYPE
+        self._buffer = np.empty(block_size, dtype=LIVE_DTYPE)
+        self._buffered = 0
+        self._last_flush = monotonic()
+        # number of blocks written to the file
+        self.blocks_written = 0
+
+        self._owns_file = shared_file is None
+        if self._owns_file:
+            # imported on first use, so starting the UI does not wait for h5py
+            import h5py
+            try:
+                self._file = h5py.File(log_file, "r+" if append else "w")
+            except BaseException:
+                if self.journal is not None:
+                    self.journal.close()
+                raise
+        else:
+            self._file = shared_file
+        if append and (group if group is not None else "live") in self._file:
+            self._root = self._file[group] if group is not None else self._file
+            self._resume_layout()
+        else:
+            self._root = self._file.create_group(group) if group is not None else self._file
+            self._create_layout()
+
+        ### compaction thread of the write ahead journal, see class doc
+        self._compaction = None
+        self._writes = []
+        # journal sequence number of the oldest entry not yet handed to the compaction thread
+        self._needed_seq = None
+        # journal sequence number of the first reading held back by the change compression
+        self._held_seq = None
+        if journal:
+            self._compaction = ThreadPoolExecutor(1, thread_name_prefix="ls336 log compaction")
+        atexit.register(self.close)
+
+### Properties
+
+    @property
+    def is_open(self):
+        """Returns True as long as the hdf5 file is held open
+
+        Returns:
+            bool: file state
+        """
+        return self._file is not None
+
+### Methods
+
+    def _create_layout(self):
+        """creates the (empty) data sets of the log file"""
+        self._root.attrs["format_version"] = FORMAT_VERSION
+        _live = self._root.create_dataset("live", shape=(0,), maxshape=(None,), chunks=(LIVE_CHUNK,),
+                                          dtype=LIVE_DTYPE, compression=self.compression,
+                                          compression_opts=self.compression_opts,
+                                          shuffle=self.compression is not None)
+        _live.attrs["length"] = 0
+        if self.compressor is not None:
+            _live.attrs["change_compression_mode"] = self.compressor.mode
+            _live.attrs["change_compression_deviation"] = self.compressor.deviation
+            _live.attrs["change_compression_keepalive"] = self.compressor.keepalive
+            _live.attrs["change_compression_reconstruction"] = RECONSTRUCTION[self.compressor.mode]
+
+        for group, names in SETTING_GROUPS.values():
+            self._create_setting_group(group, names)
+
+    def _create_setting_group(self, group, names):
+        """creates the (empty) group of a setting"""
+        _group = self._root.create_group(group)
+        _group.create_dataset("time", shape=(0,), maxshape=(None,), chunks=(SETTING_CHUNK,), dtype=np.float64)
+        for name in names:
+            _group.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(SETTING_CHUNK,),
+                                  dtype=SETTING_DTYPES.get(name, np.float64))
+        _group.attrs["length"] = 0
+
+    def _resume_layout(self):
+        """checks the layout of an existing log file, takes over its change compression"""
+        _live = self._root["live"]
+        _live.attrs["length"] = min(int(_live.attrs["length"]), _live.shape[0])
+        if "change_compression_mode" in _live.attrs:
+            self.compressor = change_compressor(_live.attrs["change_compression_mode"],
+                                                _live.attrs["change_compression_deviation"],
+                                                _live.attrs["change_compression_keepalive"])
+        else:
+            self.compressor = None
+        for group, names in SETTING_GROUPS.values():
+            if group not in self._root:
+                # log files written before the group was introduced
+                self._create_setting_group(group, names)
+
+    def _reserve(self, node, n):
+        """makes sure the data set node (or all data sets of the group node) can hold n additional entries,
+        grows them geometrically if not
+
+        Args:
+            node (h5py.Dataset or h5py.Group): data set or group of the log file with the attribute "length"
+            n (int): number of entries to be appended
+
+        Returns:
+            int: current number of valid entries of node
+        """
+        import h5py
+        _length = int(node.attrs["length"])
+        _needed = _length + n
+        for dataset in (node.values() if isinstance(node, h5py.Group) else (node,)):
+            if dataset.shape[0] < _needed:
+                dataset.resize(max(_needed, 2 * dataset.shape[0]), axis=0)
+        return _length
+
+    def append(self, time_stamp, mode, value):
+        """appends a log entry
+
+        Args:
+            time_stamp (float): epoch time of the entry
+            mode (string): "live_temp", "set_point", "heater_mode" or "pid"
+            value (misc): depending on mode:
+                        live_temp: 3-tuple of floats (T_sample, T_tip, Heater_power)
+                        set_point: float temperature set point
+                        heater_mode: string ("off","low", "mid", "high")
+                        pid: 3-tuple of floats (P, I, D)
+                        recipe: 2-tuple (step, state) of a running recipe (see recipe_runner)
+                        loop_metrics: 5-tuple of floats, metrics of a set point step (see loop_analyzer)
+                        autotune: 6-tuple of floats, result of an autotune (see autotune_runner)
+        """
+        if self.journal is not None:
+            if self.journal.full:
+                # the compaction thread fell behind
+                self.flush()
+            _seq = self.journal.append(time_stamp, mode, value)
+            if self._needed_seq is None:
+                self._needed_seq = _seq
+        if mode == "live_temp":
+            if self.compressor is None:
+                self._buffer_row(time_stamp, value)
+            else:
+                _rows = self.compressor.add(time_stamp, value)
+                if self.journal is not None:
+                    if _rows and _rows[-1][0] == time_stamp:
+                        self._held_seq = None
+                    elif _rows or self._held_seq is None:
+                        # the readings since the last logged row are needed to continue the compression
+                        self._held_seq = _seq
+                for row in _rows:
+                    self._buffer_row(*row)
+            if monotonic() - self._last_flush >= self.flush_interval:
+                self._write_block()
+        else:
+            self._submit(self._write_setting, time_stamp, mode, value,
+                         setting_seq=_seq if self.journal is not None else None)
+
+    def _write_setting(self, time_stamp, mode, value):
+        """writes a setting entry to the log file"""
+        group_name, names = SETTING_GROUPS[mode]
+        _values = value if len(names) > 1 else (value,)
+        _group = self._root[group_name]
+        _idx = self._reserve(_group, 1)
+        _group["time"][_idx] = time_stamp
+        for name, _value in zip(names, _values):
+            _group[name][_idx] = _value
+        _group.attrs["length"] = _idx + 1
+
+    def _buffer_row(self, time_stamp, value):
+        """adds a row of live values to the buffer, writes the buffer when it is full"""
+        self._buffer[self._buffered] = (time_stamp, value[0], value[1], value[2])
+        self._buffered += 1
+        if self._buffered == self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        """writes all buffered live values to the log file and flushes the file to disk"""
+        _n = self._buffered
+        # the compaction thread writes a copy, the buffer is refilled meanwhile
+        _rows = self._buffer[:_n].copy() if self._compaction is not None else self._buffer[:_n]
+        self._buffered = 0
+        if _n > 0:
+            self.blocks_written += 1
+        self._submit(self._write_rows, _rows)
+        self._last_flush = monotonic()
+
+    def _write_rows(self, rows):
+        """appends rows of LIVE_DTYPE to the live data set"""
+        if len(rows) == 0:
+            return
+        _live = self._root["live"]
+        _start = self._reserve(_live, len(rows))
+        _live[_start:_start + len(rows)] = rows
+        _live.attrs["length"] = _start + len(rows)
+
+    def _submit(self, write, *args, setting_seq=None):
+        """writes to the log file and flushes it to disk, with journal in the compaction thread
+        (setting_seq: journal sequence number of the setting entry written)
+
+        Raises:
+            Exception: Errors of previous writes of the compaction thread are raised
+        """
+        if self._compaction is None:
+            write(*args)
+            self._file.flush()
+            return
+        # all entries are handed over with this write, except buffered rows and readings held by the compression
+        if self._buffered == 0:
+            self._needed_seq = self._held_seq
+        _commit = self._needed_seq if self._needed_seq is not None else self.journal.next_seq
+        for future in [future for future in self._writes if future.done()]:
+            self._writes.remove(future)
+            future.result()
+        self._writes.append(self._compaction.submit(self._compact, write, args, _commit, setting_seq))
+
+    def _compact(self, write, args, commit, setting_seq=None):
+        """runs a write in the compaction thread, commits the journal entries before commit (and the setting entry
+        setting_seq) once they are on disk"""
+        write(*args)
+        self._file.flush()
+        if setting_seq is not None:
+            self.journal.commit_settings(setting_seq + 1)
+        self.journal.commit(commit)
+
+    def _wait(self):
+        """waits until the compaction thread wrote all entries handed over
+
+        Raises:
+            Exception: Errors of the compaction thread are raised
+        """
+        _writes, self._writes = self._writes, []
+        for future in _writes:
+            future.result()
+
+    def flush(self):
+        """writes all buffered live values (including the latest reading held back by the change compression)
+        to the log file and flushes the file to disk"""
+        if self._file is None:
+            return
+        if self.compressor is not None:
+            for row in self.compressor.flush():
+                self._buffer_row(*row)
+            self._held_seq = None
+        self._write_block()
+        self._wait()
+
+    def close(self):
+        """flushes the buffer, trims all data sets to their valid length and closes the log file (unless shared),
+        removes the journal"""
+        if self._file is None:
+            return
+        self.flush()
+        if self._compaction is not None:
+            self._compaction.shutdown()
+            self._compaction = None
+        _live = self._root["live"]
+        _live.resize(int(_live.attrs["length"]), axis=0)
+        for group, names in SETTING_GROUPS.values():
+            _group = self._root[group]
+            _length = int(_group.attrs["length"])
+            for dataset in _group.values():
+                dataset.resize(_length, axis=0)
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+        self._root = None
+        if self.journal is not None:
+            self.journal.close()
+        atexit.unregister(self.close)
+
+
+class rotating_log_writer():
+    """Log split into segments: a new log file (log_writer) is started every rotate_hours hours of
+    live values and when the current file exceeds rotate_mb MB.
+
+    Every segment is a complete log file, the latest setting values are repeated at the start of every segment.
+    The index file (log_index_name) lists the file name, the time range of the live values and the number of
+    live readings of every segment, it is updated whenever live values are written to the file.
+    With compress_finished, finished segments are rewritten compressed (compress_log_file) in a background thread,
+    e.g. to log uncompressed (compression=None) and archive compressed.
+    Further keyword arguments are passed to log_writer.
+    """
+    def __init__(self, save_path, device=None, rotate_hours=None, rotate_mb=None, compress_finished=False,
+                 **writer_options):
+        self.save_path = save_path
+        self.device = device
+        self.rotate_hours = rotate_hours
+        self.rotate_mb = rotate_mb
+        self.compress_finished = compress_finished
+        self.writer_options = writer_options
+        self.index_file = log_index_name(save_path, device)
+        self._index = {"device": device, "segments": []}
+        if exists(self.index_file):
+            with open(self.index_file) as f:
+                self._index = json.load(f)
+        self._settings = {}
+        self._compressing = []
+        self._writer = None
+        self._segment = None
+        self._start_segment()
+        atexit.register(self.close)
+
+### Properties
+
+    @property
+    def is_open(self):
+        """Returns True as long as the current segment is held open
+
+        Returns:
+            bool: file state
+        """
+        return self._writer is not None
+
+    @property
+    def log_file(self):
+        """Returns the path of the current segment
+
+        Returns:
+            string: path of the hdf5 log file
+        """
+        return self._writer.log_file if self._writer is not None else None
+
+### Methods
+
+    def _start_segment(self):
+        """creates the next segment and repeats the latest settings in it"""
+        _log_file = log_file_name(self.save_path, self.device)
+        _count = 1
+        while exists(_log_file):
+            # several segments within one second
+            _log_file = f"{log_file_name(self.save_path, self.device)[:-5]}_{_count}.hdf5"
+            _count += 1
+        self._writer = log_writer(_log_file, **self.writer_options)
+        self._segment = {"file": basename(_log_file), "start": None, "end": None, "entries": 0}
+        self._index["segments"].append(self._segment)
+        for mode, (time_stamp, value) in self._settings.items():
+            self._writer.append(time_stamp, mode, value)
+        self._write_index()
+
+    def _finish_segment(self):
+        """closes the current segment and starts compressing it"""
+        self._writer.close()
+        self._write_index()
+        if self.compress_finished:
+            _thread = threading.Thread(target=compress_log_file, args=(self._writer.log_file,),
+                                       name="ls336 log compression", daemon=True)
+            _thread.start()
+            self._compressing.append(_thread)
+        self._writer = None
+
+    def _write_index(self):
+        """writes the index file, replaces the previous index only after it is written completely"""
+        _temporary = f"{self.index_file}.tmp"
+        with open(_temporary, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(_temporary, self.index_file)
+
+    def rotate(self):
+        """finishes the current segment and starts a new one"""
+        if self._writer is None:
+            return
+        self._finish_segment()
+        self._start_segment()
+
+    def append(self, time_stamp, mode, value):
+        """appends a log entry to the current segment, rotates the segment if it is due (see log_writer.append)"""
+        if self._writer is None:
+            return
+        if mode != "live_temp":
+            if mode not in SETTING_RESULTS:
+                self._settings[mode] = (time_stamp, value)
+            self._writer.append(time_stamp, mode, value)
+            return
+
+        if (self.rotate_hours is not None and self._segment["start"] is not None
+                and time_stamp - self._segment["start"] >= self.rotate_hours * 3600):
+            self.rotate()
+        _blocks_written = self._writer.blocks_written
+        self._writer.append(time_stamp, mode, value)
+        if self._segment["start"] is None:
+            self._segment["start"] = time_stamp
+        self._segment["end"] = time_stamp
+        self._segment["entries"] += 1
+        if self._writer.blocks_written != _blocks_written:
+            # a block was just written to the file
+            self._write_index()
+            if self.rotate_mb is not None and getsize(self._writer.log_file) >= self.rotate_mb * 2**20:
+                self.rotate()
+
+    def flush(self):
+        """writes all buffered live values of the current segment and updates the index"""
+        if self._writer is None:
+            return
+        self._writer.flush()
+        self._write_index()
+
+    def close(self):
+        """closes the current segment and waits until all finished segments are compressed"""
+        if self._writer is not None:
+            self._finish_segment()
+        for thread in self._compressing:
+            thread.join()
+        self._compressing = []
+        atexit.unregister(self.close)
@@ -1,12 +1,38 @@
-from time import sleep
-from lakeshore import Model336
-from lakeshore.model_336 import Model336HeaterRange
+import os
+from math import isclose
+from time import monotonic, sleep, time
+from collections import namedtuple
+from ls336.lib.metrics import registry
 
 # # connects to first available ls336 control. If no instrument is found specify port number
 
+# live values read in one query: time stamp in epoch time, temperatures in Kelvin, heater output in percent
+live_snapshot = namedtuple("live_snapshot", ["time", "sample_temperature", "tip_temperature", "heater_power"])
+
+# read back of written settings: first wait in s, the wait doubles with every retry
+CONFIRM_INITIAL_WAIT = 0.01
+CONFIRM_RETRIES = 6
+# tolerances of the read back values (the controller rounds setpoints to 1 mK and PID values to 0.1)
+SETPOINT_TOLERANCE = 5e-4
+PID_TOLERANCE = 0.05
+# seconds a setting read from the controller is reused by the get_* properties, settings written through the setters
+# are cached right away. The settings only change when written, the TTL catches changes at the front panel
+SETTING_TTL = {
+              "set_point": 60.,
+              "heater_mode": 60.,
+              "pid": 300.,
+              }
+
 class local_intrument():
-    def __init__(self, heater_channel):
+    def __init__(self, heater_channel, backend=None, serial_number=None, com_port=None, setting_ttl=None):
+        # backend: "hardware" (default) or "sim" for a simulated controller, default from environment variable LS336_BACKEND
+        self.backend = backend if backend is not None else os.environ.get("LS336_BACKEND", "hardware")
+        # serial_number / com_port select a specific controller, the first available controller is used if both are None
+        self.serial_number = serial_number
+        self.com_port = com_port
         self.instrument = self.connect_ls336()
+        # the lakeshore driver is imported on connection (in the acquisition thread), not on program start
+        from lakeshore.model_336 import Model336HeaterRange
         self.heater_range = {
                             'OFF': Model336HeaterRange.OFF,
                             'LO': Model336HeaterRange.LOW,
@@ -14,6 +40,9 @@ class local_intrument():
                             'HI': Model336HeaterRange.HIGH
                             }
         self.heater_channel = heater_channel
+        # setting cache: TTL in s per setting ("set_point", "heater_mode", "pid"), 0 disables the cache of a setting
+        self.setting_ttl = dict(SETTING_TTL, **(setting_ttl or {}))
+        self._settings = {}
 
 ### Properties
 
@@ -46,42 +75,152 @@ class local_intrument():
 
     @property
     def get_setpoint(self):
-        """Returns the setpoint of output self.heater_channel
+        """Returns the setpoint of output self.heater_channel (cached for setting_ttl["set_point"] seconds)
 
         Returns:
             float: setpoint value in kelvin (preferred units of output self.heater_channel)
         """
-        return self.instrument.get_control_setpoint(self.heater_channel)
+        return self._cached("set_point", self._read_setpoint)
 
     @property
     def get_heater_range(self):
-        """Return current heater range setting of output self.heater_channel
+        """Return current heater range setting of output self.heater_channel (cached for setting_ttl["heater_mode"] seconds)
 
         Returns:
             Model336HeaterRange entry: heater range
         """
-        return self.instrument.get_heater_range(self.heater_channel)
+        return self._cached("heater_mode", self._read_heater_range)
 
     @property
     def get_heater_pid(self):
         """ returns the P, I and D values of the closed loop controler of output self.heater_channel
+        (cached for setting_ttl["pid"] seconds)
 
         :return: tuple of floats (P, I, D)
         """
+        return self._cached("pid", self._read_heater_pid)
+
+### Methods
+
+    @registry.timed("get_setpoint")
+    def _read_setpoint(self):
+        return self.instrument.get_control_setpoint(self.heater_channel)
+
+    @registry.timed("get_heater_range")
+    def _read_heater_range(self):
+        return self.instrument.get_heater_range(self.heater_channel)
+
+    @registry.timed("get_heater_pid")
+    def _read_heater_pid(self):
         _pid_dict = self.instrument.get_heater_pid(self.heater_channel)
         p, i ,d = _pid_dict["gain"], _pid_dict["integral"], _pid_dict["ramp_rate"]
         return (p,i,d)
 
-### Methods
+    def _cached(self, mode, read):
+        """returns the cached value of a setting, reads it from the controller if it is older than its TTL"""
+        _entry = self._settings.get(mode)
+        if _entry is not None and monotonic() - _entry[0] < self.setting_ttl[mode]:
+            registry.count("ls336_setting_cache_total", setting=mode, result="hit")
+            return _entry[1]
+        registry.count("ls336_setting_cache_total", setting=mode, result="miss")
+        return self._cache(mode, read())
+
+    def _cache(self, mode, value):
+        self._settings[mode] = (monotonic(), value)
+        return value
+
+    def invalidate_settings(self, *modes):
+        """removes settings from the cache, the next get_* reads them from the controller
+
+        Args:
+            *modes (strings): "set_point", "heater_mode" and/or "pid", all settings if none is given
+        """
+        for mode in modes or list(self._settings):
+            self._settings.pop(mode, None)
+
+    def refresh_settings(self):
+        """Reads all settings from the controller (one compound query) and replaces the cached values
+
+        Raises:
+            CommunicationFailure: Is raised if the response can not be parsed
+
+        Returns:
+            dict: all settings as returned by self.read_settings
+        """
+        self.invalidate_settings()
+        return self.read_settings()
+
+    @registry.timed("read_live_snapshot")
+    def read_live_snapshot(self):
+        """Reads sample temperature (channel A), tip temperature (channel B) and heater power of output
+        self.heater_channel with a single compound query (one round trip to the controller)
+
+        Raises:
+            CommunicationFailure: Is raised if the response can not be parsed
+
+        Returns:
+            live_snapshot: (time, sample_temperature, tip_temperature, heater_power), time in epoch time
+        """
+        _time_stamp = time()
+        _response = self.instrument.query(f"KRDG? A;KRDG? B;HTR? {self.heater_channel}")
+        try:
+            _sample, _tip, _heater = (float(value) for value in _response.split(";"))
+        except ValueError:
+            raise CommunicationFailure(f"Unexpected response to live value query: {_response!r}")
+        return live_snapshot(_time_stamp, _sample, _tip, _heater)
 
     def connect_ls336(self):
-        """conntects to first available ls336 intrument
+        """conntects to the ls336 intrument with self.serial_number or at self.com_port (first available ls336 if both are None),
+        or creates a simulated controller if self.backend is "sim"
 
         Returns:
             intrument class: a class representing the ls336 temperature controler
         """
-        return Model336()
+        if self.backend == "sim":
+            from ls336.lib.simulated import simulated_model336
+            _instrument = simulated_model336.from_environment()
+            if self.serial_number is not None:
+                _instrument.serial_number = self.serial_number
+            return _instrument
+        from lakeshore import Model336
+        return Model336(serial_number=self.serial_number, com_port=self.com_port)
+
+    def _confirm(self, read_back, matches, message):
+        """polls read_back until matches(value) is True. Waits CONFIRM_INITIAL_WAIT before the first read,
+        the wait doubles with every retry
+
+        Args:
+            read_back (callable): returns the current value(s) of the controller
+            matches (callable): returns True if the value is the expected one
+            message (string): message of the CommunicationFailure
 
+        Raises:
+            CommunicationFailure: Is raised if the value does not match after CONFIRM_RETRIES reads
+
+        Returns:
+            misc: the confirmed value
+        """
+        _wait = CONFIRM_INITIAL_WAIT
+        for _ in range(CONFIRM_RETRIES):
+            sleep(_wait)
+            try:
+                _value = read_back()
+            except (ValueError, CommunicationFailure):
+                _value = None
+            if _value is not None and matches(_value):
+                return _value
+            registry.count("ls336_retries_total")
+            _wait *= 2
+        raise CommunicationFailure(message)
+
+    def _setpoint_matches(self, setpoint, expected):
+        return isclose(setpoint, expected, abs_tol=SETPOINT_TOLERANCE)
+
+    def _pid_matches(self, pid_values, expected):
+        return all(isclose(value, expected_value, abs_tol=PID_TOLERANCE)
+                   for value, expected_value in zip(pid_values, expected))
+
+    @registry.timed("set_setpoint")
     def set_setpoint(self, setpoint):
         """Sets the temperature setpoint of heater output self.heater_channel
 
@@ -94,13 +233,14 @@ class local_intrument():
         Returns:
             float: new temperature setpoint in Kelvin
         """
+        self.invalidate_settings("set_point")
         self.instrument.set_control_setpoint(self.heater_channel, setpoint)
-        sleep(0.1) #wait for controler to set new value
-        setpoint_new = self.get_setpoint
-        if setpoint_new != setpoint:
-            raise CommunicationFailure("Setpoint was not set correctly!")
-        return setpoint_new
+        setpoint_new = self._confirm(self._read_setpoint,
+                                     lambda value: self._setpoint_matches(value, setpoint),
+                                     "Setpoint was not set correctly!")
+        return self._cache("set_point", setpoint_new)
 
+    @registry.timed("set_heater_range")
     def set_heater_range(self,range):
         """sets the heater range to enabele or disable output
 
@@ -113,13 +253,14 @@ class local_intrument():
         Returns:
             Model336HeaterRange entry: returns entry of IntEnum corresponding to set heater range
         """
+        self.invalidate_settings("heater_mode")
         self.instrument.set_heater_range(self.heater_channel, self.heater_range[range])
-        sleep(0.1) #wait for controler to set new value
-        new_range = self.get_heater_range
-        if new_range != self.heater_range[range]:
-            raise CommunicationFailure("Heater was not set correctly")
-        return new_range
+        new_range = self._confirm(self._read_heater_range,
+                                  lambda value: value == self.heater_range[range],
+                                  "Heater was not set correctly")
+        return self._cache("heater_mode", new_range)
 
+    @registry.timed("set_heater_pid")
     def set_heater_pid(self, pid_values):
         """sets the pid values of closed loop controller
 
@@ -132,12 +273,72 @@ class local_intrument():
         Returns:
             Model336HeaterRange entry: returns entry of IntEnum corresponding to set heater range
         """
+        self.invalidate_settings("pid")
         self.instrument.set_heater_pid(self.heater_channel, pid_values[0],pid_values[1],pid_values[2])
-        sleep(0.1) #wait for controler to set new value
-        new_pid_values = self.get_heater_pid
-        if new_pid_values != pid_values:
-            raise CommunicationFailure("PID values were not set correctly")
-        return new_pid_values
+        new_pid_values = self._confirm(self._read_heater_pid,
+                                       lambda value: self._pid_matches(value, pid_values),
+                                       "PID values were not set correctly")
+        return self._cache("pid", new_pid_values)
+
+    @registry.timed("read_settings")
+    def read_settings(self):
+        """Reads setpoint, heater range and PID values of output self.heater_channel with a single compound query,
+        the values replace the cached settings
+
+        Raises:
+            CommunicationFailure: Is raised if the response can not be parsed
+
+        Returns:
+            dict: {"set_point": float, "heater_mode": Model336HeaterRange entry, "pid": 3-tuple of floats (P, I, D)}
+        """
+        _response = self.instrument.query(f"SETP? {self.heater_channel};RANGE? {self.heater_channel};"
+                                          f"PID? {self.heater_channel}")
+        from lakeshore.model_336 import Model336HeaterRange
+        try:
+            _setpoint, _range, _pid = _response.split(";")
+            _settings = {
+                        "set_point": float(_setpoint),
+                        "heater_mode": Model336HeaterRange(int(_range)),
+                        "pid": tuple(float(value) for value in _pid.split(",")),
+                        }
+        except ValueError:
+            raise CommunicationFailure(f"Unexpected response to settings query: {_response!r}")
+        for mode, value in _settings.items():
+            self._cache(mode, value)
+        return _settings
+
+    @registry.timed("apply_settings")
+    def apply_settings(self, setpoint=None, heater_range=None, pid_values=None):
+        """Writes setpoint, heater range and PID values together and confirms them in one read back pass.
+        Settings passed as None are not changed
+
+        Args:
+            setpoint (float): temperature setpoint in Kelvin
+            heater_range (string): ('OFF', 'LO', 'MID', 'HI') key of dictonary self.heater_range
+            pid_values (3-tuple of floats): (p_value, i_value, d_value)
+
+        Raises:
+            CommunicationFailure: Is raised if a setting was not set correctly
+
+        Returns:
+            dict: all settings as returned by self.read_settings
+        """
+        self.invalidate_settings(*(mode for mode, value in (("set_point", setpoint), ("heater_mode", heater_range),
+                                                            ("pid", pid_values)) if value is not None))
+        if pid_values is not None:
+            self.instrument.set_heater_pid(self.heater_channel, pid_values[0], pid_values[1], pid_values[2])
+        if setpoint is not None:
+            self.instrument.set_control_setpoint(self.heater_channel, setpoint)
+        if heater_range is not None:
+            self.instrument.set_heater_range(self.heater_channel, self.heater_range[heater_range])
+
+        def _matches(settings):
+            return ((setpoint is None or self._setpoint_matches(settings["set_point"], setpoint))
+                    and (heater_range is None or settings["heater_mode"] == self.heater_range[heater_range])
+                    and (pid_values is None or self._pid_matches(settings["pid"], pid_values)))
+
+        settings = self._confirm(self.read_settings, _matches, "Settings were not set correctly")
+        return settings
 
 
 class CommunicationFailure(Exception):
@@ -0,0 +1,294 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter, time
+
+# upper bounds in seconds of the latency histogram buckets (the last bucket is unbounded)
+LATENCY_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _label_text(labels):
+    """returns labels as in the prometheus text format: {name="value",...}"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class latency_histogram():
+    """Histogram of latencies with fixed buckets (LATENCY_BUCKETS), count and sum as prometheus histograms."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+### Methods
+
+    def observe(self, seconds):
+        """adds a latency
+
+        Args:
+            seconds (float): latency in seconds
+        """
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """estimates a quantile by linear interpolation within its bucket
+
+        Args:
+            q (float): quantile between 0 and 1
+
+        Returns:
+            float: latency in seconds, None without observations
+        """
+        if self.count == 0:
+            return None
+        _rank = q * self.count
+        _cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and _cumulative + count >= _rank:
+                _low = self.buckets[index - 1] if index > 0 else 0.
+                _high = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(_low + (_high - _low) * (_rank - _cumulative) / count, self.max)
+            _cumulative += count
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "sum": self.sum, "max": self.max,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class metrics_registry():
+    """Thread safe collection of latency histograms and counters, identified by name and labels.
+
+    Latencies are recorded with timer() / timed(), counters with count(). The values are exported as
+    prometheus text (prometheus_text()), as dict for JSON (as_dict()) and as one line summary (summary()).
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+### Methods
+
+    def observe(self, name, seconds, **labels):
+        """adds a latency to the histogram name{labels}
+
+        Args:
+            name (string): metric name, e.g. "ls336_instrument_seconds"
+            seconds (float): latency in seconds
+            **labels: labels of the histogram, e.g. call="read_live_snapshot"
+        """
+        _key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            _histogram = self.histograms.get(_key)
+            if _histogram is None:
+                _histogram = self.histograms[_key] = latency_histogram()
+            _histogram.observe(seconds)
+
+    def count(self, name, increment=1, **labels):
+        """increments the counter name{labels}
+
+        Args:
+            name (string): metric name, e.g. "ls336_errors_total"
+            increment (int): increment
+            **labels: labels of the counter
+        """
+        _key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[_key] = self.counters.get(_key, 0) + increment
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """context manager recording the time spent in its block in the histogram name{labels}"""
+        _start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - _start, **labels)
+
+    def timed(self, call, name="ls336_instrument_seconds"):
+        """decorator recording the latency of every call in the histogram name{call=call} and
+        exceptions in the counter ls336_errors_total{call=call, type=exception class name}
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                _start = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                except Exception as e:
+                    self.count("ls336_errors_total", call=call, type=type(e).__name__)
+                    raise
+                finally:
+                    self.observe(name, perf_counter() - _start, call=call)
+            return wrapper
+        return decorator
+
+    def histogram(self, name, **labels):
+        """returns the histogram name{labels}, None if nothing was recorded yet"""
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name, **labels):
+        """returns the counter name{labels}, summed over all further labels not given"""
+        _labels = set(labels.items())
+        with self._lock:
+            return sum(value for (counter_name, counter_labels), value in self.counters.items()
+                       if counter_name == name and _labels <= set(counter_labels))
+
+    def prometheus_text(self):
+        """returns all metrics in the prometheus text exposition format
+
+        Returns:
+            string: metrics
+        """
+        _lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                _lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        _lines.append(f"{name}{_label_text(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                _lines.append(f"# TYPE {name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    _cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        _cumulative += count
+                        _lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {_cumulative}")
+                    _lines.append(f"{name}_sum{_label_text(labels)} {histogram.sum}")
+                    _lines.append(f"{name}_count{_label_text(labels)} {histogram.count}")
+        return "\n".join(_lines) + "\n"
+
+    def as_dict(self):
+        """returns all metrics for a JSON dump
+
+        Returns:
+            dict: {"time": epoch time, "counters": [...], "histograms": [...]} with name and labels of every metric
+        """
+        with self._lock:
+            return {
+                   "time": time(),
+                   "counters": [{"name": name, "labels": dict(labels), "value": value}
+                                for (name, labels), value in sorted(self.counters.items())],
+                   "histograms": [dict(histogram.as_dict(), name=name, labels=dict(labels))
+                                  for (name, labels), histogram in sorted(self.histograms.items())],
+                   }
+
+    def summary(self):
+        """returns a one line summary for the status bar: 95th percentile of the tick phases, errors and overruns
+
+        Returns:
+            string: summary
+        """
+        _parts = []
+        for phase in ("acquire", "log", "plot"):
+            _histogram = self.histogram("ls336_tick_seconds", phase=phase)
+            if _histogram is not None and _histogram.count:
+                _parts.append(f"{phase} {_histogram.quantile(0.95) * 1e3:.2f} ms")
+        _parts.append(f"errors {self.counter('ls336_errors_total')}")
+        _parts.append(f"retries {self.counter('ls336_retries_total')}")
+        _parts.append(f"overruns {self.counter('ls336_tick_overruns_total')}")
+        return "p95 " + " | ".join(_parts)
+
+    def reset(self):
+        """removes all metrics"""
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+# registry of the process, used by the instrument, the acquisition worker and the UI
+registry = metrics_registry()
+
+
+def metrics_handler():
+    """returns the request handler class of metrics_exporter, http.server is only imported if metrics are served"""
+    from http.server import BaseHTTPRequestHandler
+
+    class _metrics_handler(BaseHTTPRequestHandler):
+        """answers GET /metrics with the prometheus text and GET /metrics.json with the JSON dump"""
+        def do_GET(self):
+            if self.path == "/metrics":
+                _body, _type = self.server.registry.prometheus_text().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                _body, _type = json.dumps(self.server.registry.as_dict()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", _type)
+            self.send_header("Content-Length", str(len(_body)))
+            self.end_headers()
+            self.wfile.write(_body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return _metrics_handler
+
+
+class metrics_exporter():
+    """Exports a metrics registry: over http on host:port (GET /metrics, prometheus text format) and/or as
+    JSON file json_file, rewritten every interval seconds.
+    """
+    def __init__(self, metrics=registry, port=None, host="127.0.0.1", json_file=None, interval=10.):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.json_file = json_file
+        self.interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+### Methods
+
+    def start(self):
+        """starts the http server and the JSON dump
+
+        Raises:
+            OSError: Is raised if the port can not be opened
+        """
+        if self.port is not None:
+            from http.server import ThreadingHTTPServer
+            self._server = ThreadingHTTPServer((self.host, self.port), metrics_handler())
+            self._server.daemon_threads = True
+            self._server.registry = self.metrics
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="ls336 metrics",
+                                                  daemon=True))
+        if self.json_file is not None:
+            self._threads.append(threading.Thread(target=self._dump_loop, name="ls336 metrics dump", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def dump(self):
+        """writes the JSON file (atomically, readers never see a partial file)"""
+        _tmp_file = f"{self.json_file}.tmp"
+        with open(_tmp_file, "w") as f:
+            json.dump(self.metrics.as_dict(), f, indent=1)
+        os.replace(_tmp_file, self.json_file)
+
+    def _dump_loop(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+        self.dump()
+
+    def stop(self):
+        """stops the http server, writes the JSON file a last time"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join(5)
+        self._threads = []
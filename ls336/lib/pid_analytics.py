@@ -0,0 +1,424 @@
+import threading
+from datetime import datetime
+from time import monotonic, time
+import numpy as np
+from ls336.lib.log_writer import LIVE_DTYPE, SETTING_GROUPS
+
+# metrics of a set point step, logged in the group "PID_performance" of the log file (see loop_analyzer)
+LOOP_METRICS = SETTING_GROUPS["loop_metrics"][1]
+# results of an autotune, logged in the group "PID_autotune" of the log file (see autotune_runner)
+AUTOTUNE_RESULTS = SETTING_GROUPS["autotune"][1]
+# states of an autotune
+AUTOTUNE_STATES = ("running", "done", "aborted", "failed")
+# |T_sample - set point| in K within which the loop counts as settled
+SETTLE_TOLERANCE = 0.01
+# set point changes less than STEP_MERGE s apart belong to one step (ramps, corrections)
+STEP_MERGE = 60.
+# readings collected before they are folded into the metrics of the running step
+ANALYZER_BLOCK = 1024
+# ranges of the P, I and D values written (those of the PID spin boxes of the UI)
+PID_LIMITS = ((0.1, 1000.), (0., 1000.), (0., 200.))
+# integral time in s of I = 1: I is given in repeats per minute, output = P * (e + I / 60 * integral of e dt)
+INTEGRAL_UNIT = 60.
+# seconds to wait for the controller when reading or writing a setting
+WRITE_TIMEOUT = 30.
+
+
+class AutotuneError(Exception):
+    pass
+
+
+class loop_analyzer():
+    """Scores the temperature control loop per set point step, fed incrementally with readings and set points.
+
+    A step starts with a change of the set point, changes less than merge s apart (e.g. the writes of a ramp)
+    belong to the same step. The metrics (LOOP_METRICS) refer to the last change of the step:
+        set_point           set point in K
+        settling_time       s until T_sample stays within tolerance of the set point
+        overshoot           largest excursion of T_sample beyond the set point in the direction of the step,
+                            in percent of the step (NaN for the first set point and steps smaller than tolerance)
+        steady_state_error  mean of T_sample - set point in K since settled
+        power_noise         standard deviation of the heater output in percent since settled
+    settling_time, steady_state_error and power_noise are NaN as long as the loop is not settled.
+    Readings are buffered and folded block wise (vectorized) into running sums, so a reading costs one row
+    assignment and the memory does not grow with the length of a step.
+    """
+    def __init__(self, tolerance=SETTLE_TOLERANCE, merge=STEP_MERGE, block_size=ANALYZER_BLOCK):
+        self.tolerance = tolerance
+        self.merge = merge
+        ### current step: start (time of the first change), previous set point, set point, time of the last change
+        self.step = None
+        self._buffer = np.empty(block_size, dtype=LIVE_DTYPE)
+        self._buffered = 0
+        self._reset()
+
+### Methods
+
+    def _reset(self):
+        """resets the running sums, e.g. after a set point change"""
+        self._peak = -np.inf
+        self._settled_since = None
+        self._count = 0
+        self._error_sum = 0.
+        self._power_sum = 0.
+        self._power_square_sum = 0.
+
+    def add(self, time_stamp, value):
+        """adds a reading
+
+        Args:
+            time_stamp (float): epoch time of the reading
+            value (3-tuple of floats): (T_sample, T_tip, P_heater)
+        """
+        if self.step is None:
+            return
+        self._buffer[self._buffered] = (time_stamp, value[0], value[1], value[2])
+        self._buffered += 1
+        if self._buffered == len(self._buffer):
+            self._fold()
+
+    def add_rows(self, rows):
+        """adds readings, e.g. blocks of a log file
+
+        Args:
+            rows (numpy structured array): rows of LIVE_DTYPE sorted by time
+        """
+        if self.step is None:
+            return
+        self._fold()
+        self._fold_rows(rows)
+
+    def set_point(self, time_stamp, value):
+        """adds a set point (read or written), a change of the set point finishes the step unless the previous
+        change is less than merge s ago
+
+        Args:
+            time_stamp (float): epoch time of the set point
+            value (float): set point in K
+
+        Returns:
+            tuple: (start time, metrics dict) of the finished step, None if no step was finished
+        """
+        if self.step is not None and value == self.step["set_point"]:
+            return None
+        self._fold()
+        _finished = None
+        if self.step is not None and time_stamp - self.step["changed"] < self.merge:
+            self.step.update(set_point=value, changed=time_stamp)
+        else:
+            if self.step is not None:
+                _finished = (self.step["start"], self.metrics())
+            self.step = {"start": time_stamp, "previous": self.step["set_point"] if self.step is not None else None,
+                         "set_point": value, "changed": time_stamp}
+        self._reset()
+        return _finished
+
+    def metrics(self):
+        """Returns the metrics of the current step up to the latest reading
+
+        Returns:
+            dict: LOOP_METRICS -> float, None before the first set point
+        """
+        if self.step is None:
+            return None
+        self._fold()
+        _step = self.step
+        _size = abs(_step["set_point"] - _step["previous"]) if _step["previous"] is not None else 0.
+        _overshoot = (max(0., self._peak) / _size * 100. if _size >= self.tolerance and self._peak > -np.inf
+                      else np.nan)
+        if self._settled_since is None or self._count == 0:
+            return dict(zip(LOOP_METRICS, (_step["set_point"], np.nan, _overshoot, np.nan, np.nan)))
+        _mean_power = self._power_sum / self._count
+        return dict(zip(LOOP_METRICS, (_step["set_point"], self._settled_since - _step["changed"], _overshoot,
+                                       self._error_sum / self._count,
+                                       float(np.sqrt(max(0., self._power_square_sum / self._count - _mean_power**2))))))
+
+    def _fold(self):
+        """folds the buffered readings into the running sums"""
+        if self._buffered:
+            self._fold_rows(self._buffer[:self._buffered])
+            self._buffered = 0
+
+    def _fold_rows(self, rows):
+        rows = rows[rows["time"] >= self.step["changed"]]
+        if len(rows) == 0:
+            return
+        _error = rows["T_sample"].astype(np.float64) - self.step["set_point"]
+        if self.step["previous"] is not None and self.step["set_point"] != self.step["previous"]:
+            _direction = 1. if self.step["set_point"] > self.step["previous"] else -1.
+            self._peak = max(self._peak, float(np.max(_direction * _error)))
+        _outside = np.flatnonzero(np.abs(_error) > self.tolerance)
+        if len(_outside):
+            # settled only after the last reading outside of the tolerance
+            _first = int(_outside[-1]) + 1
+            _peak = self._peak
+            self._reset()
+            self._peak = _peak
+            if _first < len(rows):
+                self._settled_since = float(rows["time"][_first])
+        else:
+            _first = 0
+            if self._settled_since is None:
+                self._settled_since = float(rows["time"][0])
+        _power = rows["P_heater"][_first:].astype(np.float64)
+        self._count += len(_power)
+        self._error_sum += float(_error[_first:].sum())
+        self._power_sum += float(_power.sum())
+        self._power_square_sum += float(np.dot(_power, _power))
+
+
+def analyze_log(path, group=None, tolerance=SETTLE_TOLERANCE, merge=STEP_MERGE, block_rows=65536):
+    """scores the control loop of all set point steps of a log (see open_log and loop_analyzer), the live values
+    are read block wise
+
+    Args:
+        path (string): hdf5 log file or index file (*.json) of a rotated log
+        group (string): group of a shared log file
+        tolerance (float): settled within tolerance K of the set point
+        merge (float): set point changes less than merge s apart belong to one step
+        block_rows (int): rows read at a time
+
+    Returns:
+        list of tuples: (start time, metrics dict) per step, the last step is scored up to the end of the log
+    """
+    from ls336.lib.log_reader import open_log
+    _analyzer = loop_analyzer(tolerance, merge)
+    _steps = []
+    with open_log(path, group) as log:
+        _set_points = log.read_setting("set_point")
+        _times, _values = _set_points["time"], _set_points["set_point"]
+        _next = 0
+        for block in log.iter_live(block_rows):
+            # the set points logged within the block split it
+            _last = int(np.searchsorted(_times, block["time"][-1], side="right"))
+            _splits = np.searchsorted(block["time"], _times[_next:_last])
+            _first = 0
+            for split, time_stamp, value in zip(_splits, _times[_next:_last], _values[_next:_last]):
+                _analyzer.add_rows(block[_first:split])
+                _first = split
+                _finished = _analyzer.set_point(float(time_stamp), float(value))
+                if _finished is not None:
+                    _steps.append(_finished)
+            _analyzer.add_rows(block[_first:])
+            _next = _last
+        for time_stamp, value in zip(_times[_next:], _values[_next:]):
+            _finished = _analyzer.set_point(float(time_stamp), float(value))
+            if _finished is not None:
+                _steps.append(_finished)
+    if _analyzer.step is not None:
+        _steps.append((_analyzer.step["start"], _analyzer.metrics()))
+    return _steps
+
+
+def identify_model(times, inputs, temperature, max_dead_time=60.):
+    """fits a first order plus dead time model of the response of the temperature to an input:
+        time_constant * dT/dt = gain * input(t - dead_time) - (T - T_0)
+    The readings are resampled to their median interval, the discrete model T[k+1] = a T[k] + b input[k-d] + c
+    is fitted by least squares for all dead times d at once (closed form on centered sums) and the best fit is taken.
+
+    Args:
+        times (numpy.ndarray): epoch times of the readings, sorted
+        inputs (numpy.ndarray): input at the readings, e.g. the set point of a closed loop
+        temperature (numpy.ndarray): temperature in K
+        max_dead_time (float): longest dead time in s tried
+
+    Raises:
+        AutotuneError: Is raised if the readings do not show a stable response to the input
+
+    Returns:
+        tuple of floats: (gain in K per unit of the input, time constant in s, dead time in s)
+    """
+    if len(times) < 10:
+        raise AutotuneError(f"{len(times)} readings are too few to identify the loop")
+    _dt = float(np.median(np.diff(times)))
+    _grid = np.arange(times[0], times[-1], _dt)
+    _u = np.interp(_grid, times, inputs)
+    _y = np.interp(_grid, times, temperature)
+    _delays = np.arange(min(int(max_dead_time / _dt), len(_grid) // 2) + 1)
+    # per dead time d: T[k + 1] regressed on T[k] and input[k - d] for k = 0 .. n - 2, centered (absorbs c),
+    # the input before the first reading is taken as constant
+    _y0, _y1 = _y[:-1] - _y[:-1].mean(), _y[1:] - _y[1:].mean()
+    _u = np.concatenate([np.full(_delays[-1], _u[0]), _u])
+    _u0 = np.lib.stride_tricks.sliding_window_view(_u[:-1], len(_y0))[_delays[-1] - _delays]
+    _u0 = _u0 - _u0.mean(axis=1, keepdims=True)
+    _yy, _yu, _uu = _y0 @ _y0, _u0 @ _y0, np.einsum("ij,ij->i", _u0, _u0)
+    _y1y, _y1u = _y0 @ _y1, _u0 @ _y1
+    _det = _yy * _uu - _yu**2
+    # the input does not change within the window of a dead time
+    _valid = _det > 1e-9 * _yy * _uu
+    if not _valid.any():
+        raise AutotuneError("The readings do not excite the loop (constant input or temperature)")
+    _det = np.where(_valid, _det, 1.)
+    _a = (_y1y * _uu - _y1u * _yu) / _det
+    _b = (_yy * _y1u - _yu * _y1y) / _det
+    _residuals = np.where(_valid, _y1 @ _y1 - _a * _y1y - _b * _y1u, np.inf)
+    _best = int(np.argmin(_residuals))
+    a, b = float(_a[_best]), float(_b[_best])
+    if not 0. < a < 1. or b <= 0.:
+        raise AutotuneError(f"No stable response to the input found (a={a:.4g}, b={b:.4g})")
+    return b / (1. - a), -_dt / float(np.log(a)), float(_delays[_best] * _dt)
+
+
+def process_model(closed_loop_gain, closed_loop_time_constant, dead_time, p):
+    """returns the model of the process from the model of its proportional control loop (identify_model of the
+    response to the set point): with closed loop gain g = K P / (1 + K P) the process gain is
+    K = g / (P (1 - g)) and the time constant time_constant / (1 - g)
+
+    Args:
+        closed_loop_gain (float): K per K of set point
+        closed_loop_time_constant (float): s
+        dead_time (float): s
+        p (float): P value of the loop in percent per K
+
+    Raises:
+        AutotuneError: Is raised if the closed loop gain is not between 0 and 1
+
+    Returns:
+        tuple of floats: (gain in K per percent heater output, time constant in s, dead time in s)
+    """
+    if not 0. < closed_loop_gain < 1.:
+        raise AutotuneError(f"Closed loop gain {closed_loop_gain:.3g} is not that of a proportional loop")
+    return (closed_loop_gain / (p * (1. - closed_loop_gain)), closed_loop_time_constant / (1. - closed_loop_gain),
+            dead_time)
+
+
+def pid_from_model(gain, time_constant, dead_time, closed_loop_time=None):
+    """returns PID values for a first order plus dead time model by the SIMC rules (PI control):
+        P = time_constant / (gain * (closed_loop_time + dead_time))
+        integral time = min(time_constant, 4 * (closed_loop_time + dead_time)), I = INTEGRAL_UNIT / integral time
+    limited to PID_LIMITS
+
+    Args:
+        gain (float): K per percent heater output
+        time_constant (float): s
+        dead_time (float): s
+        closed_loop_time (float): desired time constant of the closed loop in s, default: max(dead_time,
+                                  time_constant / 10), smaller is faster and less robust
+
+    Returns:
+        3-tuple of floats: (P, I, D) rounded to the resolution of the controller
+    """
+    if closed_loop_time is None:
+        closed_loop_time = max(dead_time, time_constant / 10.)
+    _p = time_constant / (gain * (closed_loop_time + dead_time))
+    _i = INTEGRAL_UNIT / min(time_constant, 4. * (closed_loop_time + dead_time))
+    return tuple(float(round(min(max(value, low), high), 1)) for value, (low, high) in zip((_p, _i, 0.), PID_LIMITS))
+
+
+class autotune_runner(threading.Thread):
+    """Tunes the PID values of the control loop by a step response test on its own thread through an
+    acquisition_worker.
+
+    The loop is switched to proportional control (set_heater_pid with the current P, I = D = 0), after
+    10 readings the set point is raised by step K and the readings of the following duration s (sampled every
+    sample_interval s on the latest reading of the worker) are fitted by a first order plus dead time model
+    (identify_model, process_model). The PID values are calculated by the SIMC rules (pid_from_model) and
+    written to the controller, with apply=False the previous PID values are restored. The set point is
+    restored afterwards, also if the autotune fails or is aborted.
+    The result is logged to the log file of the worker (group "PID_autotune": AUTOTUNE_RESULTS), every state
+    change (AUTOTUNE_STATES) is passed to on_state(state, description).
+    """
+    def __init__(self, worker, step=0.5, duration=600., sample_interval=1., closed_loop_time=None, apply=True,
+                 on_state=None):
+        super().__init__(name="autotune", daemon=True)
+        self.worker = worker
+        self.step = step
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.closed_loop_time = closed_loop_time
+        self.apply = apply
+        self.on_state = on_state
+        self.state = None
+        self.result = None
+        self._abort = threading.Event()
+
+### Methods
+
+    def abort(self):
+        """stops the autotune, set point and PID values are restored"""
+        self._abort.set()
+
+    def _set_state(self, state, description=""):
+        self.state = state
+        if self.on_state is not None:
+            self.on_state(state, description)
+
+    def _reading(self):
+        """returns the latest reading of the worker, requests a reading if the worker is not polling"""
+        _snapshot = self.worker.latest_snapshot
+        if _snapshot is None or not self.worker.polling:
+            _snapshot = self.worker.acquire().result(WRITE_TIMEOUT)
+        return _snapshot
+
+    def _record(self, readings, seconds):
+        """adds the readings of the next seconds to readings (time -> snapshot), returns False if aborted"""
+        _start = monotonic()
+        _tick = 0
+        while _tick * self.sample_interval < seconds:
+            if self._abort.wait(max(0., _start + _tick * self.sample_interval - monotonic())):
+                return False
+            _snapshot = self._reading()
+            if _snapshot is not None:
+                readings[_snapshot.time] = _snapshot
+            _tick += 1
+        return True
+
+    def _tune(self, set_point, pid):
+        """runs the step response test, returns the final state and its description"""
+        self.worker.write_setting("pid", (pid[0], 0., 0.)).result(WRITE_TIMEOUT)
+        _readings = {}
+        if not self._record(_readings, 10 * self.sample_interval):
+            return "aborted", "autotune aborted"
+        _step_time = time()
+        self.worker.write_setting("set_point", round(set_point + self.step, 3)).result(WRITE_TIMEOUT)
+        if not self._record(_readings, self.duration):
+            return "aborted", "autotune aborted"
+        _times = np.array(sorted(_readings))
+        _closed_loop = identify_model(_times, np.where(_times >= _step_time, set_point + self.step, set_point),
+                                      np.array([_readings[time_stamp].sample_temperature for time_stamp in _times]))
+        _model = process_model(*_closed_loop, pid[0])
+        _pid = pid_from_model(*_model, closed_loop_time=self.closed_loop_time)
+        self.result = dict(zip(AUTOTUNE_RESULTS, _model + _pid))
+        self.worker.log_entry("autotune", _model + _pid)
+        return "done", (f"gain {_model[0]:.3g} K/%, time constant {_model[1]:.3g} s, dead time {_model[2]:.3g} s "
+                        f"-> PID " + ",".join(f"{value:g}" for value in _pid) + ("" if self.apply else " (not applied)"))
+
+    def run(self):
+        try:
+            _set_point = self.worker.read_setting("set_point").result(WRITE_TIMEOUT)
+            _pid = self.worker.read_setting("pid").result(WRITE_TIMEOUT)
+        except Exception as e:
+            return self._set_state("failed", f"{type(e).__name__}: {e}")
+        self._set_state("running", f"P control, set point step {_set_point:g} K -> {_set_point + self.step:g} K "
+                                   f"for {self.duration:g} s")
+        try:
+            _state, _description = self._tune(_set_point, _pid)
+        except AutotuneError as e:
+            _state, _description = "failed", str(e)
+        except Exception as e:
+            _state, _description = "failed", f"{type(e).__name__}: {e}"
+        try:
+            if _state == "done" and self.apply:
+                _pid = tuple(self.result[name] for name in ("p", "i", "d"))
+            self.worker.write_setting("pid", _pid).result(WRITE_TIMEOUT)
+            self.worker.write_setting("set_point", _set_point).result(WRITE_TIMEOUT)
+        except Exception as e:
+            _state, _description = "failed", f"settings not restored: {type(e).__name__}: {e}"
+        self._set_state(_state, _description)
+
+
+def main(args):
+    """python -m ls336 analyze: prints the metrics of the set point steps of the logs given on the command line"""
+    from ls336.lib.log_reader import log_reader
+    for path in args.logs:
+        _groups = [None]
+        if not path.endswith(".json"):
+            with log_reader(path) as reader:
+                _groups = reader.groups or [None]
+        for group in _groups:
+            print(f"{path}{f' [{group}]' if group is not None else ''}")
+            print("start                set point [K]  settling [s]  overshoot [%]  error [mK]  heater noise [%]")
+            for start, metrics in analyze_log(path, group, args.tolerance, args.merge):
+                print(f"{datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S}  {metrics['set_point']:13.3f}  "
+                      f"{metrics['settling_time']:12.1f}  {metrics['overshoot']:13.1f}  "
+                      f"{metrics['steady_state_error'] * 1e3:10.2f}  {metrics['power_noise']:16.3f}")
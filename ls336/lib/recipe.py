@@ -0,0 +1,254 @@
+import json
+import threading
+from time import monotonic
+
+# heater ranges of the "range" step
+HEATER_RANGES = ("OFF", "LO", "MID", "HI")
+# states of a running recipe, logged with the step number in the group "Recipe" of the log file
+RECIPE_STATES = ("running", "stable", "done", "aborted", "timeout", "failed")
+# seconds to wait for the controller when writing a setting
+WRITE_TIMEOUT = 30.
+
+
+class RecipeError(Exception):
+    pass
+
+
+def _number(step, key, value, positive=False):
+    try:
+        _value = float(value)
+    except (TypeError, ValueError):
+        raise RecipeError(f"Step {step}: {key} must be a number, got {value!r}")
+    if positive and _value <= 0:
+        raise RecipeError(f"Step {step}: {key} must be positive, got {value!r}")
+    return _value
+
+
+def parse_recipe(data):
+    """checks a recipe and returns its steps in normalized form
+
+    A recipe is a dict {"name": string, "steps": [...]} (or just the list of steps), every step is a dict with
+    one of the keys:
+        setpoint: 4.2                                           set point in K
+        ramp: {to: 10., rate: 0.5}                              ramp the set point from its current value with
+                                                                rate K/min
+        dwell: 600                                              wait 600 s
+        range: LO                                               heater range ('OFF', 'LO', 'MID', 'HI')
+        pid: [50, 20, 0]                                        P, I and D values
+        stable: {tolerance: 0.01, duration: 300, timeout: 3600} wait until |T_sample - set point| <= tolerance for
+                                                                duration s, fail after timeout s (optional),
+                                                                channel: sample (default) or tip
+
+    Args:
+        data (dict or list): recipe as loaded from YAML/JSON
+
+    Raises:
+        RecipeError: Is raised if a step is invalid
+
+    Returns:
+        dict: {"name": string, "steps": list of dicts with the key "type" and the step parameters}
+    """
+    _name = data.get("name", "recipe") if isinstance(data, dict) else "recipe"
+    _steps = data.get("steps") if isinstance(data, dict) else data
+    if not isinstance(_steps, list) or not _steps:
+        raise RecipeError("A recipe needs a list of steps")
+    _parsed = []
+    for index, step in enumerate(_steps, 1):
+        if not isinstance(step, dict) or len(step) != 1:
+            raise RecipeError(f"Step {index}: one of setpoint, ramp, dwell, range, pid, stable expected, got {step!r}")
+        (_type, _value), = step.items()
+        if _type == "setpoint":
+            _parsed.append({"type": _type, "value": _number(index, _type, _value)})
+        elif _type == "ramp":
+            if not isinstance(_value, dict) or "to" not in _value or "rate" not in _value:
+                raise RecipeError(f"Step {index}: ramp needs to (K) and rate (K/min)")
+            _parsed.append({"type": _type, "to": _number(index, "to", _value["to"]),
+                            "rate": _number(index, "rate", _value["rate"], positive=True)})
+        elif _type == "dwell":
+            _parsed.append({"type": _type, "duration": _number(index, _type, _value)})
+        elif _type == "range":
+            if str(_value).upper() not in HEATER_RANGES:
+                raise RecipeError(f"Step {index}: range must be one of {', '.join(HEATER_RANGES)}, got {_value!r}")
+            _parsed.append({"type": _type, "value": str(_value).upper()})
+        elif _type == "pid":
+            if not isinstance(_value, (list, tuple)) or len(_value) != 3:
+                raise RecipeError(f"Step {index}: pid needs three values [P, I, D]")
+            _parsed.append({"type": _type, "value": tuple(_number(index, _type, value) for value in _value)})
+        elif _type == "stable":
+            if not isinstance(_value, dict) or "tolerance" not in _value or "duration" not in _value:
+                raise RecipeError(f"Step {index}: stable needs tolerance (K) and duration (s)")
+            _channel = _value.get("channel", "sample")
+            if _channel not in ("sample", "tip"):
+                raise RecipeError(f"Step {index}: channel must be sample or tip, got {_channel!r}")
+            _timeout = _value.get("timeout")
+            _parsed.append({"type": _type, "tolerance": _number(index, "tolerance", _value["tolerance"], positive=True),
+                            "duration": _number(index, "duration", _value["duration"]),
+                            "timeout": _number(index, "timeout", _timeout, positive=True) if _timeout is not None else None,
+                            "channel": _channel})
+        else:
+            raise RecipeError(f"Step {index}: unknown step {_type}")
+    return {"name": str(_name), "steps": _parsed}
+
+
+def load_recipe(path):
+    """loads and checks a recipe from a YAML (.yaml, .yml, requires pyyaml) or JSON file (see parse_recipe)
+
+    Args:
+        path (string): path of the recipe file
+
+    Raises:
+        RecipeError: Is raised if the recipe is invalid
+
+    Returns:
+        dict: {"name": string, "steps": list of dicts}
+    """
+    with open(path) as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            import yaml
+            _data = yaml.safe_load(f)
+        else:
+            _data = json.load(f)
+    return parse_recipe(_data)
+
+
+def describe_step(step):
+    """returns a short description of a normalized step, e.g. for the status bar"""
+    if step["type"] == "ramp":
+        return f"ramp to {step['to']} K at {step['rate']} K/min"
+    if step["type"] == "dwell":
+        return f"dwell {step['duration']:g} s"
+    if step["type"] == "stable":
+        return f"wait until stable within {step['tolerance']} K for {step['duration']:g} s"
+    if step["type"] == "pid":
+        return "PID " + ",".join(f"{value:g}" for value in step["value"])
+    return f"{step['type']} {step['value']}"
+
+
+class recipe_runner(threading.Thread):
+    """Runs the steps of a recipe (see parse_recipe) on its own thread through an acquisition_worker.
+
+    Timing does not depend on the GUI: waits use monotonic deadlines, the set point of a ramp is written
+    every ramp_interval seconds on a fixed schedule (not drifting with the time the writes take).
+    Stability is checked every check_interval seconds on the latest reading of the worker
+    (a reading is requested if the worker is not polling).
+    Every state change is logged to the log file of the worker (group "Recipe": step, state, see RECIPE_STATES)
+    and passed to on_state(step, state, description), step counts from 1, 0 before the first step.
+    """
+    def __init__(self, worker, recipe, ramp_interval=1., check_interval=1., on_state=None):
+        super().__init__(name=f"recipe {recipe['name']}", daemon=True)
+        self.worker = worker
+        self.recipe = recipe
+        self.ramp_interval = ramp_interval
+        self.check_interval = check_interval
+        self.on_state = on_state
+        self.step = 0
+        self.state = None
+        self.setpoint = None
+        self._abort = threading.Event()
+
+### Methods
+
+    def abort(self):
+        """stops the recipe after the current write, the settings are left as they are"""
+        self._abort.set()
+
+    def _set_state(self, state, description=""):
+        self.state = state
+        self.worker.log_entry("recipe", (self.step, state))
+        if self.on_state is not None:
+            self.on_state(self.step, state, description)
+
+    def _wait_until(self, deadline):
+        """waits until the monotonic deadline, returns False if the recipe was aborted"""
+        return not self._abort.wait(max(0., deadline - monotonic()))
+
+    def _write(self, mode, value):
+        return self.worker.write_setting(mode, value).result(WRITE_TIMEOUT)
+
+    def _write_setpoint(self, value):
+        # the controller resolves 1 mK
+        _value = round(value, 3)
+        if _value != self.setpoint:
+            self.setpoint = self._write("set_point", _value)
+
+    def _ramp(self, to, rate):
+        _start_value = self.setpoint
+        _duration = abs(to - _start_value) / rate * 60.
+        _direction = 1. if to >= _start_value else -1.
+        _start = monotonic()
+        _tick = 1
+        while _tick * self.ramp_interval < _duration:
+            if not self._wait_until(_start + _tick * self.ramp_interval):
+                return False
+            self._write_setpoint(_start_value + _direction * rate / 60. * _tick * self.ramp_interval)
+            _tick += 1
+        if not self._wait_until(_start + _duration):
+            return False
+        self._write_setpoint(to)
+        return True
+
+    def _reading(self):
+        """returns the latest reading of the worker, requests a reading if the worker is not polling"""
+        _snapshot = self.worker.latest_snapshot
+        if _snapshot is None or not self.worker.polling:
+            _snapshot = self.worker.acquire().result(WRITE_TIMEOUT)
+        return _snapshot
+
+    def _wait_stable(self, tolerance, duration, timeout, channel):
+        """returns True when stable, False if aborted, raises RecipeError on timeout"""
+        _start = monotonic()
+        _stable_since = None
+        _next_check = _start
+        while True:
+            _snapshot = self._reading()
+            _now = monotonic()
+            if _snapshot is not None and abs((_snapshot.sample_temperature if channel == "sample"
+                                              else _snapshot.tip_temperature) - self.setpoint) <= tolerance:
+                _stable_since = _now if _stable_since is None else _stable_since
+                if _now - _stable_since >= duration:
+                    return True
+            else:
+                _stable_since = None
+            if timeout is not None and _now - _start >= timeout:
+                self._set_state("timeout", f"not stable within {timeout:g} s")
+                raise RecipeError(f"Step {self.step}: temperature not stable within {timeout:g} s")
+            _next_check += self.check_interval
+            if not self._wait_until(_next_check):
+                return False
+
+    def _run_step(self, step):
+        """executes a step, returns False if the recipe was aborted"""
+        if step["type"] == "setpoint":
+            self._write_setpoint(step["value"])
+        elif step["type"] == "ramp":
+            return self._ramp(step["to"], step["rate"])
+        elif step["type"] == "dwell":
+            return self._wait_until(monotonic() + step["duration"])
+        elif step["type"] == "range":
+            self._write("heater_mode", step["value"])
+        elif step["type"] == "pid":
+            self._write("pid", step["value"])
+        elif step["type"] == "stable":
+            if not self._wait_stable(step["tolerance"], step["duration"], step["timeout"], step["channel"]):
+                return False
+            self._set_state("stable", describe_step(step))
+        return True
+
+    def run(self):
+        try:
+            self.setpoint = self.worker.read_setting("set_point").result(WRITE_TIMEOUT)
+            for self.step, step in enumerate(self.recipe["steps"], 1):
+                if self._abort.is_set():
+                    break
+                self._set_state("running", describe_step(step))
+                if not self._run_step(step):
+                    break
+            if self._abort.is_set():
+                self._set_state("aborted", f"{self.recipe['name']} aborted")
+            else:
+                self._set_state("done", f"{self.recipe['name']} done")
+        except RecipeError as e:
+            if self.state != "timeout":
+                self._set_state("failed", str(e))
+        except Exception as e:
+            self._set_state("failed", f"{type(e).__name__}: {e}")
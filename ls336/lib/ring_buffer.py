@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class ring_buffer():
+    """Fixed capacity buffer of time stamped samples with O(1) append.
+
+    Every sample is written twice (at position i and i + capacity) so the stored samples always form one
+    contiguous slice of the underlying array. time and channel() therefore return views without copying.
+    Samples older than retention seconds (relative to the latest sample) are hidden from the views.
+    """
+    def __init__(self, capacity, n_channels, retention=None):
+        self.capacity = capacity
+        self.n_channels = n_channels
+        self.retention = retention
+        ### row 0: epoch time stamps, rows 1...n_channels: values
+        self._data = np.full((n_channels + 1, 2 * capacity), np.nan, dtype=np.float64)
+        self._head = 0
+        self._size = 0
+
+### Properties
+
+    @property
+    def size(self):
+        """Returns the number of stored samples (including samples outside of the retention window)
+
+        Returns:
+            int: number of samples
+        """
+        return self._size
+
+    @property
+    def time(self):
+        """Returns the time stamps of the samples within the retention window
+
+        Returns:
+            numpy.ndarray: view of epoch time stamps, oldest first
+        """
+        return self._data[0, self._window()]
+
+### Methods
+
+    def _window(self):
+        """returns the slice of self._data holding the samples within the retention window"""
+        _start = (self._head - self._size) % self.capacity
+        _stop = _start + self._size
+        if self.retention is not None and self._size > 0:
+            _times = self._data[0, _start:_stop]
+            _start += int(np.searchsorted(_times, _times[-1] - self.retention, side="left"))
+        return slice(_start, _stop)
+
+    def append(self, time_stamp, values):
+        """appends a sample, overwrites the oldest sample once the buffer is full
+
+        Args:
+            time_stamp (float): epoch time of the sample
+            values (sequence of floats): one value per channel
+        """
+        _idx = self._head
+        self._data[0, _idx] = self._data[0, _idx + self.capacity] = time_stamp
+        self._data[1:, _idx] = self._data[1:, _idx + self.capacity] = values
+        self._head = (_idx + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def channel(self, idx):
+        """returns the values of channel idx within the retention window
+
+        Args:
+            idx (int): channel index (0 ... n_channels - 1)
+
+        Returns:
+            numpy.ndarray: view of the values, oldest first
+        """
+        return self._data[idx + 1, self._window()]
+
+    def latest(self):
+        """returns the latest sample
+
+        Returns:
+            numpy.ndarray: (time, value_0, ..., value_n)
+        """
+        return self._data[:, (self._head - 1) % self.capacity]
+
+    def clear(self):
+        """removes all samples"""
+        self._head = 0
+        self._size = 0
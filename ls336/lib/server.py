@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import socket
+import threading
+from collections import deque
+from time import monotonic
+from ls336.lib.ls_interface import live_snapshot
+
+logger = logging.getLogger("ls336")
+
+# control command -> setting mode of acquisition_worker
+CONTROL_COMMANDS = {
+                   "SETP": "set_point",
+                   "RANGE": "heater_mode",
+                   "PID": "pid",
+                   }
+# seconds to wait for the controller when answering a command
+CONTROL_TIMEOUT = 10.
+# readings queued per subscription, the oldest reading is dropped for slow clients
+SUBSCRIPTION_QUEUE = 64
+
+
+class ServerError(Exception):
+    pass
+
+
+def format_setting(mode, value):
+    """returns a setting value as sent to the clients
+
+    Args:
+        mode (string): "set_point", "heater_mode" or "pid"
+        value (misc): set point (float), heater range (enum with name 'OFF', 'LOW', ...) or (P, I, D)
+
+    Returns:
+        string: formatted value
+    """
+    if mode == "heater_mode":
+        return getattr(value, "name", f"{value}")
+    if mode == "pid":
+        return ",".join(f"{v}" for v in value)
+    return f"{value}"
+
+
+def format_snapshot(snapshot):
+    """returns a live_snapshot as sent to the clients: time,T_sample,T_tip,P_heater"""
+    return ",".join(f"{value}" for value in snapshot)
+
+
+class instrument_server():
+    """Asyncio server on localhost sharing the controllers of this process (UI or headless) with other programs.
+
+    workers is a dict device name -> acquisition_worker. The server runs its event loop in its own thread,
+    the acquisition callbacks hand their results over with publish_sample() and publish_setting().
+    Line based protocol, every command is answered with one line, errors with "ERROR <message>":
+        SNAP?                   -> time,T_sample,T_tip,P_heater of the latest reading
+        SETP? / SETP 10.5       -> temperature set point
+        RANGE? / RANGE LO       -> heater range ('OFF', 'LO', 'MID', 'HI')
+        PID? / PID 50,20,0      -> P, I and D values
+        SUB / UNSUB             -> OK, after SUB every new reading is sent as "SNAP time,T_sample,T_tip,P_heater"
+        DEVICES?                -> device names
+    With several controllers a command is sent to a specific controller by prefixing it with "@NAME ",
+    e.g. "@cryo2 SETP 10.5", without prefix the first controller is used. Streamed readings of
+    subscriptions carry the prefix "@NAME " if several controllers are served.
+
+    No client causes additional bus traffic for live values: SNAP? and subscriptions are served from the
+    readings of the acquisition worker. Setting queries are answered from the values read or written during
+    the last setting_max_age seconds, concurrent queries of the same setting share one read of the controller.
+    """
+    def __init__(self, workers, port, host="127.0.0.1", setting_max_age=5.):
+        self.workers = workers
+        self.port = port
+        self.host = host
+        self.setting_max_age = setting_max_age
+        self.latest = {}
+        self._settings = {}
+        self._pending = {}
+        self._subscribers = {name: set() for name in workers}
+        self._clients = set()
+        self._loop = None
+        self._stopped = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+### Properties
+
+    @property
+    def running(self):
+        """Returns True while the server accepts clients
+
+        Returns:
+            bool: server state
+        """
+        return self._thread is not None and self._thread.is_alive() and self._start_error is None
+
+### Methods
+
+    def start(self):
+        """starts the server thread, returns when the server accepts clients
+
+        Raises:
+            OSError: Is raised if the port can not be opened
+        """
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),), name="ls336 server", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+        logger.info(f"Instrument server listening on {self.host}:{self.port}")
+
+    def stop(self):
+        """closes all client connections and stops the server thread"""
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._thread.join(5)
+
+    def publish_sample(self, name, snapshot):
+        """hands a new reading to the server, may be called from any thread
+
+        Args:
+            name (string): device name
+            snapshot (live_snapshot): reading
+        """
+        self.latest[name] = snapshot
+        if self._loop is not None and self._subscribers[name]:
+            self._loop.call_soon_threadsafe(self._distribute, name, snapshot)
+
+    def publish_setting(self, name, mode, value):
+        """hands a setting read from or written to the controller to the server, may be called from any thread
+
+        Args:
+            name (string): device name
+            mode (string): "set_point", "heater_mode" or "pid"
+            value (misc): setting value
+        """
+        self._settings[(name, mode)] = (monotonic(), value)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            _server = await asyncio.start_server(self._handle, self.host, self.port, family=socket.AF_INET,
+                                                 reuse_address=True)
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+        async with _server:
+            await self._stopped.wait()
+            for writer in list(self._clients):
+                writer.close()
+        logger.info("Instrument server stopped")
+
+    def _distribute(self, name, snapshot):
+        """queues a reading for all subscribers of the device"""
+        for _queue in self._subscribers[name]:
+            if _queue.full():
+                _queue.get_nowait()
+            _queue.put_nowait(snapshot)
+
+    async def _stream(self, name, queue, writer):
+        """sends the readings of a subscription to the client"""
+        _prefix = f"@{name} " if len(self.workers) > 1 else ""
+        while True:
+            _snapshot = await queue.get()
+            writer.write(f"{_prefix}SNAP {format_snapshot(_snapshot)}\n".encode("ascii"))
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        """answers the commands of one client, one command per line"""
+        _streams = {}
+        self._clients.add(writer)
+        try:
+            while not reader.at_eof():
+                _line = (await reader.readline()).decode("ascii", errors="replace").strip()
+                if not _line:
+                    continue
+                try:
+                    _answer = await self.execute(_line, _streams, writer)
+                except Exception as e:
+                    _answer = f"ERROR {e}"
+                writer.write(f"{_answer}\n".encode("ascii", errors="replace"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for name, (queue, task) in _streams.items():
+                self._subscribers[name].discard(queue)
+                task.cancel()
+            self._clients.discard(writer)
+            writer.close()
+
+    async def execute(self, line, streams=None, writer=None):
+        """executes a command
+
+        Args:
+            line (string): command line, e.g. "SETP 10.5", "PID?" or "@cryo2 SNAP?"
+            streams (dict): subscriptions of the client, device name -> (queue, task)
+            writer (asyncio.StreamWriter): connection of the client, required for SUB
+
+        Raises:
+            ValueError: Is raised for unknown commands and devices or invalid values
+
+        Returns:
+            string: answer
+        """
+        _line = line.strip()
+        _name = next(iter(self.workers))
+        if _line.startswith("@"):
+            _name, _, _line = _line[1:].partition(" ")
+            if _name not in self.workers:
+                raise ValueError(f"Unknown device {_name}")
+        _worker = self.workers[_name]
+
+        _command, _, _argument = _line.strip().partition(" ")
+        _command = _command.upper()
+        if _command == "SNAP?":
+            if _name not in self.latest:
+                raise ValueError("No reading yet")
+            return format_snapshot(self.latest[_name])
+        if _command == "DEVICES?":
+            return ",".join(self.workers)
+        if _command == "SUB":
+            if _name not in streams:
+                _queue = asyncio.Queue(SUBSCRIPTION_QUEUE)
+                self._subscribers[_name].add(_queue)
+                streams[_name] = (_queue, asyncio.create_task(self._stream(_name, _queue, writer)))
+            return "OK"
+        if _command == "UNSUB":
+            if _name in streams:
+                _queue, _task = streams.pop(_name)
+                self._subscribers[_name].discard(_queue)
+                _task.cancel()
+            return "OK"
+
+        _query = _command.endswith("?")
+        _mode = CONTROL_COMMANDS.get(_command.rstrip("?"))
+        if _mode is None:
+            raise ValueError(f"Unknown command {_command}")
+        if _query:
+            return format_setting(_mode, await self._read_setting(_name, _mode))
+        if _mode == "set_point":
+            _value = float(_argument)
+        elif _mode == "heater_mode":
+            _value = _argument.strip().upper()
+        else:
+            _value = tuple(float(value) for value in _argument.split(","))
+            if len(_value) != 3:
+                raise ValueError("PID needs three values P,I,D")
+        _future = asyncio.wrap_future(_worker.write_setting(_mode, _value))
+        return format_setting(_mode, await asyncio.wait_for(_future, CONTROL_TIMEOUT))
+
+    async def _read_setting(self, name, mode):
+        """returns a setting from the cache or reads it, concurrent reads of the same setting are coalesced"""
+        _cached = self._settings.get((name, mode))
+        if _cached is not None and monotonic() - _cached[0] <= self.setting_max_age:
+            return _cached[1]
+        _pending = self._pending.get((name, mode))
+        if _pending is None:
+            _pending = asyncio.wrap_future(self.workers[name].read_setting(mode))
+            self._pending[(name, mode)] = _pending
+            _pending.add_done_callback(lambda _: self._pending.pop((name, mode), None))
+        return await asyncio.wait_for(asyncio.shield(_pending), CONTROL_TIMEOUT)
+
+
+class instrument_client():
+    """Blocking client of instrument_server, e.g. for lab scripts running next to the UI.
+
+    device selects the controller of a server with several controllers (None: the first one).
+    """
+    def __init__(self, port, host="127.0.0.1", device=None, timeout=CONTROL_TIMEOUT):
+        self._socket = socket.create_connection((host, port), timeout)
+        self._file = self._socket.makefile("rwb")
+        self._prefix = f"@{device} " if device is not None else ""
+        self._readings = deque()
+
+### Methods
+
+    def _read_line(self):
+        _line = self._file.readline()
+        if not _line:
+            raise ServerError("Connection closed by the server")
+        return _line.decode("ascii").strip()
+
+    def command(self, line):
+        """sends a command and returns the answer, readings of a subscription received meanwhile are kept
+
+        Args:
+            line (string): command, e.g. "SETP 10.5" or "PID?"
+
+        Raises:
+            ServerError: Is raised if the server answers with an error
+
+        Returns:
+            string: answer
+        """
+        self._file.write(f"{self._prefix}{line}\n".encode("ascii"))
+        self._file.flush()
+        while True:
+            _answer = self._read_line().removeprefix(self._prefix)
+            if _answer.startswith("SNAP "):
+                self._readings.append(self._parse(_answer[5:]))
+            elif _answer.startswith("ERROR "):
+                raise ServerError(_answer[6:])
+            else:
+                return _answer
+
+    @staticmethod
+    def _parse(text):
+        return live_snapshot(*(float(value) for value in text.split(",")))
+
+    def snapshot(self):
+        """returns the latest reading
+
+        Returns:
+            live_snapshot: (time, sample_temperature, tip_temperature, heater_power)
+        """
+        return self._parse(self.command("SNAP?"))
+
+    def readings(self):
+        """subscribes to the readings of the controller
+
+        Returns:
+            generator of live_snapshot: every new reading, blocks until the next reading
+        """
+        self.command("SUB")
+        while True:
+            while self._readings:
+                yield self._readings.popleft()
+            self._socket.settimeout(None)
+            _line = self._read_line().removeprefix(self._prefix)
+            if _line.startswith("SNAP "):
+                self._readings.append(self._parse(_line[5:]))
+
+    def close(self):
+        """closes the connection"""
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,160 @@
+import os
+import random
+import threading
+from time import monotonic, sleep
+from lakeshore import Model336
+
+# maximum heater power in W of the heater ranges OFF, LOW, MEDIUM, HIGH
+HEATER_POWER = (0., 0.5, 5., 50.)
+
+
+class SimulatedFault(Exception):
+    pass
+
+
+class simulated_model336(Model336):
+    """Simulated Lakeshore 336 for development and benchmarking without hardware.
+
+    Only the wire protocol (query/command) is replaced, all Model336 methods work as with a real controller.
+    A two stage thermal model is integrated on every access:
+        tip (channel B) coupled to the cold head at base_temperature,
+        sample (channel A) coupled to the tip and heated by the output of the closed loop controller.
+    Sensor readings carry gaussian noise. Every query/command takes latency seconds; with probability
+    fault_rate it fails: half of the faults time out (SimulatedFault after timeout seconds),
+    the other half return a corrupted response.
+    time_scale > 1 makes the simulated time pass faster than wall clock time.
+    """
+    def __init__(self, latency=0.01, fault_rate=0., timeout=2., time_scale=1., base_temperature=3.,
+                 noise=1e-3, seed=None):
+        # no connection: do not call Model336.__init__
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.noise = noise
+        self.serial_number = "SIMULATED"
+        self.device_serial = self.device_tcp = self.user_connection = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        ### thermal model: heat capacities in J/K, thermal conductances in W/K
+        self.base_temperature = base_temperature
+        self.c_sample, self.c_tip = 10., 20.
+        self.g_sample_tip, self.g_tip_base = 0.2, 0.5
+        self.t_sample = self.t_tip = base_temperature
+
+        ### controller state of the outputs 1 and 2
+        self.setpoint = {1: base_temperature, 2: base_temperature}
+        self.heater_range = {1: 0, 2: 0}
+        self.pid = {1: [50., 20., 0.], 2: [50., 20., 0.]}
+        self.output = {1: 0., 2: 0.}
+        self._integral = {1: 0., 2: 0.}
+        self._last_error = {1: 0., 2: 0.}
+        self._last_update = monotonic()
+
+### Methods
+
+    @classmethod
+    def from_environment(cls):
+        """creates a simulated controller configured by the environment variables
+        LS336_SIM_LATENCY, LS336_SIM_FAULT_RATE, LS336_SIM_TIME_SCALE (floats)
+
+        Returns:
+            simulated_model336: simulated controller
+        """
+        return cls(latency=float(os.environ.get("LS336_SIM_LATENCY", 0.01)),
+                   fault_rate=float(os.environ.get("LS336_SIM_FAULT_RATE", 0.)),
+                   time_scale=float(os.environ.get("LS336_SIM_TIME_SCALE", 1.)))
+
+    def _advance(self):
+        """integrates the thermal model and the control loops up to now"""
+        _now = monotonic()
+        _elapsed = (_now - self._last_update) * self.time_scale
+        self._last_update = _now
+        _steps = max(1, min(int(_elapsed / 0.1) + 1, 2000))
+        _dt = _elapsed / _steps
+        for _ in range(_steps):
+            _power = 0.
+            for output in (1, 2):
+                _error = self.setpoint[output] - self.t_sample
+                p, i, d = self.pid[output]
+                if self.heater_range[output] == 0:
+                    self._integral[output] = 0.
+                    self.output[output] = 0.
+                else:
+                    _derivative = (_error - self._last_error[output]) / _dt if _dt > 0 else 0.
+                    _output = p * (_error + self._integral[output] + d * _derivative)
+                    # no integration while the output is saturated (anti windup)
+                    if 0. < _output < 100. or _output * _error < 0:
+                        self._integral[output] += i / 60. * _error * _dt
+                    self.output[output] = min(max(_output, 0.), 100.)
+                    _power += self.output[output] / 100. * HEATER_POWER[self.heater_range[output]]
+                self._last_error[output] = _error
+            _flow_sample_tip = self.g_sample_tip * (self.t_sample - self.t_tip)
+            _flow_tip_base = self.g_tip_base * (self.t_tip - self.base_temperature)
+            self.t_sample += (_power - _flow_sample_tip) / self.c_sample * _dt
+            self.t_tip += (_flow_sample_tip - _flow_tip_base) / self.c_tip * _dt
+
+    def _transfer(self):
+        """simulates bus latency and faults, returns True if the response is to be corrupted"""
+        sleep(self.latency)
+        if self.fault_rate > 0 and self._random.random() < self.fault_rate:
+            if self._random.random() < 0.5:
+                sleep(self.timeout)
+                raise SimulatedFault("Simulated communication timeout")
+            return True
+        return False
+
+    def _execute(self, command):
+        """executes a single command, returns the response of queries"""
+        _name, _, _arguments = command.strip().partition(" ")
+        _arguments = [argument.strip() for argument in _arguments.split(",")] if _arguments else []
+        _name = _name.upper()
+        if _name == "*IDN?":
+            return "LSCI,MODEL336,SIMULATED,0.0"
+        elif _name == "KRDG?":
+            _temperature = self.t_sample if _arguments[0].upper() == "A" else self.t_tip
+            return f"{_temperature + self._random.gauss(0., self.noise):+.4f}"
+        elif _name == "HTR?":
+            return f"{self.output[int(_arguments[0])]:+.3f}"
+        elif _name == "SETP?":
+            return f"{self.setpoint[int(_arguments[0])]:+.3f}"
+        elif _name == "SETP":
+            self.setpoint[int(_arguments[0])] = round(float(_arguments[1]), 3)
+        elif _name == "RANGE?":
+            return f"{self.heater_range[int(_arguments[0])]}"
+        elif _name == "RANGE":
+            self.heater_range[int(_arguments[0])] = int(_arguments[1])
+        elif _name == "PID?":
+            return ",".join(f"{value:+.1f}" for value in self.pid[int(_arguments[0])])
+        elif _name == "PID":
+            self.pid[int(_arguments[0])] = [round(float(value), 1) for value in _arguments[1:4]]
+        else:
+            raise SimulatedFault(f"Command not simulated: {command}")
+        return None
+
+    def query(self, query_string, *args, **kwargs):
+        """Simulates a query, several queries can be separated by semicolons
+
+        Returns:
+            string: response, responses of several queries are separated by semicolons
+        """
+        with self._lock:
+            _corrupt = self._transfer()
+            self._advance()
+            _responses = [self._execute(command) for command in query_string.split(";")]
+            _response = ";".join(response for response in _responses if response is not None)
+        if _corrupt:
+            return _response[:len(_response) // 2] + "#"
+        return _response
+
+    def command(self, command_string, *args, **kwargs):
+        """Simulates a command, several commands can be separated by semicolons"""
+        with self._lock:
+            _corrupt = self._transfer()
+            self._advance()
+            if _corrupt:
+                # the controller did not understand the command
+                return
+            for command in command_string.split(";"):
+                self._execute(command)
@@ -1,46 +1,126 @@
+import math
+import threading
 from functools import partial
 from datetime import datetime
-from time import mktime
-import h5py
-from os.path import join, exists
-from PyQt5.QtWidgets import QFileDialog
-from ls336.lib.ls_interface import local_intrument
+from os.path import exists
+import numpy as np
+from PyQt5.QtWidgets import QFileDialog, QApplication, QLabel
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from ls336.lib.acquisition import acquisition_worker
+from ls336.lib.adaptive import adaptive_interval
+from ls336.lib.log_writer import log_file_name, log_index_name
+from ls336.lib.decimation import decimation_pyramid
+from ls336.lib.history import log_history, latest_log
+from ls336.lib.journal import replay_journals
+from ls336.lib.metrics import metrics_exporter, registry
+from ls336.lib.pid_analytics import autotune_runner
+from ls336.lib.recipe import load_recipe, recipe_runner
 from .. import get_base_path
 
+
+class acquisition_signals(QObject):
+    """
+    Qt signals carrying the results of the acquisition worker thread into the GUI thread
+    """
+    sample = pyqtSignal(object)
+    setting = pyqtSignal(str, object)
+    error = pyqtSignal(object)
+    connected = pyqtSignal()
+    recipe_state = pyqtSignal(int, str, str)
+    autotune_state = pyqtSignal(str, str)
+    history = pyqtSignal(str, object, object, object)
+
+
+# number of samples kept for live plotting (~ 36 hours when reading every second)
+LIVE_VIEW_CAPACITY = 2**17
+# ms between two updates of the metrics summary in the status bar
+METRICS_UPDATE_INTERVAL = 2000
+
+
 class ctrl_ui():
-    def __init__(self, ui, heater_channel):
+    def __init__(self, ui, heater_channel, live_view_retention=24*3600, serial_number=None, com_port=None,
+                 rotate_hours=None, rotate_mb=None, compress_finished=False, preload_hours=None, adaptive=None,
+                 change_compression=None, control_port=None, control_host="127.0.0.1", metrics_port=None,
+                 metrics_json=None, metrics_interval=10., recipe=None, journal=True):
         self._ui = ui
         self.global_timestamp = datetime.now()
         self.save_path = get_base_path()
         self.log_file = None
+        ### log rotation (see rotating_log_writer), no rotation if rotate_hours and rotate_mb are None
+        self.rotate_hours = rotate_hours
+        self.rotate_mb = rotate_mb
+        self.compress_finished = compress_finished
+        ### change based compression of the live values: keyword arguments of change_compressor (None: log every reading)
+        self.change_compression = change_compression
+        ### write ahead journal of the log entries (see log_writer), journals of crashed sessions in self.save_path
+        ### are replayed into their log files on start (in the background, see self._loadHistory) and before a
+        ### log file is created
+        self.journal = journal
+        self.recovered = []
         self.temp_setpoint = None
         self.heater_mode = None
         self.read_time_interval = 10
         self.pid_values = (0,0,0)
+        self.live_view_active = False
+        ### adaptive read interval: keyword arguments of adaptive_interval (None: fixed interval at start up),
+        ### the update time is the longest interval
+        self.adaptive_options = adaptive
 
-        ### Initializing data array for live plotting (x,4) (x, 0: time stamps, 1: temp tip, 2: temp sample, 3: heater power)
-        self.time_stamp = []
-        self.tip_temp = []
-        self.sample_temp = []
-        self.heater_power = []
+        ### Initializing ring buffers for live plotting (time stamps, 0: temp sample, 1: temp tip, 2: heater power)
+        ### samples older than live_view_retention seconds are not plotted
+        ### the plots show the min/max decimation level matching the visible time range and plot width
+        self.live_data = decimation_pyramid(LIVE_VIEW_CAPACITY, 3, retention=live_view_retention)
+        self._updating_plots = False
+
+        ### values of the last preload_hours hours of the latest log in self.save_path, plotted before the live values
+        self.preload_hours = preload_hours
+        self.history = None
 
         # Start up procedure:
-        # - connect to ls336 temperature controller
+        # - replay journals and load the history in a background thread
+        # - start acquisition worker thread, which connects to ls336 temperature controller
         # - read all set values from instrument and update UI
-        self.ls336 = local_intrument(heater_channel)
+        self.signals = acquisition_signals()
+        self.signals.history.connect(self._showHistory)
+        self._loadHistory(replay=True)
+        self.ls336 = acquisition_worker(heater_channel, self.read_time_interval,
+                                        on_sample=self.signals.sample.emit,
+                                        on_setting=self.signals.setting.emit,
+                                        on_error=self.signals.error.emit,
+                                        on_connected=self.signals.connected.emit,
+                                        serial_number=serial_number, com_port=com_port)
         self._ui.ls336 = self.ls336
-        self.startUp(self.ls336)
         self.connectSignals(self.ls336)
+        self.ls336.start()
+
+        ### server sharing the controller with other programs (instrument_server), None without control_port
+        self.server = None
+        if control_port is not None:
+            self._startServer(control_port, control_host)
+
+        ### metrics (latencies of the controller calls and tick phases, errors) in the status bar and exported
+        ### over http (metrics_port) and/or as JSON file (metrics_json)
+        self.metrics_exporter = metrics_exporter(port=metrics_port, host=control_host, json_file=metrics_json,
+                                                 interval=metrics_interval)
+        self._startMetrics()
+        ### recipe running on its own thread (recipe_runner), recipe: recipe (load_recipe) started right away
+        self.recipe_runner = None
+        ### PID autotune running on its own thread (autotune_runner)
+        self.autotune_runner = None
+        self.startUp(self.ls336)
+
+        if recipe is not None:
+            self._startRecipe(recipe)
+        QApplication.instance().aboutToQuit.connect(self._shutDown)
 
     def connectSignals(self, controller_instance):
         """
 
-        :param controller_instance: ls336 controller instance (local_instrument())
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
         :return:
         """
         # Temperature set point
         self._ui.setSetPoint.clicked.connect(partial(self._setSetPoint, controller_instance))
-        self._ui.setSetPoint.clicked.connect(partial(self._getSetPoint, controller_instance))
 
         # Heater Setting
         self._ui.setHeaterSettingOff.clicked.connect(partial(self._setHeaterMode,controller_instance,"OFF"))
@@ -48,74 +128,185 @@ class ctrl_ui():
         self._ui.setHeaterSettingMid.clicked.connect(partial(self._setHeaterMode,controller_instance,"MID"))
         self._ui.setHeaterSettingHigh.clicked.connect(partial(self._setHeaterMode,controller_instance,"HI"))
 
-        self._ui.setHeaterSettingOff.clicked.connect(partial(self._getHeaterMode, controller_instance))
-        self._ui.setHeaterSettingLow.clicked.connect(partial(self._getHeaterMode, controller_instance))
-        self._ui.setHeaterSettingMid.clicked.connect(partial(self._getHeaterMode, controller_instance))
-        self._ui.setHeaterSettingHigh.clicked.connect(partial(self._getHeaterMode, controller_instance))
-
         # PID Setting
         self._ui.pidSet.clicked.connect(partial(self._setPidValues, controller_instance))
-        self._ui.pidSet.clicked.connect(partial(self._getPidValues, controller_instance))
+        self._ui.autotunePid.clicked.connect(self._startStopAutotune)
+        self.signals.autotune_state.connect(self._showAutotuneState)
 
         # update time
         self._ui.timeIntervalSet.clicked.connect(self._updateUpdateTime)
         self._ui.timeIntervalSet.clicked.connect(self._updateReadLoop)
+        self._ui.timeIntervalAdaptive.toggled.connect(self._updateReadLoop)
 
         # set logfile path
         self._ui.setSavePath.clicked.connect(self._setLogPath)
 
+        # recipes
+        self._ui.runRecipe.clicked.connect(self._loadRecipe)
+        self._ui.abortRecipe.clicked.connect(self._abortRecipe)
+        self.signals.recipe_state.connect(self._showRecipeState)
+
         # Start Read out loop
         self._ui.startStop.clicked.connect(partial(self._startStopReadLoop, controller_instance))
 
-        # Read out loop
-        self._ui.read_loop.timeout.connect(partial(self._readLiveParameters, controller_instance))
+        # Live view: choose decimation level on zoom, pan and resize
+        self._ui.liveViewHeater.sigXRangeChanged.connect(self._updatePlots)
+        self._ui.liveViewHeater.getViewBox().sigResized.connect(self._updatePlots)
+
+        # Results of the acquisition worker
+        self.signals.sample.connect(self._readLiveParameters)
+        self.signals.setting.connect(self._updateSetting)
+        self.signals.error.connect(self._showError)
+        self.signals.connected.connect(self._showConnected)
 
     def startUp(self, controller_instance):
         """
         Startup sequence for the remote control of the LS336 temperature controller
-        - gets temperature set point from controller and updates UI
-        - gets heater mode from controller and updates UI
-        - gets PID values for local control loop from controller and updates UI
+        - gets temperature set point, heater mode and PID values for local control loop from controller
+          (one query, fills the settings cache) and updates UI
         - sets update time for read loop to standard value defined in self.read_time_interval
-        :param controller_instance: ls336 controller instance (local_instrument())
+        The values are read by the acquisition worker and shown by self._updateSetting. The window is usable
+        while the worker connects, the controls writing settings are enabled once the controller is connected.
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
         """
-        self._getSetPoint(controller_instance)
-        self._getHeaterMode(controller_instance)
-        self._getPidValues(controller_instance)
+        controller_instance.refresh_settings()
         self._setUpdateTime(self.read_time_interval)
+        self._ui.timeIntervalAdaptive.setChecked(self.adaptive_options is not None)
 
-        self._ui.statusBar.showMessage(f"Log file save path: {self.save_path}")
+        self._setControlsEnabled(False)
+        self._ui.statusBar.showMessage("Connecting to LS336 ...")
 
-    def _readLiveParameters(self, controller_instance):
+    def _setControlsEnabled(self, enabled):
         """
-        Gets Temperature values and heater power from controller, writes them into class attributes,
-        updates ui labels ui.displaySampleTemp, ui.displayTipTemp, ui.displayHeaterPower,
-        updates plots in live view and triggers a log entry.
-        :param controller_instance:
-        :return:
+        Enables or disables the controls writing settings to the controller
+        :param enabled: (bool) True to enable the controls
         """
-        # get values from controller
-        self.time_stamp.append(datetime.now())
-        self.sample_temp.append(controller_instance.get_sample_temperature)
-        self.tip_temp.append(controller_instance.get_tip_temperature)
-        self.heater_power.append(controller_instance.get_heater_power)
+        for _control in (self._ui.setSetPoint, self._ui.setHeaterSettingOff, self._ui.setHeaterSettingLow,
+                         self._ui.setHeaterSettingMid, self._ui.setHeaterSettingHigh, self._ui.pidSet,
+                         self._ui.autotunePid):
+            _control.setEnabled(enabled)
+        self._ui.runRecipe.setEnabled(enabled and (self.recipe_runner is None or not self.recipe_runner.is_alive()))
 
-        # writing values to the UI
-        self._ui.displaySampleTemp.setText(f"{self.sample_temp[-1]:.3f}")
-        self._ui.displayTipTemp.setText(f"{self.tip_temp[-1]:.3f}")
-        self._ui.displayHeaterPower.setText(f"{self.heater_power[-1]:.2f}")
+    def _showConnected(self):
+        """
+        Enables the controls and shows the log file save path in the status bar once the controller is connected
+        """
+        self._setControlsEnabled(True)
+        _recovered = sum(entries for _, entries in self.recovered)
+        self._ui.statusBar.showMessage(f"Log file save path: {self.save_path}" +
+                                       (f" (recovered {_recovered} log entries of a crashed session)" if _recovered else ""))
 
-        # plotting values
-        _x = [mktime(dt.timetuple()) for dt in self.time_stamp]
+    def _showError(self, error):
+        """
+        Shows errors of the acquisition worker in the status bar
+        :param error: (Exception) raised in the acquisition worker
+        """
+        self._ui.statusBar.showMessage(f"Error: {error}")
 
-        self._ui.liveViewSampleTempPlot.setData(self.sample_temp, x=_x)
-        self._ui.liveViewTipTempPlot.setData(self.tip_temp, x=_x)
-        self._ui.liveViewHeaterPlot.setData(self.heater_power, x=_x)
+    def _startServer(self, port, host):
+        """
+        Starts the server sharing the controller with other programs, the server receives the readings and
+        settings directly in the acquisition worker thread
+        :param port: (int) port of the server
+        :param host: (string) address of the server
+        """
+        # asyncio is only imported if the server is used
+        from ls336.lib.server import instrument_server
+        self.server = instrument_server({"ls336": self.ls336}, port, host)
+        self.signals.sample.connect(partial(self.server.publish_sample, "ls336"), Qt.DirectConnection)
+        self.signals.setting.connect(partial(self.server.publish_setting, "ls336"), Qt.DirectConnection)
+        try:
+            self.server.start()
+        except OSError as e:
+            self._showError(f"Server not started: {e}")
 
-        # logging values
-        self._logFileUpdate(self.time_stamp[-1],"live_temp", (
-            self.sample_temp[-1], self.tip_temp[-1], self.heater_power[-1]
-        ))
+    def _startMetrics(self):
+        """
+        Shows the metrics summary (metrics_registry.summary) in the status bar and starts the metrics export
+        """
+        self._metricsLabel = QLabel()
+        self._ui.statusBar.addPermanentWidget(self._metricsLabel)
+        self._metricsTimer = QTimer()
+        self._metricsTimer.timeout.connect(lambda: self._metricsLabel.setText(registry.summary()))
+        self._metricsTimer.start(METRICS_UPDATE_INTERVAL)
+        try:
+            self.metrics_exporter.start()
+        except OSError as e:
+            self._showError(f"Metrics export not started: {e}")
+
+    def _shutDown(self):
+        """
+        Stops the server, the metrics export and the acquisition worker, which writes all buffered values to the
+        log file and closes it
+        """
+        if self.recipe_runner is not None:
+            self.recipe_runner.abort()
+            self.recipe_runner.join(5)
+        if self.autotune_runner is not None:
+            self.autotune_runner.abort()
+            self.autotune_runner.join(5)
+        if self.server is not None:
+            self.server.stop()
+        self.metrics_exporter.stop()
+        self.ls336.shutdown()
+        self.ls336.join(5)
+
+    def _readLiveParameters(self, snapshot):
+        """
+        Receives temperature values and heater power read by the acquisition worker, writes them into class attributes,
+        updates ui labels ui.displaySampleTemp, ui.displayTipTemp, ui.displayHeaterPower and
+        updates plots in live view. The values are logged by the acquisition worker.
+        :param snapshot: live_snapshot (time, sample_temperature, tip_temperature, heater_power) from local_intrument
+        :return:
+        """
+        with registry.timer("ls336_tick_seconds", phase="plot"):
+            self.live_data.append(snapshot.time, snapshot[1:])
+
+            # writing values to the UI
+            self._ui.displaySampleTemp.setText(f"{snapshot.sample_temperature:.3f}")
+            self._ui.displayTipTemp.setText(f"{snapshot.tip_temperature:.3f}")
+            self._ui.displayHeaterPower.setText(f"{snapshot.heater_power:.2f}")
+
+            # plotting values
+            self._updatePlots()
+
+    def _updatePlots(self):
+        """
+        Updates the plots in live view with the decimation level of self.live_data matching the visible time range
+        and the plot width. Only data within the visible range (padded by its width on both sides) is passed to the plots,
+        the whole retention window is passed while the x-axis auto range is enabled.
+        Preloaded values of self.history are plotted before the live values in the same resolution.
+        """
+        _live = self.live_data.raw.size > 0
+        if self._updating_plots or not (_live or self.history is not None):
+            return
+        self._updating_plots = True
+        try:
+            _x_min, _x_max = self._ui.liveViewHeater.viewRange()[0]
+            _width = self._ui.liveViewHeater.getViewBox().width()
+            if self._ui.liveViewHeater.getViewBox().autoRangeEnabled()[0]:
+                # follow the data: the whole retention window (and the preloaded values) is visible
+                _x_min = self.history.start if self.history is not None else self.live_data.raw.time[0]
+                _x_max = self.live_data.raw.time[-1] if _live else self.history.stop
+            _span = _x_max - _x_min
+            _max_points = max(2 * int(_width), 100)
+            _level = self.live_data.level_for(_x_min, _x_max, _max_points) if _live else 0
+            _live_start = self.live_data.raw.time[0] if _live else np.inf
+            if self.history is not None and _x_min - _span < _live_start:
+                _history = self.history.window(_x_min - _span, min(_x_max + _span, _live_start), _span / _max_points)
+            else:
+                _history = None
+
+            for channel, plot in enumerate([self._ui.liveViewSampleTempPlot,
+                                            self._ui.liveViewTipTempPlot,
+                                            self._ui.liveViewHeaterPlot]):
+                _x, _y = self.live_data.view(channel, _level, _x_min - _span, _x_max + _span)
+                if _history is not None:
+                    _x = np.concatenate((_history[0], _x))
+                    _y = np.concatenate((_history[1][:, channel], _y))
+                plot.setData(_y, x=_x)
+        finally:
+            self._updating_plots = False
 
     def _setLogPath(self):
         """
@@ -126,24 +317,156 @@ class ctrl_ui():
                                                     directory=get_base_path())
 
         self._ui.statusBar.showMessage(f"Log file save path: {self.save_path}")
+        if self.live_data.raw.size == 0:
+            self._loadHistory()
+
+    def _loadRecipe(self):
+        """
+        Opens a QFileDialog to choose a recipe file (YAML/JSON, see parse_recipe) and starts the recipe
+        """
+        _path, _ = QFileDialog.getOpenFileName(self._ui, "Choose recipe", directory=self.save_path,
+                                               filter="Recipes (*.yaml *.yml *.json)")
+        if not _path:
+            return
+        try:
+            _recipe = load_recipe(_path)
+        except Exception as e:
+            self._showError(f"Recipe not loaded: {e}")
+            return
+        self._startRecipe(_recipe)
+
+    def _startRecipe(self, recipe):
+        """
+        Starts a recipe on its own thread, the live view is started if it is not running (the recipe needs the
+        readings and logs its state to the log file)
+        :param recipe: (dict) recipe as returned by load_recipe
+        """
+        if self.recipe_runner is not None and self.recipe_runner.is_alive():
+            self._showError("A recipe is already running")
+            return
+        if not self.live_view_active:
+            self._startStopReadLoop(self.ls336)
+        self.recipe_runner = recipe_runner(self.ls336, recipe, on_state=self.signals.recipe_state.emit)
+        self.recipe_runner.start()
+        self._ui.runRecipe.setEnabled(False)
+        self._ui.abortRecipe.setEnabled(True)
+
+    def _abortRecipe(self):
+        """
+        Aborts the running recipe, the settings are left as they are
+        """
+        if self.recipe_runner is not None:
+            self.recipe_runner.abort()
+
+    def _showRecipeState(self, step, state, description):
+        """
+        Shows the state of the running recipe in the status bar
+        :param step: (int) current step, counting from 1
+        :param state: (string) state of the recipe (see RECIPE_STATES)
+        :param description: (string) description of the step or of the result
+        """
+        _recipe = self.recipe_runner.recipe
+        self._ui.statusBar.showMessage(f"Recipe {_recipe['name']} step {step}/{len(_recipe['steps'])} {state}: "
+                                       f"{description}")
+        if state not in ("running", "stable"):
+            self._ui.runRecipe.setEnabled(True)
+            self._ui.abortRecipe.setEnabled(False)
+
+    def _startStopAutotune(self):
+        """
+        Starts an autotune of the PID values on its own thread (see autotune_runner) or aborts the running one,
+        the live view is started if it is not running
+        """
+        if self.autotune_runner is not None and self.autotune_runner.is_alive():
+            self.autotune_runner.abort()
+            return
+        if not self.live_view_active:
+            self._startStopReadLoop(self.ls336)
+        self.autotune_runner = autotune_runner(self.ls336, on_state=self.signals.autotune_state.emit)
+        self.autotune_runner.start()
+        self._ui.autotunePid.setText("Abort")
+
+    def _showAutotuneState(self, state, description):
+        """
+        Shows the state of the autotune in the status bar
+        :param state: (string) state of the autotune (see AUTOTUNE_STATES)
+        :param description: (string) description of the test or of the result
+        """
+        self._ui.statusBar.showMessage(f"Autotune {state}: {description}")
+        if state != "running":
+            self._ui.autotunePid.setText("Tune")
+
+    def _loadHistory(self, replay=False):
+        """
+        Loads the last self.preload_hours hours of the latest log in self.save_path into the live view (see log_history)
+        in a background thread, so the window stays responsive. Only an overview is loaded, details are read from
+        the log when zooming in. The history is shown by self._showHistory.
+        :param replay: (bool) replay the journals of crashed sessions in self.save_path into their log files first
+        """
+        if not (self.preload_hours or replay):
+            return
+        threading.Thread(target=self._readHistory, args=(self.save_path, replay), name="ls336 history",
+                         daemon=True).start()
+
+    def _readHistory(self, save_path, replay):
+        """
+        Replays the journals (replay) and reads the history of save_path, runs in the background thread of
+        self._loadHistory and passes the results to self._showHistory through self.signals.history
+        :param save_path: (string) log directory
+        :param replay: (bool) replay the journals of crashed sessions first
+        """
+        _recovered = replay_journals(save_path) if replay else []
+        _history, _error = None, None
+        _log = latest_log(save_path) if self.preload_hours else None
+        if _log is not None:
+            try:
+                _history = log_history(_log, self.preload_hours)
+            except (OSError, KeyError, ValueError) as e:
+                _error = f"could not load {_log}: {e}"
+            else:
+                if _history.empty:
+                    _history.close()
+                    _history = None
+        self.signals.history.emit(save_path, _recovered, _history, _error)
+
+    def _showHistory(self, save_path, recovered, history, error):
+        """
+        Shows the history read by self._readHistory in the live view, histories of a previous log directory are
+        dropped
+        :param save_path: (string) log directory the history was read from
+        :param recovered: (list) log files and numbers of entries recovered from journals (see replay_journals)
+        :param history: (log_history) history to be plotted, None if there is none
+        :param error: (string) error reading the history, None if there was none
+        """
+        self.recovered += recovered
+        if recovered:
+            self._ui.statusBar.showMessage(f"Recovered {sum(entries for _, entries in recovered)} log entries of a "
+                                           f"crashed session")
+        if save_path != self.save_path:
+            if history is not None:
+                history.close()
+            return
+        if error is not None:
+            self._ui.statusBar.showMessage(f"Error: {error}")
+        if self.history is not None:
+            self.history.close()
+        self.history = history
+        self._updatePlots()
 
     def _createLogFile(self):
         """
         Creates hdf5 log file at self.save_path if the file does not exist yet.
-        The file can store 7e5 data points for each entry (~ 8 days of entries when reading every second)
+        The file is created and written by the acquisition worker.
+        The file is held open by a log_writer until the log file is closed, live values are written in blocks.
+        While the file is open, the number of valid entries is stored in the attribute "length".
+        With log rotation, a new file is started every self.rotate_hours hours or self.rotate_mb MB and
+        self.log_file is the index file listing all files of the log.
         The file has the following data entries:
-        
-        Sample temperature
-        group T_sample: time = list of epoch time as floats from datetime.datetime.timestamp()
-                        temp = list of floats 
-                        
-        Tip temperature
-        group T_tip:    time = list of epoch time as floats from datetime.datetime.timestamp()
-                        temp = list of floats 
-        Heater Power
-        group P_heater: time = list of epoch time as floats from datetime.datetime.timestamp()
-                        temp = list of floats 
-                        
+
+        Live values (format version 2, file attribute "format_version")
+        data set live:  rows of (time, T_sample, T_tip, P_heater), time = epoch time as float64,
+                        temperatures in Kelvin and heater power in percent as float32
+
         Temperature set point
         group T_set_point:  time = list of epoch time as floats from datetime.datetime.timestamp()
                             set_point = list of floats
@@ -159,107 +482,89 @@ class ctrl_ui():
                             d = list of floats
 
         """
-        _creation_timestamp = datetime.now()
-        _timestamp_string = f"{_creation_timestamp.date().isoformat()}_{_creation_timestamp.hour}h_{_creation_timestamp.minute}m_{_creation_timestamp.second}s"
-        self.log_file = join(self.save_path, f"ls336_log_{_timestamp_string}.hdf5")
-        with h5py.File(self.log_file, "w") as f:
-            # Live View data
-            t_sample_group = f.create_group("T_sample")
-            t_sample_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            t_sample_group.create_dataset("data", data = [], maxshape=(7e5,), chunks=True)
-
-            t_tip_group = f.create_group("T_tip")
-            t_tip_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            t_tip_group.create_dataset("data", data = [], maxshape=(7e5,), chunks=True)
-
-            p_heater_group = f.create_group("P_heater")
-            p_heater_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            p_heater_group.create_dataset("data", data = [], maxshape=(7e5,), chunks=True)
-
-            # Controller Settings
-            t_setpoint_group = f.create_group("T_set_point")
-            t_setpoint_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            t_setpoint_group.create_dataset("set_point", data = [], maxshape=(7e5,), chunks=True)
-
-            heater_mode_group = f.create_group("Heater_mode")
-            heater_mode_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            heater_mode_group.create_dataset("heater_mode", data = [], maxshape=(7e5,), chunks=True, dtype="S4")
-
-            pid_values_group = f.create_group("PID_values")
-            pid_values_group.create_dataset("time", data = [], maxshape=(7e5,), chunks=True)
-            pid_values_group.create_dataset("p", data = [], maxshape=(7e5,), chunks=True)
-            pid_values_group.create_dataset("i", data=[], maxshape=(7e5,), chunks=True)
-            pid_values_group.create_dataset("d", data=[], maxshape=(7e5,), chunks=True)
-
-    def _logFileUpdate(self,time_stamp,mode,value):
-        """
-        updates the log file defined in self.log_file by appending the respective lists of values
-
-        :param time_stamp (datetime): time stamp for log entry
-        :param mode (string): selects mode write mode. allowed values "live_temp", "set_point", "heater_mode" ,"pid"
-        :param value (misc): depending on mode:
-                            live_temp: 3-tuple of floats (T_sample, T_tip, Heater_power)
-                            set_point: float temperature set point
-                            heater_mode: string ("off","low", "mid", "high")
-                            pid: 3-tuple of floats (P, I, D)
-        """
-        with h5py.File(self.log_file, "a") as f:
-            if mode == "live_temp":
-                for idx, group in enumerate(["T_sample", "T_tip", "P_heater"]):
-                    _time = f[f"{group}/time"]
-                    _time.resize(_time.shape[0]+1,axis=0)
-                    _time[-1] = time_stamp.timestamp()
-                    _value = f[f"{group}/data"]
-                    _value.resize(_value.shape[0] + 1, axis=0)
-                    _value[-1] = value[idx]
-            elif mode == "set_point":
-                _time = f["T_set_point/time"]
-                _time.resize(_time.shape[0] + 1, axis=0)
-                _time[-1] = time_stamp.timestamp()
-                _value = f["T_set_point/set_point"]
-                _value.resize(_value.shape[0] + 1, axis=0)
-                _value[-1] = value
-            elif mode == "heater_mode":
-                _time = f["Heater_mode/time"]
-                _time.resize(_time.shape[0] + 1, axis=0)
-                _time[-1] = time_stamp.timestamp()
-                _value = f["Heater_mode/heater_mode"]
-                _value.resize(_value.shape[0] + 1, axis=0)
-                _value[-1] = value
-            elif mode == "pid":
-                _time = f["PID_values/time"]
-                _time.resize(_time.shape[0] + 1, axis=0)
-                _time[-1] = time_stamp.timestamp()
-                for idx, name in enumerate(["p", "i", "d"]):
-                    _value = f[f"PID_values/{name}"]
-                    _value.resize(_value.shape[0] + 1, axis=0)
-                    _value[-1] = value[idx]
+        self.recovered += replay_journals(self.save_path)
+        if self.rotate_hours is not None or self.rotate_mb is not None:
+            self.log_file = log_index_name(self.save_path)
+            self.ls336.open_rotating_log(self.save_path, None, self.rotate_hours, self.rotate_mb,
+                                         self.compress_finished, self.change_compression, self.journal)
+        else:
+            self.log_file = log_file_name(self.save_path)
+            self.ls336.open_log(self.log_file, change_compression=self.change_compression, journal=self.journal)
 
     def _getSetPoint(self, controller_instance):
         """
-        Gets temperature set point from controller and writes it to ui.setSetPointValue
-        :param controller_instance: ls336 controller instance (local_instrument())
+        Requests the temperature set point from controller, it is written to ui.setSetPointValue by self._showSetPoint
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
         """
-        self.temp_setpoint = controller_instance.get_setpoint
-        self._ui.setSetPointValue.setValue(self.temp_setpoint)
-
-        if self.log_file != None:
-            self._logFileUpdate(datetime.now(), "set_point", self.temp_setpoint)
+        controller_instance.read_setting("set_point")
 
     def _setSetPoint(self, controller_instance):
         """
         Sets temperature set point of ls336 temperature controller to value specified by ui.setSetPointValue
-        :param controller_instance: ls336 controller instance (local_instrument())
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
         """
         __setpoint = round(self._ui.setSetPointValue.value()*1000)/1000
-        controller_instance.set_setpoint(__setpoint)
+        controller_instance.write_setting("set_point", __setpoint)
 
     def _getHeaterMode(self, controller_instance):
         """
-        Gets heater mode from controller and sets respective Button to checked
-        :param controller_instance: ls336 controller instance (local_instrument())
+        Requests the heater mode from controller, the respective Button is set to checked by self._showHeaterMode
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
         """
-        self.heater_mode = controller_instance.get_heater_range
+        controller_instance.read_setting("heater_mode")
+
+    def _setHeaterMode(self, controller_instance, range):
+        """
+        Sets heater range of ls336 to range specified by "range"
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
+        :param range: (string) ("OFF", "LO", "MID", "HI")
+        """
+        controller_instance.write_setting("heater_mode", range)
+
+    def _getPidValues(self, controller_instance):
+        """
+        Requests P,I and D values from controller, they are written to ui.pValue/iValue/dValue by self._showPidValues
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
+        """
+        controller_instance.read_setting("pid")
+
+    def _setPidValues(self, controller_instance):
+        """
+        sets P,I and D values of controller to values specified in ui.pValue/iValue/dValue, respectively
+        :param controller_instance: acquisition worker of the ls336 controller (acquisition_worker())
+        """
+        __pid_values = (round(self._ui.pValue.value()*10)/10,round(self._ui.iValue.value()*10)/10,round(self._ui.dValue.value()*10)/10)
+        controller_instance.write_setting("pid", __pid_values)
+
+    def _updateSetting(self, mode, value):
+        """
+        Receives a setting read by the acquisition worker and updates the UI
+        :param mode: (string) "set_point", "heater_mode", "pid" or "loop_metrics"
+        :param value: setting value as returned by local_intrument
+        """
+        if mode == "set_point":
+            self._showSetPoint(value)
+        elif mode == "heater_mode":
+            self._showHeaterMode(value)
+        elif mode == "pid":
+            self._showPidValues(value)
+        elif mode == "loop_metrics":
+            self._showLoopMetrics(value)
+
+    def _showSetPoint(self, setpoint):
+        """
+        Writes temperature set point to ui.setSetPointValue
+        :param setpoint: (float) temperature set point in Kelvin
+        """
+        self.temp_setpoint = setpoint
+        self._ui.setSetPointValue.setValue(self.temp_setpoint)
+
+    def _showHeaterMode(self, heater_mode):
+        """
+        Sets respective heater mode Button to checked
+        :param heater_mode: Model336HeaterRange entry
+        """
+        self.heater_mode = heater_mode
         if self.heater_mode.value == 0:
             self._ui.setHeaterSettingLow.setChecked(False)
             self._ui.setHeaterSettingMid.setChecked(False)
@@ -281,39 +586,28 @@ class ctrl_ui():
             self._ui.setHeaterSettingHigh.setChecked(True)
             self._ui.setHeaterSettingOff.setChecked(False)
 
-
-        if self.log_file != None:
-            self._logFileUpdate(datetime.now(), "heater_mode", self.heater_mode.name)
-
-
-    def _setHeaterMode(self, controller_instance, range):
+    def _showPidValues(self, pid_values):
         """
-        Sets heater range of ls336 to range specified by "range"
-        :param controller_instance: ls336 controller instance (local_instrument())
-        :param range: (string) ("OFF", "LO", "MID", "HI")
+        Writes P,I and D values to ui.pValue/iValue/dValue, respectively
+        :param pid_values: 3-tuple of floats (P, I, D)
         """
-        controller_instance.set_heater_range(range)
-
-    def _getPidValues(self, controller_instance):
-        """
-        Gets P,I and D values from controller and writes it to ui.pValue/iValue/dValue, respectively
-        :param controller_instance: ls336 controller instance (local_instrument())
-        """
-        self.pid_values = controller_instance.get_heater_pid
+        self.pid_values = pid_values
         self._ui.pValue.setValue(self.pid_values[0])
         self._ui.iValue.setValue(self.pid_values[1])
         self._ui.dValue.setValue(self.pid_values[2])
 
-        if self.log_file != None:
-            self._logFileUpdate(datetime.now(), "pid", self.pid_values)
-
-    def _setPidValues(self, controller_instance):
+    def _showLoopMetrics(self, metrics):
         """
-        sets P,I and D values of controller to values specified in ui.pValue/iValue/dValue, respectively
-        :param controller_instance: ls336 controller instance (local_instrument())
+        Shows the metrics of a finished set point step in the status bar
+        :param metrics: (dict) metrics of the step (see loop_analyzer)
         """
-        __pid_values = (round(self._ui.pValue.value()*10)/10,round(self._ui.iValue.value()*10)/10,round(self._ui.dValue.value()*10)/10)
-        controller_instance.set_heater_pid(__pid_values)
+        if math.isnan(metrics["settling_time"]):
+            _settled = "not settled"
+        else:
+            _settled = (f"settled in {metrics['settling_time']:.0f} s, error {metrics['steady_state_error'] * 1e3:.1f} mK, "
+                        f"heater noise {metrics['power_noise']:.2f} %")
+        _overshoot = "" if math.isnan(metrics["overshoot"]) else f", overshoot {metrics['overshoot']:.0f} %"
+        self._ui.statusBar.showMessage(f"Step to {metrics['set_point']:g} K: {_settled}{_overshoot}")
 
     def _setUpdateTime(self, time_interval):
         """
@@ -331,11 +625,11 @@ class ctrl_ui():
 
     def _startStopReadLoop(self, controller_instance):
         """
-        Starts or stops the read loop Qtimer
+        Starts or stops polling of the live values by the acquisition worker
         """
-        _active = self._ui.read_loop.isActive()
+        _active = self.live_view_active
         if _active == False:
-            self._ui.read_loop.start(self.read_time_interval*1000)
+            self.live_view_active = True
             self._ui.startStop.setText("Stop")
             self._ui.liveViewSampleTemp.enableAutoRange()
             self._ui.liveViewTipTemp.enableAutoRange()
@@ -350,16 +644,23 @@ class ctrl_ui():
             self._getSetPoint(controller_instance)
             self._getHeaterMode(controller_instance)
             self._getPidValues(controller_instance)
+            controller_instance.start_polling()
 
         else:
-            self._ui.read_loop.stop()
+            controller_instance.stop_polling()
+            self.live_view_active = False
             self._ui.startStop.setText("Start")
 
     def _updateReadLoop(self):
         """
-        Updates the read loop time interval to value self.read_time_interval
+        Updates the read loop time interval to value self.read_time_interval. With ui.timeIntervalAdaptive checked,
+        the interval adapts to the temperature dynamics (adaptive_interval) up to self.read_time_interval
         :return:
         """
         self._updateUpdateTime()
-        self._ui.read_loop.setInterval(self.read_time_interval*1000)
-
+        self.ls336.set_interval(self.read_time_interval)
+        if self._ui.timeIntervalAdaptive.isChecked():
+            _options = dict(self.adaptive_options or {}, max_interval=self.read_time_interval)
+            self.ls336.set_adaptive(adaptive_interval(**_options))
+        else:
+            self.ls336.set_adaptive(None)
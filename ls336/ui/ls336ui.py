@@ -1,19 +1,63 @@
 import sys
 import os
-from PyQt5 import uic
+import glob
+import hashlib
+import importlib.util
+import tempfile
 from PyQt5.QtWidgets import QApplication, QMainWindow 
-from PyQt5.QtCore import QTimer
 import pyqtgraph as pg
 
 from .. import get_base_path
 from ..lib.ui_ctrl import ctrl_ui
 
+UI_FILE = os.path.join(get_base_path(), "ui", "ls336ui.ui")
+
+
+def compiled_ui(ui_file=UI_FILE):
+    """returns the form class (Ui_MainWindow) of ui_file. The form is compiled once with uic and cached as python
+    module named after the hash of ui_file in the __pycache__ directory next to ui_file (in the temp directory
+    if that is not writable), so starting the UI neither imports uic nor parses the ui file
+
+    Args:
+        ui_file (string): path of the Qt Designer file
+
+    Returns:
+        class: form class with the method setupUi(main_window)
+    """
+    with open(ui_file, "rb") as f:
+        _digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    _name = f"{os.path.splitext(os.path.basename(ui_file))[0]}_ui_{_digest}"
+    for cache_dir in (os.path.join(os.path.dirname(ui_file), "__pycache__"),
+                      os.path.join(tempfile.gettempdir(), "ls336_ui_cache")):
+        _module_file = os.path.join(cache_dir, f"{_name}.py")
+        if not os.path.exists(_module_file):
+            try:
+                from PyQt5 import uic
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(f"{_module_file}.tmp", "w") as f:
+                    uic.compileUi(ui_file, f)
+                os.replace(f"{_module_file}.tmp", _module_file)
+                # forms of previous versions of ui_file
+                for module_file in glob.glob(os.path.join(cache_dir, f"{_name.rsplit('_', 1)[0]}_*.py")):
+                    if module_file != _module_file:
+                        os.remove(module_file)
+            except OSError:
+                continue
+        _spec = importlib.util.spec_from_file_location(_name, _module_file)
+        _module = importlib.util.module_from_spec(_spec)
+        _spec.loader.exec_module(_module)
+        return _module.Ui_MainWindow
+    raise OSError(f"No writable directory to cache the compiled form of {ui_file}")
+
+
 class ls336_control(QMainWindow):
     def __init__(self):
         super().__init__()
-        uic.loadUi(os.path.join(get_base_path(),"ui",'ls336ui.ui'),self)
-        self.read_loop = QTimer()
-        self.read_loop.stop()
+        # widgets of the form become attributes of the window (as with uic.loadUi)
+        _form = compiled_ui()()
+        _form.setupUi(self)
+        for name, widget in vars(_form).items():
+            setattr(self, name, widget)
         self.defineLiveViewLayout()
 
 
@@ -53,7 +97,6 @@ class ls336_control(QMainWindow):
         # Heater power plot
         self.liveViewHeater.setLabel('left', 'Heater [%]')
         # self.liveViewHeater.setLimits(yMin=-0.05)
-        self.liveViewHeater.setXLink(self.liveViewHeater)
         self.liveViewHeaterPlot = self.liveViewHeater.plot(pen='g')
         self.liveViewHeater.setAxisItems({"bottom": pg.DateAxisItem()})
         tempXHeater = self.liveViewHeater.getAxis('bottom')
@@ -63,15 +106,18 @@ class ls336_control(QMainWindow):
 
 
 
-    def closeEvent(self, event):
-        self.read_loop.stop()
-
-def main():
-    HEATER_CHANNEL = 1
+def main(heater_channel=1, serial_number=None, com_port=None, rotate_hours=None, rotate_mb=None,
+         compress_finished=False, preload_hours=None, adaptive=None, change_compression=None,
+         control_port=None, control_host="127.0.0.1", metrics_port=None, metrics_json=None, metrics_interval=10.,
+         recipe=None, journal=True):
     ls336 = QApplication(sys.argv)
     gui = ls336_control()
     gui.show()
-    ctrl_ui(gui, HEATER_CHANNEL) #initializes controler
+    ctrl_ui(gui, heater_channel, serial_number=serial_number, com_port=com_port, rotate_hours=rotate_hours,
+            rotate_mb=rotate_mb, compress_finished=compress_finished, preload_hours=preload_hours,
+            adaptive=adaptive, change_compression=change_compression, control_port=control_port,
+            control_host=control_host, metrics_port=metrics_port, metrics_json=metrics_json,
+            metrics_interval=metrics_interval, recipe=recipe, journal=journal) #initializes controler
     sys.exit(ls336.exec())
     print("debug finished")
 
@@ -0,0 +1,28 @@
+import pytest
+from ls336.lib.adaptive import adaptive_interval
+from ls336.lib.ls_interface import live_snapshot
+
+
+def run(schedule, temperature, duration):
+    """polls temperature(t) for duration s, returns the time stamps of the readings"""
+    _times = [0.]
+    while _times[-1] < duration:
+        _t = _times[-1]
+        _times.append(_t + schedule.update(live_snapshot(_t, temperature(_t), temperature(_t), 10.)))
+    return _times
+
+
+def test_interval_backs_off_while_stable():
+    _schedule = adaptive_interval(0.5, 60., hold=10.)
+    _times = run(_schedule, lambda t: 4.2, 600.)
+    assert max(b - a for a, b in zip(_times, _times[1:])) == 60.
+    assert _schedule.trigger() == 0.5
+
+
+def test_drift_below_thresholds_limits_interval():
+    # 2 mK/s: below temperature_rate, but 120 mK in 60 s
+    _schedule = adaptive_interval(0.5, 60., temperature_rate=1e-2, temperature_step=0.05, hold=0.)
+    _times = run(_schedule, lambda t: 4.2 + 2e-3 * t, 600.)
+    _intervals = [b - a for a, b in zip(_times, _times[1:])]
+    assert max(_intervals) <= 12.5 + 1e-9
+    assert _intervals[-1] == pytest.approx(12.5)
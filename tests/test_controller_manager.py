@@ -0,0 +1,13 @@
+import pytest
+from ls336.lib.controller_manager import parse_device
+
+
+@pytest.mark.parametrize("text, device", [
+    ("cryo=LSA1234", {"name": "cryo", "serial_number": "LSA1234", "com_port": None, "heater_channel": 3}),
+    ("cryo=LSA1234:2", {"name": "cryo", "serial_number": "LSA1234", "com_port": None, "heater_channel": 2}),
+    ("A=COM3:2", {"name": "A", "serial_number": None, "com_port": "COM3", "heater_channel": 2}),
+    ("COM3", {"name": "COM3", "serial_number": None, "com_port": "COM3", "heater_channel": 3}),
+    ("B=/dev/ttyUSB0:1", {"name": "B", "serial_number": None, "com_port": "/dev/ttyUSB0", "heater_channel": 1}),
+])
+def test_parse_device(text, device):
+    assert parse_device(text, heater_channel=3) == device
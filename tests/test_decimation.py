@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from ls336.lib.decimation import decimation_pyramid
+
+
+@pytest.mark.parametrize("factor", [2, 4])
+def test_levels_match_brute_force_min_max(factor):
+    _random = np.random.default_rng(5)
+    _times = np.cumsum(_random.uniform(0.5, 1.5, 1000))
+    _values = _random.normal(size=(1000, 2))
+    # a spike, which has to survive every level
+    _values[517, 1] = 50.
+    pyramid = decimation_pyramid(4096, 2, factor=factor, n_levels=4)
+    for time_stamp, values in zip(_times, _values):
+        pyramid.append(time_stamp, values)
+    for k in range(1, 4):
+        _bucket = factor**k
+        _n = len(_times) // _bucket
+        for channel in range(2):
+            _time, _level = pyramid.view(channel, k)
+            _grouped = _values[:_n * _bucket, channel].reshape(_n, _bucket)
+            np.testing.assert_array_equal(_level[0::2], _grouped.min(axis=1))
+            np.testing.assert_array_equal(_level[1::2], _grouped.max(axis=1))
+            np.testing.assert_array_equal(_time[0::2], _times[:_n * _bucket:_bucket])
+            np.testing.assert_array_equal(_time[1::2], _times[_bucket - 1:_n * _bucket:_bucket])
+        assert pyramid.view(1, k)[1].max() == 50.
+
+
+def test_level_for_limits_points():
+    pyramid = decimation_pyramid(4096, 1, factor=4, n_levels=5)
+    for i in range(4000):
+        pyramid.append(float(i), (float(i),))
+    assert pyramid.level_for(0., 3999., 5000) == 0
+    _level = pyramid.level_for(0., 3999., 600)
+    assert len(pyramid.view(0, _level, 0., 3999.)[0]) <= 600
+    assert len(pyramid.view(0, _level - 1, 0., 3999.)[0]) > 600
+
+
+def test_clear_restarts_buckets():
+    pyramid = decimation_pyramid(64, 1, factor=2, n_levels=2)
+    pyramid.append(0., (5.,))
+    pyramid.clear()
+    pyramid.append(1., (1.,))
+    pyramid.append(2., (2.,))
+    np.testing.assert_array_equal(pyramid.view(0, 1)[1], [1., 2.])
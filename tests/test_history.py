@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from ls336.lib.history import OVERVIEW_BUCKETS, OVERVIEW_SAMPLES, _envelope, log_history
+from ls336.lib.log_writer import log_writer
+
+
+def write_log(log_file, times):
+    writer = log_writer(log_file, block_size=4096)
+    for i, time_stamp in enumerate(times):
+        writer.append(time_stamp, "live_temp", (np.sin(i / 50.), 4. + i % 7, float(i % 100)))
+    writer.close()
+
+
+@pytest.mark.parametrize("stop, hours", [(1708158535.5412154, 0.23117), (1.7e9 + 2048., 2048. / 3600),
+                                         (1.7e9 + 4096., 1.)])
+def test_overview_of_bucket_aligned_windows(tmp_path, stop, hours):
+    _times = stop - np.arange(int(hours * 3600) + 10)[::-1]
+    write_log(str(tmp_path / "log.hdf5"), _times)
+    history = log_history(str(tmp_path / "log.hdf5"), hours)
+    assert history.step == 1
+    _rows = history._log.read_live(history.start, np.nextafter(history.stop, np.inf))
+    _time, _values = history._overview
+    _expected = _envelope(_rows, history.bin_seconds)
+    np.testing.assert_array_equal(_time, _expected[0])
+    np.testing.assert_array_equal(_values, _expected[1])
+    history.close()
+
+
+def test_overview_is_decimated_and_zoom_reads_every_row(tmp_path):
+    _times = 1.7e9 + np.arange(3 * OVERVIEW_BUCKETS * OVERVIEW_SAMPLES)
+    write_log(str(tmp_path / "log.hdf5"), _times)
+    history = log_history(str(tmp_path / "log.hdf5"), 48)
+    assert history.step == 3
+    assert len(history._overview[0]) <= 2 * (OVERVIEW_BUCKETS + 1)
+    _time, _values = history.window(_times[100], _times[199], 0.5)
+    np.testing.assert_array_equal(_time, _times[100:200])
+    history.close()
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+from os.path import dirname, exists
+import numpy as np
+import pytest
+from ls336.lib.journal import JournalError, _read_records, journal_name, read_journal, replay_journal, write_ahead_journal
+from ls336.lib.log_reader import log_reader
+
+# writes 10 live rows (still buffered) and two settings, then dies without closing the log
+CRASH = """
+import os, sys, time
+from ls336.lib.log_writer import log_writer
+writer = log_writer(sys.argv[1], journal=True, change_compression={change_compression})
+for i in range(10):
+    writer.append(1000. + i, "live_temp", (10. + i, 11., 0.5))
+writer.append(1010.5, "set_point", 20.)
+writer.append(1010.6, "pid", (50., 20., 0.))
+writer.append(1010.7, "heater_mode", "high")
+writer._wait()
+os._exit(0)
+"""
+
+
+@pytest.mark.parametrize("change_compression", [None, {"mode": "deadband", "deviation": (0.5, 0.5, 0.5)}])
+def test_crash_replay_writes_settings_once(tmp_path, change_compression):
+    log_file = str(tmp_path / "log.hdf5")
+    subprocess.run([sys.executable, "-c", CRASH.format(change_compression=change_compression), log_file],
+                   check=True, env={**os.environ, "PYTHONPATH": dirname(dirname(__file__))})
+    assert exists(journal_name(log_file))
+    replay_journal(journal_name(log_file))
+    assert not exists(journal_name(log_file))
+    with log_reader(log_file) as reader:
+        np.testing.assert_array_equal(reader.read_setting("set_point")["time"], [1010.5])
+        np.testing.assert_array_equal(reader.read_setting("pid")["time"], [1010.6])
+        np.testing.assert_array_equal(reader.read_setting("heater_mode")["time"], [1010.7])
+        _times = reader.read_live()["time"]
+    assert len(_times) == len(np.unique(_times))
+    assert _times[0] == 1000. and _times[-1] == 1009.
+
+
+def test_journal_in_use_is_not_overwritten(tmp_path):
+    path = str(tmp_path / "log.hdf5.journal")
+    journal = write_ahead_journal(path)
+    journal.append(1000., "set_point", 20.)
+    with pytest.raises(JournalError):
+        write_ahead_journal(path)
+    journal.close(remove=False)
+    _group, records = read_journal(path)
+    assert len(records) == 1 and records[0]["values"][0] == 20.
+
+
+def test_concurrent_replay_finds_no_entries_left(tmp_path):
+    log_file = str(tmp_path / "log.hdf5")
+    subprocess.run([sys.executable, "-c", CRASH.format(change_compression=None), log_file],
+                   check=True, env={**os.environ, "PYTHONPATH": dirname(dirname(__file__))})
+    # a second replay opened the journal before the first one removed it
+    with open(journal_name(log_file), "r+b") as f:
+        assert replay_journal(journal_name(log_file))[1] == 10
+        assert len(_read_records(f, journal_name(log_file))[1]) == 0
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from ls336.lib.log_compression import change_compressor
+
+DEVIATION = (0.05, 0.05, 0.5)
+
+
+def compress(compressor, times, values):
+    """returns the logged rows of the readings (flushed at the end) as arrays of times and values"""
+    _rows = [row for time_stamp, reading in zip(times, values) for row in compressor.add(time_stamp, reading)]
+    _rows += compressor.flush()
+    return np.array([row[0] for row in _rows]), np.array([row[1] for row in _rows])
+
+
+def test_keepalive_row_within_door():
+    _times, _values = compress(change_compressor("swinging_door", (1., 1., 1.), keepalive=2.),
+                               [0., 1., 2.], [(0., 0., 0.), (-1., -1., -1.), (0.9, 0.9, 0.9)])
+    assert abs(np.interp(1., _times, _values[:, 0]) + 1.) <= 1.
+
+
+@pytest.mark.parametrize("keepalive", [3., 10., 600.])
+@pytest.mark.parametrize("mode", ["swinging_door", "deadband"])
+def test_reconstruction_error_of_random_walks(mode, keepalive):
+    _random = np.random.default_rng(336)
+    for walk in range(20):
+        _times = np.cumsum(_random.uniform(0.5, 1.5, 500))
+        _values = np.cumsum(_random.normal(0., (0.03, 0.03, 0.3), (500, 3)), axis=0)
+        _logged_times, _logged = compress(change_compressor(mode, DEVIATION, keepalive), _times, _values)
+        assert np.all(np.diff(_logged_times) <= keepalive + 1.5)
+        for channel in range(3):
+            if mode == "swinging_door":
+                _reconstructed = np.interp(_times, _logged_times, _logged[:, channel])
+            else:
+                _reconstructed = _logged[np.searchsorted(_logged_times, _times, side="right") - 1, channel]
+            assert np.all(np.abs(_reconstructed - _values[:, channel]) <= DEVIATION[channel] + 1e-9)
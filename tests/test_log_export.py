@@ -0,0 +1,64 @@
+import csv
+import numpy as np
+import pytest
+from ls336.lib.log_export import EXPORT_COLUMNS, export_log, join_settings
+from ls336.lib.log_writer import LIVE_DTYPE, log_writer
+
+
+def write_log(log_file):
+    writer = log_writer(log_file, block_size=16)
+    for i in range(100):
+        if i == 10:
+            writer.append(1010., "set_point", 20.)
+            writer.append(1010., "heater_mode", "high")
+        if i == 50:
+            writer.append(1050.5, "set_point", 25.)
+            writer.append(1050.5, "pid", (50., 20., 0.))
+        writer.append(1000. + i, "live_temp", (20. + i / 8, 4.5, float(i)))
+    writer.close()
+
+
+def test_join_settings_as_of_time():
+    _rows = np.zeros(5, dtype=LIVE_DTYPE)
+    _rows["time"] = [0., 1., 2., 3., 4.]
+    _settings = {"set_point": {"time": np.array([1., 3.]), "set_point": np.array([10., 30.])},
+                 "heater_mode": {"time": np.array([2.5]), "heater_mode": np.array(["low"], dtype=object)},
+                 "pid": {name: np.empty(0) for name in ("time", "p", "i", "d")}}
+    _columns = join_settings(_rows, _settings)
+    # an entry applies from its own time stamp on, rows before the first entry are missing
+    np.testing.assert_array_equal(_columns["set_point"], [np.nan, 10., 10., 30., 30.])
+    assert _columns["heater_mode"].tolist() == ["", "", "", "low", "low"]
+    assert np.isnan(_columns["p"]).all()
+
+
+@pytest.mark.parametrize("block_rows", [7, 1000])
+def test_csv_export(tmp_path, block_rows):
+    write_log(tmp_path / "log.hdf5")
+    assert export_log(str(tmp_path / "log.hdf5"), str(tmp_path / "log.csv"), block_rows=block_rows) == 100
+    assert not (tmp_path / "log.csv.tmp").exists()
+    with open(tmp_path / "log.csv", newline="") as f:
+        _table = list(csv.DictReader(f))
+    assert tuple(_table[0]) == EXPORT_COLUMNS and len(_table) == 100
+    assert [float(row["time"]) for row in _table] == [1000. + i for i in range(100)]
+    assert float(_table[3]["T_sample"]) == np.float32(20. + 3 / 8)
+    assert [row["set_point"] for row in _table[9:11]] == ["", "20.0"]
+    assert [row["set_point"] for row in _table[50:52]] == ["20.0", "25.0"]
+    assert {row["heater_mode"] for row in _table[10:]} == {"high"}
+    assert [(row["p"], row["i"], row["d"]) for row in _table[50:52]] == [("", "", ""), ("50.0", "20.0", "0.0")]
+
+
+def test_failed_export_leaves_no_file(tmp_path):
+    with pytest.raises(OSError):
+        export_log(str(tmp_path / "missing.hdf5"), str(tmp_path / "log.csv"))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_parquet_export(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_log(tmp_path / "log.hdf5")
+    assert export_log(str(tmp_path / "log.hdf5"), str(tmp_path / "log.parquet"), format="parquet", block_rows=30) == 100
+    _table = pq.read_table(tmp_path / "log.parquet").to_pydict()
+    assert tuple(_table) == EXPORT_COLUMNS
+    assert _table["time"] == [1000. + i for i in range(100)]
+    assert _table["set_point"][9] is None or np.isnan(_table["set_point"][9])
+    assert _table["set_point"][51] == 25. and _table["heater_mode"][10] == "high"
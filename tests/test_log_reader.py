@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from ls336.lib.log_reader import _time_column
+
+# reads after which search is considered to hang
+MAX_READS = 200
+
+
+class counting_dataset():
+    """array with the chunks attribute of a h5py data set, counting the reads"""
+    def __init__(self, values, chunk):
+        self.values = values
+        self.chunks = (chunk,)
+        self.reads = 0
+
+    def __getitem__(self, idx):
+        self.reads += 1
+        if self.reads > MAX_READS:
+            raise RuntimeError("search does not terminate")
+        return self.values[idx]
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 7, 64])
+@pytest.mark.parametrize("length", [1, 2, 3, 10, 101, 1000])
+def test_search_matches_bisect(chunk, length):
+    _random = np.random.default_rng(chunk * 1000 + length)
+    # unevenly sampled with repeated time stamps
+    _times = np.cumsum(_random.choice([0., 0.5, 1., 30.], length))
+    _values = np.concatenate([_times, _times + 0.25, [_times[0] - 1., _times[-1] + 1.]])
+    for value in _values:
+        _dataset = counting_dataset(_times, chunk)
+        assert _time_column(_dataset, length).search(value) == np.searchsorted(_times, value)
+
+
+def write_rotated_log(save_path):
+    """three segments of 100 s with live entries at 1 Hz and a set point in the middle of every segment,
+    the set point of the last segment is logged after its last live entry"""
+    from ls336.lib.log_writer import rotating_log_writer
+    writer = rotating_log_writer(str(save_path), rotate_hours=100. / 3600, block_size=16)
+    for segment in range(3):
+        for i in range(100):
+            writer.append(1000. + 100. * segment + i, "live_temp", (4.2, 4., 1.))
+            if i == 50 and segment < 2:
+                writer.append(1050.5 + 100. * segment, "set_point", 10. + segment)
+    writer.append(1299.5, "set_point", 12.)
+    writer.close()
+    return writer.index_file
+
+
+@pytest.mark.parametrize("start, stop, expected, files", [(None, None, [10., 11., 12.], 3),
+                                                          (1120., 1200., [11.], 1), (1050.5, 1151., [10., 11.], 2),
+                                                          (1250., 1400., [12.], 1), (0., 1000., [], 1)])
+def test_log_set_reads_settings_of_overlapping_files(tmp_path, start, stop, expected, files):
+    from ls336.lib.log_reader import log_set
+    with log_set(write_rotated_log(tmp_path)) as log:
+        _set_points = log.read_setting("set_point", start, stop)
+        assert _set_points["set_point"].tolist() == expected
+        assert len(log._readers) == files
+
+
+def test_log_set_without_files_returns_empty_setting():
+    from ls336.lib.log_reader import log_set
+    _pid = log_set([]).read_setting("pid")
+    assert list(_pid) == ["time", "p", "i", "d"] and all(len(values) == 0 for values in _pid.values())
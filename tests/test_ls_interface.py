@@ -0,0 +1,102 @@
+import pytest
+from ls336.lib import ls_interface
+from ls336.lib.ls_interface import CONFIRM_INITIAL_WAIT, CONFIRM_RETRIES, CommunicationFailure, local_intrument
+
+
+@pytest.fixture
+def instrument(monkeypatch):
+    monkeypatch.setenv("LS336_SIM_LATENCY", "0")
+    return local_intrument(1, backend="sim")
+
+
+@pytest.fixture
+def waits(monkeypatch):
+    """records the waits of _confirm instead of sleeping"""
+    _waits = []
+    monkeypatch.setattr(ls_interface, "sleep", _waits.append)
+    return _waits
+
+
+def test_setters_confirm_by_read_back(instrument, waits):
+    assert instrument.set_setpoint(12.3456) == pytest.approx(12.346)
+    assert instrument.set_heater_pid((40., 12.5, 0.)) == (40., 12.5, 0.)
+    assert instrument.set_heater_range("LO") == instrument.heater_range["LO"]
+    # confirmed with the first read back
+    assert waits == [CONFIRM_INITIAL_WAIT] * 3
+
+
+def test_confirm_waits_for_a_late_controller(instrument, waits):
+    _write = instrument.instrument.set_control_setpoint
+    _reads = []
+
+    def _read_setpoint(channel):
+        # the controller shows the new set point from the third read on
+        _reads.append(channel)
+        if len(_reads) == 3:
+            _write(channel, 20.)
+        return instrument.instrument.setpoint[channel]
+    instrument.instrument.set_control_setpoint = lambda channel, setpoint: None
+    instrument.instrument.get_control_setpoint = _read_setpoint
+    assert instrument.set_setpoint(20.) == 20.
+    assert waits == [CONFIRM_INITIAL_WAIT * 2**k for k in range(3)]
+
+
+def test_confirm_times_out(instrument, waits):
+    instrument.instrument.set_control_setpoint = lambda channel, setpoint: None
+    with pytest.raises(CommunicationFailure):
+        instrument.set_setpoint(20.)
+    assert waits == [CONFIRM_INITIAL_WAIT * 2**k for k in range(CONFIRM_RETRIES)]
+
+
+def test_apply_settings_confirms_in_one_pass(instrument, waits):
+    _settings = instrument.apply_settings(setpoint=15., heater_range="MID", pid_values=(30., 10., 0.))
+    assert _settings["set_point"] == 15.
+    assert _settings["heater_mode"] == instrument.heater_range["MID"]
+    assert _settings["pid"] == (30., 10., 0.)
+    assert waits == [CONFIRM_INITIAL_WAIT]
+
+
+def test_cached_settings_expire_after_their_ttl(instrument, monkeypatch):
+    _now = [1000.]
+    monkeypatch.setattr(ls_interface, "monotonic", lambda: _now[0])
+    _reads = []
+    _read = instrument.instrument.get_control_setpoint
+    instrument.instrument.get_control_setpoint = lambda channel: _reads.append(channel) or _read(channel)
+    instrument.setting_ttl["set_point"] = 60.
+    _setpoint = instrument.get_setpoint
+    # changed at the front panel
+    instrument.instrument.setpoint[1] = 25.
+    _now[0] += 59.
+    assert instrument.get_setpoint == _setpoint
+    _now[0] += 2.
+    assert instrument.get_setpoint == 25.
+    assert len(_reads) == 2
+
+
+def test_ttl_zero_disables_the_cache(monkeypatch):
+    monkeypatch.setenv("LS336_SIM_LATENCY", "0")
+    instrument = local_intrument(1, backend="sim", setting_ttl={"pid": 0.})
+    instrument.get_heater_pid
+    instrument.instrument.pid[1] = [1., 2., 3.]
+    assert instrument.get_heater_pid == (1., 2., 3.)
+
+
+def test_setters_cache_and_invalidate(instrument, waits):
+    instrument.set_setpoint(18.)
+    # cached by the setter, a change at the front panel is not seen before the TTL
+    instrument.instrument.setpoint[1] = 19.
+    assert instrument.get_setpoint == 18.
+    instrument.invalidate_settings("set_point")
+    assert instrument.get_setpoint == 19.
+    instrument.instrument.pid[1] = [5., 6., 7.]
+    instrument.instrument.setpoint[1] = 21.
+    instrument.invalidate_settings()
+    assert instrument.get_heater_pid == (5., 6., 7.)
+    assert instrument.get_setpoint == 21.
+
+
+def test_read_settings_refreshes_the_cache(instrument):
+    instrument.get_setpoint
+    instrument.instrument.setpoint[1] = 30.
+    assert instrument.refresh_settings()["set_point"] == 30.
+    assert instrument.get_setpoint == 30.
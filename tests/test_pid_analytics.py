@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from ls336.lib.log_writer import LIVE_DTYPE
+from ls336.lib.pid_analytics import (PID_LIMITS, AutotuneError, identify_model, loop_analyzer, pid_from_model,
+                                     process_model)
+
+
+def step_rows():
+    """readings at 1 Hz of a step 10 K -> 20 K at t = 100 s: linear rise to 21 K (10 % overshoot) until 110 s,
+    decay to 20.1 K at 119 s, then 20.005 K with the heater alternating 40 / 60 %"""
+    _rows = np.zeros(200, dtype=LIVE_DTYPE)
+    _time = np.arange(200.)
+    _rows["time"] = _time
+    _rows["T_sample"] = np.select([_time < 100., _time <= 110., _time < 120.],
+                                  [10., 10. + 1.1 * (_time - 100.), 21. - 0.1 * (_time - 110.)], 20.005)
+    _rows["P_heater"] = np.where(_time % 2 == 0, 40., 60.)
+    return _rows
+
+
+@pytest.mark.parametrize("block_size", [1024, 7])
+def test_loop_analyzer_metrics_of_a_step(block_size):
+    _analyzer = loop_analyzer(tolerance=0.01, block_size=block_size)
+    _rows = step_rows()
+    assert _analyzer.set_point(0., 10.) is None
+    for row in _rows[:100]:
+        _analyzer.add(row["time"], (row["T_sample"], row["T_tip"], row["P_heater"]))
+    _finished = _analyzer.set_point(100., 20.)
+    assert _finished[0] == 0. and _finished[1]["settling_time"] == 0. and np.isnan(_finished[1]["overshoot"])
+    for row in _rows[100:]:
+        _analyzer.add(row["time"], (row["T_sample"], row["T_tip"], row["P_heater"]))
+    _metrics = _analyzer.metrics()
+    assert _metrics["set_point"] == 20.
+    assert _metrics["settling_time"] == 20.
+    assert _metrics["overshoot"] == pytest.approx(10., abs=1e-3)
+    assert _metrics["steady_state_error"] == pytest.approx(0.005, abs=1e-5)
+    assert _metrics["power_noise"] == pytest.approx(10.)
+
+
+def test_loop_analyzer_merges_ramp_writes():
+    _analyzer = loop_analyzer(merge=60.)
+    _analyzer.set_point(0., 10.)
+    assert _analyzer.set_point(100., 15.) is not None
+    assert _analyzer.set_point(130., 20.) is None
+    assert _analyzer.step == {"start": 100., "previous": 10., "set_point": 20., "changed": 130.}
+    _analyzer.add_rows(step_rows()[120:])
+    # scored from the last change of the step on
+    assert _analyzer.metrics()["settling_time"] == 0.
+
+
+def simulate_fopdt(gain, time_constant, dead_time, inputs, dt=1., start=4.):
+    """exact discrete response of a first order plus dead time process to a piecewise constant input"""
+    _a = np.exp(-dt / time_constant)
+    _delay = int(round(dead_time / dt))
+    _inputs = np.concatenate([np.full(_delay, inputs[0]), inputs])
+    _temperature = np.empty(len(inputs))
+    _temperature[0] = start + gain * inputs[0]
+    for k in range(1, len(inputs)):
+        _temperature[k] = _a * _temperature[k - 1] + (1. - _a) * (start + gain * _inputs[k - 1])
+    return _temperature
+
+
+@pytest.mark.parametrize("gain, time_constant, dead_time", [(0.8, 40., 5.), (2.5, 120., 12.), (0.05, 15., 0.)])
+def test_identify_model_recovers_fopdt(gain, time_constant, dead_time):
+    _times = 1.7e9 + np.arange(600.)
+    _inputs = np.where(_times - _times[0] < 50., 10., 20.)
+    _temperature = simulate_fopdt(gain, time_constant, dead_time, _inputs)
+    _gain, _time_constant, _dead_time = identify_model(_times, _inputs, _temperature)
+    assert _gain == pytest.approx(gain, rel=1e-3)
+    assert _time_constant == pytest.approx(time_constant, rel=1e-3)
+    assert _dead_time == dead_time
+
+
+def test_identify_model_rejects_unexcited_loop():
+    _times = np.arange(100.)
+    with pytest.raises(AutotuneError):
+        identify_model(_times, np.full(100, 10.), np.full(100, 4.))
+    with pytest.raises(AutotuneError):
+        identify_model(_times[:5], np.arange(5.), np.arange(5.))
+
+
+def test_process_model_inverts_proportional_loop():
+    # process K = 0.1 K/%, tau = 100 s under P = 30 %/K: closed loop gain 0.75, time constant 25 s
+    assert process_model(0.75, 25., 3., 30.) == pytest.approx((0.1, 100., 3.))
+    with pytest.raises(AutotuneError):
+        process_model(1.2, 25., 3., 30.)
+
+
+def test_pid_from_model_simc():
+    # closed loop time max(5, 10) = 10 s: P = 100 / (0.5 * 15), integral time min(100, 60) s
+    assert pid_from_model(0.5, 100., 5.) == (13.3, 1., 0.)
+    assert pid_from_model(0.5, 100., 5., closed_loop_time=45.) == (4., 0.6, 0.)
+    # limited to PID_LIMITS
+    assert pid_from_model(1e-6, 100., 5.)[0] == PID_LIMITS[0][1]
+    assert pid_from_model(1e3, 1e4, 1.)[0] == PID_LIMITS[0][0]
@@ -0,0 +1,85 @@
+from time import monotonic
+import pytest
+from ls336.lib.acquisition import acquisition_worker
+from ls336.lib.recipe import RecipeError, parse_recipe, recipe_runner
+
+
+def test_parse_recipe_normalizes_steps():
+    _recipe = parse_recipe({"name": "cool", "steps": [{"setpoint": "4.2"}, {"ramp": {"to": 10, "rate": 0.5}},
+                                                      {"dwell": 60}, {"range": "lo"}, {"pid": [50, 20, 0]},
+                                                      {"stable": {"tolerance": 0.01, "duration": 300}}]})
+    assert _recipe["name"] == "cool"
+    assert _recipe["steps"] == [{"type": "setpoint", "value": 4.2}, {"type": "ramp", "to": 10., "rate": 0.5},
+                                {"type": "dwell", "duration": 60.}, {"type": "range", "value": "LO"},
+                                {"type": "pid", "value": (50., 20., 0.)},
+                                {"type": "stable", "tolerance": 0.01, "duration": 300., "timeout": None,
+                                 "channel": "sample"}]
+    assert parse_recipe([{"dwell": 1}])["name"] == "recipe"
+
+
+@pytest.mark.parametrize("data", [[], {"steps": []}, [{"ramp": {"to": 10}}], [{"ramp": {"to": 10, "rate": 0}}],
+                                  [{"dwell": "long"}], [{"range": "MAX"}], [{"pid": [1, 2]}],
+                                  [{"stable": {"tolerance": 0.1}}],
+                                  [{"stable": {"tolerance": 0.1, "duration": 1, "channel": "head"}}],
+                                  [{"heat": 1}], [{"dwell": 1, "setpoint": 4}]])
+def test_parse_recipe_rejects_invalid_steps(data):
+    with pytest.raises(RecipeError):
+        parse_recipe(data)
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """acquisition worker on the simulated controller, records the set points written with their time"""
+    monkeypatch.setenv("LS336_BACKEND", "sim")
+    monkeypatch.setenv("LS336_SIM_LATENCY", "0")
+    worker = acquisition_worker(1)
+    worker.writes = []
+    _write_setting = worker.write_setting
+
+    def _record(mode, value):
+        worker.writes.append((monotonic(), mode, value))
+        return _write_setting(mode, value)
+    worker.write_setting = _record
+    worker.start()
+    yield worker
+    worker.shutdown().result(10)
+
+
+def run(worker, steps, **options):
+    _states = []
+    runner = recipe_runner(worker, parse_recipe(steps), on_state=lambda *state: _states.append(state), **options)
+    _start = monotonic()
+    runner.start()
+    return runner, _states, _start
+
+
+def test_ramp_writes_on_a_fixed_schedule(worker):
+    runner, _states, _start = run(worker, [{"setpoint": 5}, {"ramp": {"to": 6, "rate": 60}}], ramp_interval=0.1)
+    runner.join(10)
+    assert _states[-1][1] == "done"
+    _ramp = [(time_stamp - _start, value) for time_stamp, mode, value in worker.writes[1:]]
+    assert [value for _, value in _ramp] == pytest.approx([5.1, 5.2, 5.3, 5.4, 5.5, 5.6, 5.7, 5.8, 5.9, 6.])
+    # writes at multiples of ramp_interval after the ramp started, not drifting
+    _offsets = [time_stamp - 0.1 * tick for tick, (time_stamp, _) in enumerate(_ramp, 1)]
+    assert max(_offsets) - min(_offsets) < 0.05
+    assert worker.instrument.get_setpoint == 6.
+
+
+def test_dwell_deadline_and_abort(worker):
+    runner, _states, _start = run(worker, [{"dwell": 0.3}, {"setpoint": 7}])
+    runner.join(10)
+    assert worker.writes[0][0] - _start == pytest.approx(0.3, abs=0.1)
+    runner, _states, _start = run(worker, [{"dwell": 30}, {"setpoint": 8}])
+    runner.abort()
+    runner.join(5)
+    assert not runner.is_alive() and _states[-1][1] == "aborted"
+    assert [value for _, _, value in worker.writes] == [7.]
+
+
+def test_stable_step_times_out(worker):
+    runner, _states, _start = run(worker, [{"setpoint": 50},
+                                           {"stable": {"tolerance": 0.01, "duration": 1, "timeout": 0.3}}],
+                                  check_interval=0.05)
+    runner.join(10)
+    assert [state for _, state, _ in _states] == ["running", "running", "timeout"]
+    assert monotonic() - _start < 2.
@@ -0,0 +1,37 @@
+import numpy as np
+from ls336.lib.ring_buffer import ring_buffer
+
+
+def test_wrap_around_keeps_latest_samples_in_order():
+    buffer = ring_buffer(5, 2)
+    for i in range(13):
+        buffer.append(float(i), (i, -i))
+    assert buffer.size == 5
+    np.testing.assert_array_equal(buffer.time, [8., 9., 10., 11., 12.])
+    np.testing.assert_array_equal(buffer.channel(0), [8., 9., 10., 11., 12.])
+    np.testing.assert_array_equal(buffer.channel(1), [-8., -9., -10., -11., -12.])
+    np.testing.assert_array_equal(buffer.latest(), [12., 12., -12.])
+
+
+def test_views_do_not_copy():
+    buffer = ring_buffer(4, 1)
+    for i in range(6):
+        buffer.append(float(i), (i,))
+    assert np.shares_memory(buffer.time, buffer._data)
+    assert np.shares_memory(buffer.channel(0), buffer._data)
+
+
+def test_retention_hides_old_samples():
+    buffer = ring_buffer(100, 1, retention=10.)
+    for i in range(30):
+        buffer.append(float(i), (i,))
+    assert buffer.size == 30
+    np.testing.assert_array_equal(buffer.time, np.arange(19., 30.))
+
+
+def test_clear():
+    buffer = ring_buffer(3, 1)
+    buffer.append(1., (1.,))
+    buffer.clear()
+    assert buffer.size == 0
+    assert len(buffer.time) == 0
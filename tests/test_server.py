@@ -0,0 +1,85 @@
+import socket
+import threading
+import pytest
+from ls336.lib.acquisition import acquisition_worker
+from ls336.lib.server import ServerError, instrument_client, instrument_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def served(monkeypatch):
+    """acquisition worker on the simulated controller shared by a server, yields (server, worker, reads)"""
+    monkeypatch.setenv("LS336_BACKEND", "sim")
+    monkeypatch.setenv("LS336_SIM_LATENCY", "0.05")
+    _server = []
+    worker = acquisition_worker(1, on_sample=lambda snapshot: _server[0].publish_sample("ls336", snapshot),
+                                on_setting=lambda mode, value: _server[0].publish_setting("ls336", mode, value))
+    # setting reads reaching the worker
+    reads = []
+    _read_setting = worker.read_setting
+    worker.read_setting = lambda mode: reads.append(mode) or _read_setting(mode)
+    server = instrument_server({"ls336": worker}, free_port(), setting_max_age=0.)
+    _server.append(server)
+    worker.start()
+    server.start()
+    yield server, worker, reads
+    server.stop()
+    worker.shutdown().result(10)
+
+
+def test_snapshot_and_settings(served):
+    server, worker, reads = served
+    with instrument_client(server.port) as client:
+        with pytest.raises(ServerError):
+            client.snapshot()
+        _snapshot = worker.acquire().result(10)
+        assert client.snapshot() == _snapshot
+        assert client.command("SETP 12.5") == "12.5"
+        assert client.command("PID 40,10,0") == "40.0,10.0,0.0"
+        assert client.command("RANGE LO") == "LOW"
+        assert client.command("DEVICES?") == "ls336"
+        with pytest.raises(ServerError):
+            client.command("@cryo9 SETP?")
+        with pytest.raises(ServerError):
+            client.command("PID 1,2")
+
+
+def test_concurrent_setting_queries_share_one_read(served):
+    server, worker, reads = served
+    _answers = []
+    _barrier = threading.Barrier(8)
+
+    def _query():
+        with instrument_client(server.port) as client:
+            _barrier.wait()
+            _answers.append(client.command("SETP?"))
+    _threads = [threading.Thread(target=_query) for _ in range(8)]
+    for thread in _threads:
+        thread.start()
+    for thread in _threads:
+        thread.join(10)
+    assert len(_answers) == 8 and len(set(_answers)) == 1
+    assert len(reads) < 8
+
+
+def test_cached_settings_need_no_read(served):
+    server, worker, reads = served
+    server.setting_max_age = 60.
+    with instrument_client(server.port) as client:
+        client.command("SETP 11")
+        assert client.command("SETP?") == "11.0"
+    assert reads == []
+
+
+def test_subscription_streams_readings(served):
+    server, worker, reads = served
+    with instrument_client(server.port) as client:
+        _readings = client.readings()
+        client.command("SUB")
+        _snapshots = [worker.acquire().result(10) for _ in range(3)]
+        assert [next(_readings) for _ in range(3)] == _snapshots